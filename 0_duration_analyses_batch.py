@@ -4,13 +4,22 @@ Created on Oct 5, 2022
 Batch Run of Duration Analyses  (v1)
 @author: tclarkin (USBR 2022)
 
-...add description...
+This script runs the duration analyses (scripts 1a, 1b, 2a, 2b, 4 and 5) for all sites in a single process. Each
+stage is called from src/stage_functions.py and results (daily data, peaks, durations) are passed in memory to the
+following stages; outputs are still saved as when the scripts are run individually.
 
 """
 import os
-import shutil
-import subprocess
-from src.functions import getsites,createclone
+import matplotlib
+matplotlib.use("Agg") # non-interactive backend; figures are only saved in batch mode
+from src.functions import getsites
+from src.stage_functions import stage_1a,stage_1b,stage_2a,stage_2b,stage_4,stage_5
+from src.batch_functions import stage_key,get_key,source_files,run_cached,run_sites,run_stage_4,run_pipeline
+from src.batch_functions import run_once
+from src.plan_functions import plan_daily,plan_1a,plan_1b,plan_2a,plan_2b,plan_4,plan_5,plan_report
+from src.profile_functions import start_profile,stop_profile,profile_report
+from src.engine_functions import set_engines
+from src.render_functions import set_render
 
 ### User Input ###
 #os.chdir("")
@@ -18,6 +27,54 @@ from src.functions import getsites,createclone
 # Input data file
 wy_division = "WY" # "WY" or "CY"
 
+# Skip stages whose inputs (data, settings and code) are unchanged since the last run
+cache = True # Boolean
+force = [] # list of stages to rerun regardless of cache (e.g., ["1a"])
+
+# Number of processes for per-site stages (1 runs all sites in this process)
+workers = 1
+
+# Record the completion of each site and stage; resume continues from the first incomplete site of a failed run
+journal = None # journal file (e.g., "cache/journal.jsonl") or None
+resume = True # Boolean
+
+# Import sites in background threads and analyze each site (1a, 1b, 2a, 4 and 5) as soon as its data are imported,
+# rather than importing all sites before any analysis (2b and the script 4 concatenation tables follow all sites)
+pipeline = False # Boolean
+downloads = 4 # number of download threads
+queue_size = 2 # max. number of imported sites waiting for analysis (limits memory)
+
+# Work queue shared by several batch processes (e.g., on machines sharing this folder): sites and cross-site stages are
+# claimed with lock files, so start this script in each process with the same settings (pipeline is not used)
+queue_dir = None # work queue directory (e.g., "cache/queue") or None
+stale = 600 # seconds without an update before a claimed unit is reclaimed (e.g., process or machine stopped)
+
+# Dry run: only report the number of figures and files, disk space and run time of each stage (nothing is run or saved;
+# sites without data yet are planned with default years of record), and save the plan to cache/dry_run_plan.csv
+dry_run = False # Boolean
+
+# Record the wall time and calls of the hot functions (imports, duration analyses, events, routing, savefig) for each
+# stage and site, and save a run report to cache/profile (run_report_{run}.json)
+profile = False # Boolean
+profile_memory = False # Boolean, also record the peak memory of each stage and site (slower)
+profile_stats = False # Boolean, also save cProfile statistics for each stage (.pstats, e.g., for snakeviz)
+
+# Engine of each analysis kernel (kernels not listed use the reference engine), e.g.,
+# {"durtable":"single_sort","evs":"numpy","doy_data":"numpy"} (volumes use "multi" unless set to "reference"); check
+# engines with benchmarks/engine_check.py first
+engines = {}
+
+# Processes drawing the per-year and per-event figures (script 4 WY plots, script 3 event and CVHS plots) while the
+# analysis continues (0 draws them in the analysis process; with workers, each site process has its own)
+render_workers = 0
+# Update the artists of the WY and CVHS hydrograph figures between years and events instead of drawing each figure
+render_reuse = False
+# Output of the per-year and per-event figures: "files" (one .jpg each), "pdf" (one multi-page .pdf per site and plot
+# family) or "sheet" (one contact sheet .jpg per site and plot family), each with an _index.csv; thumbnails adds small
+# .jpg copies in a thumbs folder
+render_output = "files"
+render_thumbnails = False
+
 ## Script 1a Settings
 script1a = True
 script1a_input_file = ["13042500","13040000","13041000","13041010",["isli","qu","cpn"]] # single file with columns for each site OR list of USGS gages and/or site names
@@ -53,7 +110,7 @@ script3 = False
 script4 = True
 script4_dict = {"seasonal":False, # Boolean
                "durations":["peak",1,3,5,7,15], # Duration in days ("peak" can also be included), single list OR dict based on seasons
-               "plot":True,  # Will plot each WY with all durations
+               "plot_wy":True,  # Will plot each WY with all durations
                "concat":True} # Create concat table of all durations and locations
 
 ## Script 5 Settings
@@ -67,118 +124,155 @@ script5_dict = {"seasonal":True,   # Boolean
                 }
 
 ### BEGIN SCRIPT ###
-# Second, begin running scripts by creating clones of each and overwriting information in the header
-# Script 1a:
-# Identify sites and site_sources
-sites, site_sources = getsites(script1a_input_file)
-
-if script1a:
-    # Add sites and site_sources to script1a_dict
-    script1a_dict["sites"] = sites
-    script1a_dict["site_sources"] = site_sources
-    script1a_dict["wy_division"] = wy_division
-
-    # Clone script
-    clone1a = createclone("1a_daily_data_prep.py",script1a_dict)
-
-    # Run clone
-    subprocess.call(["python",clone1a],cwd=os.getcwd())
-    shutil.move(clone1a,f"clones/{clone1a.split('/')[-1]}")
-
-# Script 1b
-if script1b:
+# Guard needed so that worker processes do not rerun the batch
+if __name__ == "__main__":
+    # Run each stage in this process, passing results in memory
+    # Each stage is skipped if its inputs and the data written by upstream stages (1a -> 1b -> 2a/2b/4 -> 5) are unchanged
+    # Per-site stages (1a, 1b, 2a, 4 and 5) are run over a pool of workers; cross-site stages (2b and the script 4
+    # concatenation tables) wait for all sites
+    # Completed sites are recorded in the journal; if a site fails, the others continue and the run stops before the
+    # cross-site stages (rerun to resume)
+    # If pipelined, sites are imported in background threads and the per-site stages of each site start as soon as its
+    # data are imported (cached and journaled as a single "pipeline" stage)
+    # With a work queue, each process runs the sites it claims, then waits for the other processes before the next
+    # stage (in-memory results are only passed for its own sites; others are read from their files)
+    # A dry run plans the outputs of each stage and stops before running any stage
+    set_engines(engines)
+    set_render(render_workers,reuse=render_reuse,output=render_output,thumbnails=render_thumbnails)
+
+    # Script 1a:
     # Identify sites and site_sources
-    peak_sites,peak_site_sources = getsites(script1b_input_file)
-
-    # Compare lists:
-    if peak_sites != sites:
-        print("Peak Sites and Daily Sites are not the same...")
-        if len(peak_sites) == len(sites):
-            print("Lists have same length; script will continue using daily data site names.")
-            peak_sites_sel = sites
+    sites, site_sources = getsites(script1a_input_file)
+    daily = None
+    peaks = None
+    flow = None
+    voldur = None
+    concat_dirs = ["flow_comparison","volume_concat"]
+
+    # Script 1b sites
+    if script1b:
+        # Identify sites and site_sources
+        peak_sites,peak_site_sources = getsites(script1b_input_file)
+
+        # Compare lists:
+        if peak_sites != sites:
+            print("Peak Sites and Daily Sites are not the same...")
+            if len(peak_sites) == len(sites):
+                print("Lists have same length; script will continue using daily data site names.")
+                peak_sites_sel = sites
+            else:
+                print("Lists have different lengths; script will continue using peak data site names.")
+                peak_sites_sel = peak_sites
         else:
-            print("Lists have different lengths; script will continue using peak data site names.")
             peak_sites_sel = peak_sites
-    else:
-        peak_sites_sel = peak_sites
-
-    # Add sites, site_sources, wy_division, and seasons to script1b_dict
-    script1b_dict = dict()
-    script1b_dict["sites"] = peak_sites_sel
-    script1b_dict["site_sources"] = peak_site_sources
-    script1b_dict["wy_division"] = wy_division
-    script1b_dict["seasons"] = script1a_dict["seasons"]
-
-    # Clone script
-    clone1b = createclone("1b_peak_data_prep.py",script1b_dict)
-
-    # Run clone
-    subprocess.call(["python",clone1b])
-    shutil.move(clone1b,f"clones/{clone1b.split('/')[-1]}")
-
-# Script 2a
-if script2a:
-    # Add sites, wy_division, and seasons to script2a_dict
-    script2a_dict["sites"] = sites
-    script2a_dict["wy_division"] = wy_division
-    script2a_dict["decimal"] = script1a_dict["decimal"]
-    if isinstance(script1a_dict["seasons"],bool)==False:
-        if all(script1a_dict["seasons"]):
-            script2a_dict["seasons"] = list(script1a_dict["seasons"].keys())
-    else:
-        script2a_dict["seasons"] = [None]
-
-    # Clone script
-    clone2a = createclone("2a_flow_duration_analysis.py",script2a_dict)
-
-    # Run clone
-    subprocess.call(["python",clone2a])
-    shutil.move(clone2a,f"clones/{clone2a.split('/')[-1]}")
-
-# Script 2b
-if script2b:
-    # Add sites and labels (sites) to script2b_dict
-    script2b_dict["sites"] = sites
-    script2b_dict["labels"] = sites
-
-    # Clone script
-    clone2b = createclone("2b_flow_duration_multiplot.py", script2b_dict)
-
-    # Run clone
-    subprocess.call(["python", clone2b])
-    shutil.move(clone2b,f"clones/{clone2b.split('/')[-1]}")
-
-# Script 3
-if script3:
-    print("Script 3 not setup to run in batch. Skipping...")
 
-# Script 4
-if script4:
-    # Add sites, wy_division, and seasons to script4_dict
-    script4_dict["sites"] = sites
-    script4_dict["wy_division"] = wy_division
-    script4_dict["decimal"] = script1a_dict["decimal"]
-
-    # Clone script
-    clone4 = createclone("4_volume_duration_analysis.py", script4_dict)
-
-    # Run clone
-    subprocess.call(["python", clone4])
-    shutil.move(clone4,f"clones/{clone4.split('/')[-1]}")
-
-# Script 5
-if script5:
-    # Add sites, wy_division, durations, and seasons to script4_dict
-    script5_dict["sites"] = sites
-    script5_dict["wy_division"] = wy_division
-    script5_dict["decimal"] = script1a_dict["decimal"]
-
-    # Clone script
-    clone5 = createclone("5_multiplot.py", script5_dict)
-
-    # Run clone
-    subprocess.call(["python", clone5])
-    shutil.move(clone5,f"clones/{clone5.split('/')[-1]}")
-
-
-print("Script 0 Complete")
\ No newline at end of file
+    if dry_run:
+        # Plan every selected stage (the cache, journal and work queue are not checked)
+        seasons = script1a_dict.get("seasons",False)
+        daily = plan_daily(sites,site_sources,wy_division,script1a_dict.get("decimal",2),script1a_dict.get("zero",False))
+        peak_plan = dict()
+        plans = list()
+        if script1a:
+            plans.append(plan_1a(sites,site_sources,wy_division,daily=daily,**script1a_dict))
+        if script1b:
+            plans.append(plan_1b(peak_sites_sel,peak_site_sources,seasons,daily))
+            peak_plan = {site:{"":None} for site,source in zip(peak_sites_sel,peak_site_sources) if source is not None}
+        if script2a:
+            plans.append(plan_2a(sites,wy_division=wy_division,daily=daily,seasons=seasons,**script2a_dict))
+        if script2b:
+            plans.append(plan_2b(sites,daily=daily,**script2b_dict))
+        if script4:
+            plans.append(plan_4(sites,wy_division=wy_division,daily=daily,peaks=peak_plan,seasons=seasons,**script4_dict))
+        if script5:
+            plans.append(plan_5(sites,wy_division=wy_division,peaks=peak_plan,daily=daily,seasons=seasons,
+                                durations=script4_dict["durations"] if script4 else None,**script5_dict))
+        plan_report(plans,outfile="cache/dry_run_plan.csv")
+        print("Script 0 Dry Run Complete")
+        quit()
+
+    if profile:
+        start_profile("cache/profile",profile_memory,profile_stats)
+
+    pipelined = pipeline and script1a and queue_dir is None
+    if pipelined:
+        # Scripts 1a, 1b, 2a, 4 and 5 for each site as soon as its data are imported
+        settings = {"1a":{"wy_division":wy_division,**script1a_dict}}
+        peak_sources = [None]*len(sites)
+        if script1b:
+            settings["1b"] = {"seasons":script1a_dict["seasons"]}
+            peak_sources = [dict(zip(peak_sites_sel,peak_site_sources)).get(site) for site in sites]
+        if script2a:
+            settings["2a"] = {"wy_division":wy_division,**script2a_dict}
+        if script4:
+            settings["4"] = {"wy_division":wy_division,**script4_dict}
+        if script5:
+            settings["5"] = {"wy_division":wy_division,**script5_dict}
+
+        keyp = stage_key("pipeline",{"sites":sites,"site_sources":site_sources,"peak_sources":peak_sources,
+                                     "settings":settings},files=source_files(site_sources+peak_sources))
+        results = run_cached("pipeline",keyp,sites+concat_dirs,run_pipeline,sites,site_sources,peak_sources,settings,
+                             downloads=downloads,queue_size=queue_size,workers=workers,
+                             cache=cache and "pipeline" not in force,journal=journal,
+                             resume=resume and "pipeline" not in force)
+        if results is not None:
+            daily,peaks,flow,voldur = [results[k] for k in ["daily","peaks","flow","voldur"]]
+        key1a = key2a = get_key("pipeline")
+    else:
+        key1a = stage_key("1a",{"sites":sites,"site_sources":site_sources,"wy_division":wy_division,**script1a_dict},
+                          files=source_files(site_sources))
+        if script1a:
+            daily = run_cached("1a",key1a,sites,run_sites,stage_1a,sites,site_sources,wy_division=wy_division,
+                               workers=workers,cache=cache and "1a" not in force,journal=journal,
+                               resume=resume and "1a" not in force,queue=queue_dir,stale=stale,
+                               **script1a_dict)
+        key1a = get_key("1a")
+
+        # Script 1b
+        if script1b:
+            key1b = stage_key("1b",{"sites":peak_sites_sel,"site_sources":peak_site_sources,
+                                    "seasons":script1a_dict["seasons"]},[key1a],source_files(peak_site_sources))
+            peaks = run_cached("1b",key1b,peak_sites_sel,run_sites,stage_1b,peak_sites_sel,peak_site_sources,
+                               seasons=script1a_dict["seasons"],daily=daily,workers=workers,
+                               cache=cache and "1b" not in force,journal=journal,resume=resume and "1b" not in force,
+                               queue=queue_dir,stale=stale)
+        key1b = get_key("1b")
+
+        # Script 2a
+        if script2a:
+            key2a = stage_key("2a",{"sites":sites,"wy_division":wy_division,**script2a_dict},[key1a])
+            flow = run_cached("2a",key2a,sites,run_sites,stage_2a,sites,wy_division=wy_division,daily=daily,
+                              workers=workers,cache=cache and "2a" not in force,journal=journal,
+                              resume=resume and "2a" not in force,queue=queue_dir,stale=stale,**script2a_dict)
+        key2a = get_key("2a")
+
+    # Script 2b (all sites)
+    if script2b:
+        key2b = stage_key("2b",{"sites":sites,"wy_division":wy_division,**script2b_dict},[key1a,key2a])
+        run_cached("2b",key2b,concat_dirs,run_once,stage_2b,sites,labels=sites,wy_division=wy_division,daily=daily,
+                   flow=flow,cache=cache and "2b" not in force,queue=queue_dir,stale=stale,**script2b_dict)
+
+    # Script 3
+    if script3:
+        print("Script 3 not setup to run in batch. Skipping...")
+
+    if not pipelined:
+        # Script 4 (concatenation tables after all sites)
+        if script4:
+            key4 = stage_key("4",{"sites":sites,"wy_division":wy_division,**script4_dict},[key1a,key1b])
+            voldur = run_cached("4",key4,sites+concat_dirs,run_stage_4,sites,wy_division=wy_division,daily=daily,
+                                peaks=peaks,workers=workers,cache=cache and "4" not in force,journal=journal,
+                                resume=resume and "4" not in force,queue=queue_dir,stale=stale,**script4_dict)
+        key4 = get_key("4")
+
+        # Script 5
+        if script5:
+            key5 = stage_key("5",{"sites":sites,"wy_division":wy_division,**script5_dict},[key1b,key4])
+            run_cached("5",key5,sites,run_sites,stage_5,sites,wy_division=wy_division,voldur=voldur,peaks=peaks,
+                       workers=workers,cache=cache and "5" not in force,journal=journal,
+                       resume=resume and "5" not in force,queue=queue_dir,stale=stale,**script5_dict)
+
+    if profile:
+        stop_profile()
+        profile_report("cache/profile")
+
+    print("Script 0 Complete")
\ No newline at end of file
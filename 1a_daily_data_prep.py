@@ -19,12 +19,11 @@ Alternatively, it can handle daily data from online sources:
 
 Seasons are either False (use entire year) or specified using a dictionary:
  - months {"name":[months],etc.}, or
- - start,stop {"name":[doy,doy]}
+ - start,stop {"name":[doy,doy]} (start > stop wraps the end of the year, e.g., [305,59])
 
 """
-import matplotlib.pyplot as plt
-from src.functions import check_dir,simple_plot,get_varlabel,save_seasons
-from src.data_functions import import_daily,season_subset,summarize_daily
+from src.stage_functions import stage_1a
+from src.plan_functions import plan_report
 
 ### User Input ###
 #os.chdir("")
@@ -41,38 +40,14 @@ zero = False # "average" # False, minimum flow value, or "average" (to handle ne
 # Optional seasonal selection
 # Dictionary of seasons by months {"name":[months],etc.}, start/stop {"name":[start,stop]}, OR False
 seasons = False #{"const":[6,7,8,9,10]}
+season_files = True # Boolean, write NaN-masked daily data for each season (used by 1b, 2b, 3; 2a and 4 only need site_daily)
 
-### Begin Script ###
-for site,site_source in zip(sites,site_sources):
-    print(f"Importing daily data for {site}...")
-    # Check directories
-    outdir = check_dir(site,"data")
-
-    # Load, plot, and save at-site data
-    site_daily = import_daily(site_source,wy_division,decimal,zero)
-    site_summary = summarize_daily(site_daily)
-    simple_plot(site_daily,"Site Daily")
-    site_daily.to_csv(f"{outdir}/{site}_site_daily.csv")
-    print(f"Site data saved to {outdir}/{site}_site_daily.csv")
-    site_summary.to_csv(f"{outdir}/{site}_site_summary.csv")
-    print(f"Site summary saved to {outdir}/{site}_site_summary.csv")
-
-    # Subset by season, if selected
-    if isinstance(seasons,bool)==False:
-        if all(seasons):
-            var = site_daily.columns[0]
-            # Subset, plot, and save seasonal data
-            for s in seasons.keys():
-                season_daily = season_subset(site_daily,seasons[s],var)
-                plt.plot(season_daily.index, season_daily[var], linestyle="dashed", label=f"{s}")
-                season_daily.to_csv(f"{outdir}/{site}_{s}_site_daily.csv")
-                print(f"Seasonal data saved to {outdir}/{site}_{s}_site_daily.csv")
+# Dry run: only report the number of figures and files, disk space and run time (nothing is run or saved)
+dry_run = False # Boolean
 
-    # Save list of seasons
-    save_seasons(site,seasons)
-
-    # Complete and save plot
-    plt.legend()
-    plt.savefig(f"{outdir}/{site}_site_daily.jpg",bbox_inches='tight',dpi=600)
+### Begin Script ###
+site_daily = stage_1a(sites,site_sources,wy_division,decimal,zero,seasons,season_files,dry_run=dry_run)
+if dry_run:
+    plan_report(site_daily)
 
 print("Script 1a Complete")
\ No newline at end of file
@@ -14,11 +14,8 @@ date: (dd-mmm-yyyy)
 peak: no commas
 
 """
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
-from src.data_functions import import_peaks,season_subset,nwis_import
-from src.functions import check_dir,simple_plot,save_seasons
+from src.stage_functions import stage_1b
+from src.plan_functions import plan_report
 
 ### User Input ###
 #os.chdir("")
@@ -32,76 +29,12 @@ site_sources = ["08205500","08207000","08206600","08206700"] # .csv file or othe
 # Dictionary of seasons by months {"name":[months],etc.}, start/stop {"name":[start,stop]}, OR False
 seasons = False#{"spring":[3,4,5,6]}
 
-### Begin Script ###
-for site,site_source in zip(sites,site_sources):
-    print(f"Importing peak data for {site}...")
-    if site_source is None:
-        continue
-    outdir = check_dir(site,"data")
-
-    # Load, plot, and save at-site data
-    site_peaks,var = import_peaks(site_source)
-    site_peaks.dropna(inplace=True)
-    simple_plot(site_peaks,"Site Peaks",marker="o")
-    plt.legend()
-    plt.savefig(f"{outdir}/{site}_site_peak.jpg",bbox_inches='tight',dpi=300)
-
-    # Find daily max to match peak
-    data = pd.read_csv(f"{outdir}/{site}_site_daily.csv", parse_dates=True, index_col=0)
-    dvar = data.columns[0]
-    if data.wy.max() > site_peaks.index.max():
-        for wy in range(int(site_peaks.index.max()+1),data.wy.max()):
-            site_peaks.loc[wy,:] = [np.nan]*len(site_peaks.columns)
-
-    for wy in site_peaks.index:
-        peak_date = pd.to_datetime(site_peaks.loc[wy,"date"])
-        if (peak_date>=data.index.min()) and (peak_date<=data.index.max()):
-            site_peaks.loc[wy,"daily_flow"] = data.loc[peak_date,dvar]
-
-    site_peaks.to_csv(f"{outdir}/{site}_site_peak.csv")
-    print(f"Site data saved to {outdir}/{site}_site_peak.csv")
+# Dry run: only report the number of figures and files, disk space and run time (nothing is run or saved)
+dry_run = False # Boolean
 
-    if isinstance(seasons,bool)==False:
-        if all(seasons):
-            # Subset, plot, and save seasonal data
-            for s in seasons.keys():
-                season_peaks = season_subset(site_peaks,seasons[s],var)
-
-                # Find other peaks (if available)
-                data = pd.read_csv(f"{outdir}/{site}_{s}_site_daily.csv", parse_dates=True, index_col=0)
-                dvar = data.columns[0]
-
-                for wy in season_peaks.loc[pd.isna(season_peaks.peak)].index:
-                    if wy not in data.wy.unique():
-                        continue
-                    daily_date = data.loc[data["wy"] == wy, dvar].idxmax()
-                    if pd.isna(daily_date):
-                        continue
-                    daily_flow = data.loc[daily_date, dvar].item()
-                    season_peaks.loc[wy,"date"] = daily_date
-                    season_peaks.loc[wy,"daily_flow"] = daily_flow
-                    if wy>=1990:
-                        try:
-                            inst_flow = nwis_import(site,"iv",f"{wy-1}-10-01",f"{wy}-09-30")
-                        except ValueError:
-                            continue
-                        if inst_flow.empty:
-                            continue
-                        season_inst = season_subset(inst_flow,seasons[s],dvar)
-                        inst_date = season_inst.flow.idxmax()
-                        if pd.isna(inst_date):
-                            continue
-                        season_peaks.loc[wy,"peak"] = season_inst.loc[inst_date,dvar]
-                        season_peaks.loc[wy, "date"] = inst_date
-                        season_peaks.loc[wy, "daily_flow"] = data.loc[pd.to_datetime(inst_date.date()), dvar].item()
-
-                simple_plot(season_peaks, f"{s} Peaks", marker="o")
-                season_peaks.to_csv(f"{outdir}/{site}_{s}_site_peak.csv")
-                print(f"Seasonal data saved to {outdir}/{site}_{s}_site_peak.csv")
-                plt.legend()
-                plt.savefig(f"{outdir}/{site}_{s}_site_peak.jpg", bbox_inches='tight', dpi=300)
-
-    # Save list of seasons
-    save_seasons(site, seasons)
+### Begin Script ###
+site_peaks = stage_1b(sites,site_sources,seasons,dry_run=dry_run)
+if dry_run:
+    plan_report(site_peaks)
 
 print("Script 1b Complete")
\ No newline at end of file
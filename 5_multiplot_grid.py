@@ -16,6 +16,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from src.functions import check_dir,get_seasons,get_list
 from src.plot_functions import plot_trendsshifts,plot_normality,plot_voldurpp,plot_voldurpdf,plot_voldurmonth,mannwhitney
+from src.render_functions import figure_context
 from statsmodels.graphics import tsaplots
 
 ### Begin User Input ###
@@ -158,42 +159,42 @@ for site in sites:
                 print(f'{dur}...')
 
                 # Check for trends and shifts
-                plot_trendsshifts(evs,dur,var)
-                plt.savefig(f"{outdir}/{site}{s}_{dur}_trends&shifts_plot.jpg", bbox_inches="tight", dpi=600)
+                with figure_context(f"{outdir}/{site}{s}_{dur}_trends&shifts_plot.jpg",dpi=600):
+                    plot_trendsshifts(evs,dur,var)
 
                 # Check for mann whitney
-                mannwhitney(evs,dur,var)
-                plt.savefig(f"{outdir}/{site}{s}_{dur}_mannwhitney_plot.jpg", bbox_inches="tight", dpi=600)
+                with figure_context(f"{outdir}/{site}{s}_{dur}_mannwhitney_plot.jpg",dpi=600):
+                    mannwhitney(evs,dur,var)
 
                 # TODO count change points AND add trends and shifts around confirmed change points...
 
                 # Check for autocorrelation
                 if len(evs.index) < 20:
                     continue
-                fig = tsaplots.plot_acf(evs[var], lags=20)
-                fig.set_size_inches(6.25, 4)
-                plt.ylabel("Autocorrelation")
-                plt.xlabel("Lag K, in years")
-                plt.savefig(f"{outdir}/{site}{s}_{dur}_acf_plot.jpg", bbox_inches="tight", dpi=600)
+                with figure_context(f"{outdir}/{site}{s}_{dur}_acf_plot.jpg",dpi=600):
+                    fig = tsaplots.plot_acf(evs[var], lags=20)
+                    fig.set_size_inches(6.25, 4)
+                    plt.ylabel("Autocorrelation")
+                    plt.xlabel("Lag K, in years")
 
                 # Check for normality
-                plot_normality(evs,dur,var)
-                plt.savefig(f"{outdir}/{site}{s}_{dur}_normality_plot.jpg", bbox_inches="tight", dpi=600)
+                with figure_context(f"{outdir}/{site}{s}_{dur}_normality_plot.jpg",dpi=600):
+                    plot_normality(evs,dur,var)
 
         if ppplot:
             print("Plotting with plotting positions")
-            plot_voldurpp(site,site_dur,durations_sel,alpha=0)
-            plt.savefig(f"{outdir}/{site}{s}_pp_plot.jpg", bbox_inches="tight", dpi=600)
+            with figure_context(f"{outdir}/{site}{s}_pp_plot.jpg",dpi=600):
+                plot_voldurpp(site,site_dur,durations_sel,alpha=0)
 
         if pdfplot:
             print("Plotting with probability density function")
-            plot_voldurpdf(site_dur,durations_sel)
-            plt.savefig(f"{outdir}/{site}{s}_pdf_plot.jpg", bbox_inches="tight", dpi=600)
+            with figure_context(f"{outdir}/{site}{s}_pdf_plot.jpg",dpi=600):
+                plot_voldurpdf(site_dur,durations_sel)
 
         if monthplot:
             print("Plotting with monthly distributions")
             for stat in ["count","mean","max"]:
-                plot_voldurmonth(site_dur,durations_sel,stat,eventdate,wy_division)
-                plt.savefig(f"{outdir}/{site}{s}_{eventdate}_month_{stat}_plot.jpg", bbox_inches="tight", dpi=600)
+                with figure_context(f"{outdir}/{site}{s}_{eventdate}_month_{stat}_plot.jpg",dpi=600):
+                    plot_voldurmonth(site_dur,durations_sel,stat,eventdate,wy_division)
 
 print("Script 5 Complete")
\ No newline at end of file
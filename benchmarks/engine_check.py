@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19, 2026
+Engine Check
+@author: tclarkin (USBR 2022)
+
+This script runs the reference and alternative engines of the analysis kernels (durtable, evs, doy_data and volumes;
+see src/engine_functions.py) on synthetic records and on real sample records, and compares every output table within
+tolerance (see compare_engines() in src/equivalence_functions.py). Run it before selecting an engine for production
+runs (engines option of the batch) and after changing a kernel; it exits with an error if any table differs.
+
+Run from the repository folder: python benchmarks/engine_check.py
+
+"""
+import os
+import sys
+import matplotlib
+matplotlib.use("Agg")
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.equivalence_functions import golden_records,compare_engines
+
+### Begin User Input ###
+kernels = None # list of kernels to compare (all if None)
+engines = None # dict of engines to compare for each kernel (e.g., {"evs":["numpy"]}), all registered if None
+record_lengths = [5,30,100] # years of synthetic records
+missing = [0.0,0.05] # missing-data rates of synthetic records
+seed = 0 # random seed of synthetic records
+# Real sample records: site_daily files from script 1a (e.g., "SITE/data/SITE_site_daily.csv") or site sources
+site_sources = []
+wy_division = "WY" # "WY" or "CY" (for site sources)
+rtol = 1e-9 # relative tolerance
+atol = 1e-9 # absolute tolerance
+golden_dir = None # directory of saved reference tables (e.g., "cache/golden"), or None to run the reference engine
+outdir = None # directory for tables that differ (e.g., "cache/engine_check"), or None
+outfile = None # comparison of every table (e.g., "cache/engine_check.csv"), or None
+
+### Begin Script ###
+records = golden_records(record_lengths,missing,seed,site_sources,wy_division)
+report = compare_engines(records,kernels,engines,rtol,atol,golden_dir,outdir)
+if outfile is not None:
+    report.to_csv(outfile,index=False)
+    print(f"Comparison saved to {outfile}")
+if len(report)>0 and not report["match"].all():
+    sys.exit("Engine Check Failed")
+print("Engine Check Complete")
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19, 2026
+Ingestion Benchmark
+@author: tclarkin (USBR 2022)
+
+This script times the download and import of site data (import_daily() and import_peaks() for NWIS, SNOTEL and the
+three Hydromet regions) against the local mock services (see src/mock_functions.py), for each latency, payload size
+(years of record) and number of concurrent downloads. It runs offline. Results are saved as .json; if a previous
+result is given (compare), the ratio of the times is reported for each case.
+
+Run from the repository folder: python benchmarks/ingestion_benchmark.py [cache/ingestion_benchmark.json]
+
+"""
+import os
+import sys
+import json
+import time
+import platform
+import warnings
+import subprocess
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.data_functions import import_daily,import_peaks
+from src.mock_functions import start_mock_server,stop_mock_server,reset_mock_stats
+
+### Begin User Input ###
+sites = 8 # number of sites of each source
+sources = ["nwis","peaks","snotel","cpn","mbart","ucb"] # sources to import
+latencies = [0,0.2] # delay before each response (s)
+payload_years = [10,50] # years of record of each response
+workers = [1,4,8] # concurrent downloads
+repeats = 3 # runs of each case (median is reported)
+error_rate = 0 # fraction of requests that fail (failures are counted)
+bandwidth = None # transfer rate of responses (bytes/s) or None
+fixture_dir = None # replay fixtures from this directory (see start_mock_server()) or None
+outfile = None # output file (e.g., "cache/ingestion_benchmark.json") or None; also given as the first argument
+compare = None # previous output (.json) to compare with, or None
+threshold = 1.2 # ratio reported as slower (or 1/threshold as faster)
+
+### Begin Script ###
+if len(sys.argv) > 1:
+    outfile = sys.argv[1]
+warnings.filterwarnings("ignore")
+snotel_sites = pd.read_csv("src/snotel_sites.csv")
+
+def site_sources(source,n):
+    """
+    Site sources (as for the site_source input of the scripts) of n sites
+    """
+    if source in ["nwis","peaks"]:
+        return [f"{9380000+i:08d}" for i in range(n)]
+    elif source == "snotel":
+        return [[str(s),"WTEQ","SNTL"] for s in snotel_sites["site_no"].iloc[:n]]
+    var = {"cpn":"qd","mbart":"QD","ucb":"qd"}[source]
+    return [[f"S{i:03d}",var,source] for i in range(n)]
+
+def load(source,site_source):
+    if source == "peaks":
+        return import_peaks(site_source)[0]
+    return import_daily(site_source,"WY",1)
+
+def run_case(jobs,n_workers):
+    """
+    Import all jobs with n_workers concurrent downloads
+    :return: float, int: wall time and failed imports
+    """
+    def attempt(job):
+        try:
+            load(*job)
+            return 0
+        except Exception:
+            return 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_workers) as pool:
+        failed = sum(pool.map(attempt,jobs))
+    return time.perf_counter()-start,failed
+
+def quiet(func,*args):
+    # The import functions print for each site
+    with open(os.devnull,"w") as devnull:
+        stdout,sys.stdout = sys.stdout,devnull
+        try:
+            return func(*args)
+        finally:
+            sys.stdout = stdout
+
+def git_commit():
+    try:
+        res = subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return res.stdout.strip() if res.returncode==0 else None
+    except OSError:
+        return None
+
+results = list()
+for latency in latencies:
+    for years in payload_years:
+        server = start_mock_server(fixture_dir=fixture_dir,latency=latency,bandwidth=bandwidth,error_rate=error_rate,
+                                   years=years)
+        for source in sources:
+            jobs = [(source,s) for s in site_sources(source,sites)]
+            quiet(run_case,jobs[:1],1) # warm-up (imports, synthetic responses), not timed
+            for n_workers in workers:
+                reset_mock_stats(server)
+                runs = [quiet(run_case,jobs,n_workers) for r in range(repeats)]
+                seconds = [r[0] for r in runs]
+                stats = list(server.stats.values())
+                results.append({"case":source,"latency":latency,"years":years,"workers":n_workers,
+                                "median_s":round(float(np.median(seconds)),5),"min_s":round(float(min(seconds)),5),
+                                "failed":int(sum(r[1] for r in runs)),
+                                "requests":int(sum(s["requests"] for s in stats)),
+                                "errors":int(sum(s["errors"] for s in stats)),
+                                "mb":round(sum(s["bytes"] for s in stats)/1e6,3),
+                                "server_s":round(sum(s["seconds"] for s in stats),4)})
+                results[-1]["sites_per_s"] = round(len(jobs)/results[-1]["median_s"],2)
+                print(f"{source} (latency {latency} s, {years} years, {n_workers} workers): "
+                      f"{results[-1]['median_s']:.3f} s, {results[-1]['sites_per_s']} sites/s")
+        stop_mock_server(server)
+
+results = pd.DataFrame(results)
+print(results.to_string(index=False))
+
+output = {"created":time.strftime("%Y-%m-%d %H:%M:%S"),
+          "machine":{"platform":platform.platform(),"processor":platform.processor(),"cpus":os.cpu_count(),
+                     "python":platform.python_version(),"numpy":np.__version__,"pandas":pd.__version__},
+          "commit":git_commit(),
+          "settings":{"sites":sites,"sources":sources,"latencies":latencies,"payload_years":payload_years,
+                      "workers":workers,"repeats":repeats,"error_rate":error_rate,"bandwidth":bandwidth,
+                      "fixture_dir":fixture_dir},
+          "results":results.to_dict("records")}
+if outfile is not None:
+    os.makedirs(os.path.dirname(outfile) or ".",exist_ok=True)
+    with open(outfile,"w") as f:
+        json.dump(output,f,indent=1)
+    print(f"Results saved to {outfile}")
+
+# Compare with a previous run (matching cases only)
+if compare is not None:
+    with open(compare,"r") as f:
+        previous = json.load(f)
+    if previous["settings"] != output["settings"]:
+        print("Settings differ from the compared run; only matching cases are compared.")
+    keys = ["case","latency","years","workers"]
+    merged = results.merge(pd.DataFrame(previous["results"]),on=keys,suffixes=("","_previous"))
+    merged["ratio"] = (merged["median_s"]/merged["median_s_previous"]).round(3)
+    merged["change"] = np.where(merged["ratio"]>threshold,"slower",np.where(merged["ratio"]<1/threshold,"faster",""))
+    print(f"Compared with {compare} (commit {previous.get('commit')}):")
+    print(merged[keys+["median_s_previous","median_s","ratio","change"]].to_string(index=False))
+
+print("Ingestion Benchmark Complete")
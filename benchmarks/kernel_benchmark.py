@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19, 2026
+Kernel Benchmark
+@author: tclarkin (USBR 2022)
+
+This script times the analysis functions of src (imports, flow duration, volume duration, low flow, critical duration
+and plotting kernels) on deterministic synthetic records (see src/synthetic_functions.py) for each record length and
+number of sites, and fits scaling curves (time ~ years^b and sites^c). It runs offline. Results are saved as .json;
+if a previous result is given (compare), the ratio of the times is reported for each case, so that a change can be
+checked for speed regressions (e.g., run on the main branch, then on a branch, with compare set to the first output).
+
+Run from the repository folder: python benchmarks/kernel_benchmark.py [cache/kernel_benchmark.json]
+
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.synthetic_functions import synthetic_flow,synthetic_daily,synthetic_rating
+from src.functions import wy_completeness,season_masks
+from src.data_functions import csv_daily_import,import_daily,summarize_daily,season_subset
+from src.flow_functions import annualcombos,monthcombos,standard,calculate_ep,calculate_ep_seasonal,analyze_dur,plot_wytraces
+from src.vol_functions import analyze_voldur,analyze_voldur_multi,analyze_voldur_seasonal,voldur_surface
+from src.vol_functions import analyze_lowflow_multi,lowflow_surface,lowflow_stats
+from src.crit_functions import identify_thresh_events,cvhs_vol_table,cvhs_hydros,cvhs_scale_hydros,route
+
+### Begin User Input ###
+record_lengths = [10,30,100] # years of record
+site_counts = [1,4] # number of sites (each case is run for every site)
+repeats = 3 # runs of each case (median is reported)
+missing = 0.02 # fraction of missing days
+seasonality = 1.0 # scale of the snowmelt season (0 for none)
+subdaily = "h" # frequency of the sub-daily record (for sub-daily cases) or None to skip
+seed = 0 # random seed (site n uses seed+n)
+cases = None # list of case names to run (all if None)
+outfile = None # output file (e.g., "cache/kernel_benchmark.json") or None; also given as the first argument
+compare = None # previous output (.json) to compare with, or None
+threshold = 1.2 # ratio reported as slower (or 1/threshold as faster)
+
+### Begin Script ###
+if len(sys.argv) > 1:
+    outfile = sys.argv[1]
+seasons = {"spring":[3,4,5,6],"fall":[9,10,11]}
+durations = ["WY",1,3,7,15,30]
+
+def prepare(years,site,tmpdir):
+    """
+    Prepare the inputs of all cases for one synthetic site (not timed)
+    """
+    n = seed+site
+    inputs = {"daily":synthetic_daily(years,missing,seasonality,"D",n)}
+    inputs["file"] = f"{tmpdir}/site{site}_{years}.csv"
+    synthetic_flow(years,missing,seasonality,"D",n).to_csv(inputs["file"],index=False)
+    inputs["valid"] = inputs["daily"].dropna(subset=["flow"])
+    inputs["masks"] = season_masks(inputs["daily"],seasons)
+    inputs["thresh"] = float(inputs["daily"]["flow"].quantile(0.98))
+    inputs["evs"] = identify_thresh_events(inputs["daily"],inputs["thresh"])
+    inputs["vol_table"] = cvhs_vol_table(inputs["daily"],range(1,31),1)
+    inputs["hydros"] = cvhs_hydros(inputs["daily"],inputs["evs"],inputs["thresh"]*1.5,30).dropna(axis=1) # complete events
+    inputs["surface"] = lowflow_surface(inputs["daily"],range(1,31))
+    if subdaily is not None:
+        sub = synthetic_flow(years,missing,seasonality,subdaily,n)
+        sub.index = pd.to_datetime(sub.pop("date"),format="%d-%b-%Y %H:%M")
+        sub["doy"],sub["month"] = sub.index.dayofyear,sub.index.month
+        inputs["subdaily"] = sub
+    return inputs
+
+rating = synthetic_rating()
+
+# Case name: function of the inputs of a site
+all_cases = {
+    "csv_daily_import":lambda d: csv_daily_import(d["file"]),
+    "import_daily":lambda d: import_daily(d["file"],"WY",1),
+    "summarize_daily":lambda d: summarize_daily(d["daily"]),
+    "wy_completeness":lambda d: wy_completeness(d["daily"]),
+    "season_masks":lambda d: season_masks(d["daily"],seasons),
+    "season_subset_subdaily":lambda d: season_subset(d["subdaily"],seasons["spring"],"flow"),
+    "calculate_ep":lambda d: calculate_ep(d["valid"],annualcombos["Annual"]),
+    "calculate_ep_seasonal":lambda d: calculate_ep_seasonal(d["daily"],d["masks"]),
+    "analyze_dur_annual":lambda d: analyze_dur(d["valid"],annualcombos,standard,"flow",1),
+    "analyze_dur_monthly":lambda d: analyze_dur(d["valid"],monthcombos,standard,"flow",1),
+    "plot_wytraces":lambda d: plot_wytraces(d["valid"],"WY"),
+    "identify_thresh_events":lambda d: identify_thresh_events(d["daily"],d["thresh"]),
+    "analyze_voldur":lambda d: analyze_voldur(d["daily"],7,1),
+    "analyze_voldur_multi":lambda d: analyze_voldur_multi(d["daily"],durations,1),
+    "analyze_voldur_seasonal":lambda d: analyze_voldur_seasonal(d["daily"],durations,1,d["masks"]),
+    "voldur_surface":lambda d: voldur_surface(d["daily"],range(1,61)),
+    "analyze_lowflow_multi":lambda d: analyze_lowflow_multi(d["daily"],[1,7,30],1),
+    "lowflow_surface":lambda d: lowflow_surface(d["daily"],range(1,61)),
+    "lowflow_stats":lambda d: lowflow_stats(d["surface"]),
+    "cvhs_vol_table":lambda d: cvhs_vol_table(d["daily"],range(1,31),1),
+    "cvhs_hydros":lambda d: cvhs_hydros(d["daily"],d["evs"],d["thresh"]*1.5,30),
+    "cvhs_scale_hydros":lambda d: cvhs_scale_hydros(d["hydros"],d["vol_table"],range(1,31)),
+    "route":lambda d: route(d["hydros"].iloc[:,0].dropna(),220,rating),
+}
+if subdaily is None:
+    all_cases.pop("season_subset_subdaily")
+if cases is None:
+    cases = list(all_cases.keys())
+
+def time_case(func,inputs):
+    """
+    Time one run of a case over all sites (figures are closed after each run)
+    """
+    start = time.perf_counter()
+    for d in inputs:
+        func(d)
+    elapsed = time.perf_counter()-start
+    plt.close("all")
+    return elapsed
+
+def fit_exponent(x,y):
+    """
+    Slope of log(y) vs log(x) (time ~ x^b)
+    """
+    x,y = np.array(x,dtype=float),np.array(y,dtype=float)
+    if len(x) < 2 or (y<=0).any():
+        return None
+    return round(float(np.polyfit(np.log(x),np.log(y),1)[0]),3)
+
+def git_commit():
+    try:
+        res = subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return res.stdout.strip() if res.returncode==0 else None
+    except OSError:
+        return None
+
+results = list()
+with tempfile.TemporaryDirectory() as tmpdir:
+    for years in record_lengths:
+        print(f"Preparing {max(site_counts)} sites with {years} years")
+        all_inputs = [prepare(years,site,tmpdir) for site in range(max(site_counts))]
+        for sites in site_counts:
+            inputs = all_inputs[:sites]
+            for case in cases:
+                time_case(all_cases[case],inputs[:1]) # warm-up (imports, caches), not timed
+                seconds = [time_case(all_cases[case],inputs) for r in range(repeats)]
+                results.append({"case":case,"years":years,"sites":sites,"median_s":round(float(np.median(seconds)),5),
+                                "min_s":round(float(min(seconds)),5),"max_s":round(float(max(seconds)),5)})
+                print(f"{case} ({years} years, {sites} sites): {results[-1]['median_s']:.4f} s")
+
+results = pd.DataFrame(results)
+
+# Scaling curves: time ~ years^b (fewest sites) and sites^c (longest record)
+scaling = dict()
+for case,group in results.groupby("case",sort=False):
+    by_years = group.loc[group["sites"]==min(site_counts)]
+    by_sites = group.loc[group["years"]==max(record_lengths)]
+    scaling[case] = {"years_exponent":fit_exponent(by_years["years"],by_years["median_s"]),
+                     "sites_exponent":fit_exponent(by_sites["sites"],by_sites["median_s"])}
+print(pd.DataFrame(scaling).T.to_string())
+
+output = {"created":time.strftime("%Y-%m-%d %H:%M:%S"),
+          "machine":{"platform":platform.platform(),"processor":platform.processor(),"cpus":os.cpu_count(),
+                     "python":platform.python_version(),"numpy":np.__version__,"pandas":pd.__version__},
+          "commit":git_commit(),
+          "settings":{"record_lengths":record_lengths,"site_counts":site_counts,"repeats":repeats,"missing":missing,
+                      "seasonality":seasonality,"subdaily":subdaily,"seed":seed},
+          "results":results.to_dict("records"),
+          "scaling":scaling}
+if outfile is not None:
+    os.makedirs(os.path.dirname(outfile) or ".",exist_ok=True)
+    with open(outfile,"w") as f:
+        json.dump(output,f,indent=1)
+    print(f"Results saved to {outfile}")
+
+# Compare with a previous run (same cases, record lengths and sites only)
+if compare is not None:
+    with open(compare,"r") as f:
+        previous = json.load(f)
+    if previous["settings"] != output["settings"]:
+        print("Settings differ from the compared run; only matching cases are compared.")
+    merged = results.merge(pd.DataFrame(previous["results"]),on=["case","years","sites"],suffixes=("","_previous"))
+    merged["ratio"] = (merged["median_s"]/merged["median_s_previous"]).round(3)
+    merged["change"] = np.where(merged["ratio"]>threshold,"slower",np.where(merged["ratio"]<1/threshold,"faster",""))
+    print(f"Compared with {compare} (commit {previous.get('commit')}):")
+    print(merged[["case","years","sites","median_s_previous","median_s","ratio","change"]].to_string(index=False))
+
+print("Kernel Benchmark Complete")
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19, 2026
+Startup Benchmark
+@author: tclarkin (USBR 2022)
+
+This script measures the time to import each src module (and the stage functions used by the scripts) in a fresh
+python process, i.e., the start-up cost paid by each script run or batch worker. Optionally, the slowest imports
+reported by "python -X importtime" are listed for each module.
+
+Run from the repository folder: python benchmarks/startup_benchmark.py [cache/startup_benchmark.csv]
+
+"""
+import os
+import sys
+import subprocess
+import time
+import pandas as pd
+
+### Begin User Input ###
+# Modules to import (each in a new process)
+modules = ["src.functions","src.data_functions","src.flow_functions","src.vol_functions","src.crit_functions",
+           "src.plot_functions","src.stage_functions","src.batch_functions"]
+repeats = 5 # number of runs per module (median is reported)
+backend = "Agg" # matplotlib backend (MPLBACKEND) or None for the default
+importtime = True # Boolean, list the slowest imports for each module
+top = 5 # number of imports to list
+outfile = None # output file (e.g., "cache/startup_benchmark.csv") or None; also given as the first argument
+
+### Begin Script ###
+def run_import(module,env,flag=[]):
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable]+flag+["-c",f"import {module}"],env=env,capture_output=True,text=True)
+    elapsed = time.perf_counter()-start
+    if res.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{res.stderr}")
+    return elapsed,res.stderr
+
+def slowest_imports(stderr,top):
+    rows = list()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us,cum_us,name = line[12:].split("|")
+        rows.append([name.strip(),int(self_us),int(cum_us)])
+    rows = pd.DataFrame(rows,columns=["import","self_s","cumulative_s"])
+    rows[["self_s","cumulative_s"]] = rows[["self_s","cumulative_s"]]/1e6
+    # Only packages (cumulative includes submodules), excluding the modules of this repository
+    rows = rows.loc[~rows["import"].str.contains(r"\.") & (rows["import"]!="src")]
+    return rows.sort_values("cumulative_s",ascending=False).head(top)
+
+if len(sys.argv) > 1:
+    outfile = sys.argv[1]
+env = os.environ.copy()
+if backend is not None:
+    env["MPLBACKEND"] = backend
+
+# Baseline: interpreter start-up alone
+base = [run_import("sys",env)[0] for r in range(repeats)]
+results = pd.DataFrame(columns=["median_s","min_s","max_s"])
+results.loc["(python)"] = [pd.Series(base).median(),min(base),max(base)]
+
+for module in modules:
+    times = [run_import(module,env)[0] for r in range(repeats)]
+    results.loc[module] = [pd.Series(times).median(),min(times),max(times)]
+    print(f"{module}: {results.loc[module,'median_s']:.3f} s")
+    if importtime:
+        elapsed,stderr = run_import(module,env,flag=["-X","importtime"])
+        print(slowest_imports(stderr,top).to_string(index=False))
+
+results.index.name = "module"
+results["import_s"] = results["median_s"]-results.loc["(python)","median_s"]
+print(results.round(3))
+if outfile is not None:
+    os.makedirs(os.path.dirname(outfile) or ".",exist_ok=True)
+    results.round(4).to_csv(outfile)
+    print(f"Results saved to {outfile}")
+
+print("Startup Benchmark Complete")
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19, 2026
+Run Specification (v1)
+@author: tclarkin (USBR 2022)
+
+This script runs many configurations of the duration analyses (scripts 1a, 1b, 2a, 2b, 3, 4 and 5) from a single run
+specification file (.toml, .yaml or .json) in one process, e.g., sites x thresholds x seasons for script 3, instead of
+editing and running a copy of a script for each configuration. See src/run_functions.py and run_spec_example.toml for
+the format of the run specification.
+
+Usage (from the folder containing the site folders):
+    python run_spec.py run_spec_example.toml
+    python run_spec.py run_spec_example.toml --list
+    python run_spec.py run_spec_example.toml --dry-run
+    python run_spec.py run_spec_example.toml --keep-going --summary run_summary.csv
+    python run_spec.py run_spec_example.toml --profile cache/profile --profile-stats
+    python run_spec.py run_spec_example.toml --engines evs=numpy,doy_data=numpy
+    python run_spec.py run_spec_example.toml --render-workers 4
+    python run_spec.py run_spec_example.toml --render-reuse
+    python run_spec.py run_spec_example.toml --render-output pdf --thumbnails
+
+"""
+import sys
+import argparse
+import matplotlib
+matplotlib.use("Agg") # non-interactive backend; figures are only saved
+from src.run_functions import load_spec,expand_runs,run_spec
+from src.profile_functions import start_profile,stop_profile,profile_report
+from src.engine_functions import set_engines
+from src.render_functions import set_render
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run configurations of the duration analyses from a run specification")
+    parser.add_argument("spec",help="run specification file (.toml, .yaml or .json)")
+    parser.add_argument("--list",action="store_true",help="list the configurations without running them")
+    parser.add_argument("--dry-run",action="store_true",help="only report the events, figures, files, disk space and run "
+                                                             "time of the configurations (nothing is run or saved)")
+    parser.add_argument("--keep-going",action="store_true",help="continue with the next configuration if one fails")
+    parser.add_argument("--summary",default=None,help="save the stage, status and run time of each configuration (.csv), "
+                                                           "or the plan of each output if --dry-run")
+    parser.add_argument("--profile",default=None,help="directory for a run report with the time and calls of the hot "
+                                                      "functions for each stage and site")
+    parser.add_argument("--profile-memory",action="store_true",help="also record peak memory (with --profile)")
+    parser.add_argument("--profile-stats",action="store_true",help="also save cProfile statistics for each stage "
+                                                                   "(with --profile)")
+    parser.add_argument("--engines",default=None,help="engine of each analysis kernel, e.g., evs=numpy,doy_data=numpy "
+                                                      "(see src/engine_functions.py and benchmarks/engine_check.py)")
+    parser.add_argument("--render-workers",type=int,default=0,help="processes drawing the per-year and per-event "
+                                                                     "figures while the analysis continues")
+    parser.add_argument("--render-reuse",action="store_true",help="update the artists of the WY and CVHS hydrograph "
+                                                                   "figures between years and events")
+    parser.add_argument("--render-output",choices=["files","pdf","sheet"],default="files",
+                        help="one file per figure, or one multi-page .pdf or contact sheet per plot family")
+    parser.add_argument("--thumbnails",action="store_true",help="also save small thumbnails of the figures of plot "
+                                                                 "families")
+    args = parser.parse_args()
+    if args.engines is not None:
+        set_engines(dict(engine.split("=") for engine in args.engines.split(",")))
+    set_render(args.render_workers,reuse=args.render_reuse,output=args.render_output,thumbnails=args.thumbnails)
+
+    spec = load_spec(args.spec)
+    if args.list:
+        for n,config in enumerate(expand_runs(spec)):
+            print(f"{n+1}: {config['name']} (stage {config['stage']}) {config['settings']}")
+        sys.exit()
+    if args.dry_run:
+        run_spec(spec,dry_run=True,outfile=args.summary)
+        sys.exit()
+
+    if args.profile is not None:
+        start_profile(args.profile,args.profile_memory,args.profile_stats)
+    summary = run_spec(spec,args.keep_going)
+    if args.profile is not None:
+        stop_profile()
+        profile_report(args.profile)
+    print(summary.to_string(index=False))
+    if args.summary is not None:
+        summary.to_csv(args.summary,index=False)
+    if (summary["status"]=="failed").any():
+        sys.exit(1)
+
+    print("Run Specification Complete")
@@ -0,0 +1,909 @@
+# -*- coding: utf-8 -*-
+"""
+### BATCH FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used by the batch run of the duration analyses (0_duration_analyses_batch.py)
+
+"""
+import os
+import sys
+import ast
+import dis
+import json
+import time
+import hashlib
+import inspect
+import importlib
+import socket
+from src.functions import check_dir
+from src.profile_functions import resume_profile,save_profile
+from src.engine_functions import kernel_engines
+from src.render_functions import render_settings
+
+### STAGE CACHE FUNCTIONS
+# Function run by each stage (the source files of this function and of all src functions it calls are hashed, so
+# changes to the code will rerun the stage)
+stage_code = {"1a":"src.stage_functions.stage_1a",
+              "1b":"src.stage_functions.stage_1b",
+              "2a":"src.stage_functions.stage_2a",
+              "2b":"src.stage_functions.stage_2b",
+              "4":"src.batch_functions.run_stage_4",
+              "5":"src.stage_functions.stage_5",
+              "pipeline":"src.batch_functions.run_pipeline"}
+code_imports = dict() # names imported from src modules by each source file (see import_files())
+# Figure outputs (not read by the following stages; .pdf files also differ between runs)
+figure_types = (".jpg",".png",".pdf",".svg")
+
+def hash_file(filename,h=None):
+    """
+    This function adds the contents of a file to a hash
+    :param filename: str, file path
+    :param h: hashlib object, hash to update (new sha256 if None)
+    :return: hashlib object
+    """
+    if h is None:
+        h = hashlib.sha256()
+    with open(filename,"rb") as f:
+        for chunk in iter(lambda: f.read(1048576),b""):
+            h.update(chunk)
+    return h
+
+def import_files(filename):
+    """
+    This function lists the names imported from src modules at the top of a source file
+    :param filename: str, source file (e.g., stage_functions.py)
+    :return: dict, file of the module providing each name
+    """
+    if filename not in code_imports.keys():
+        with open(filename,"r") as f:
+            tree = ast.parse(f.read())
+        srcdir = os.path.dirname(os.path.abspath(__file__))
+        code_imports[filename] = {alias.asname or alias.name:f"{srcdir}/{node.module[4:]}.py" for node in tree.body
+                                  if isinstance(node,ast.ImportFrom) and str(node.module).startswith("src.")
+                                  for alias in node.names}
+    return code_imports[filename]
+
+def code_files(func):
+    """
+    This function finds the source files of a function and of the src functions it calls, directly, through other src
+    functions, local imports or registries (e.g., engine_registry), so the key of a stage can't miss a module it uses
+    :param func: str or function, function (e.g., "src.stage_functions.stage_1a")
+    :return: list, files
+    """
+    if isinstance(func,str):
+        module,name = func.rsplit(".",1)
+        func = getattr(importlib.import_module(module),name)
+    srcdir = os.path.dirname(os.path.abspath(__file__))
+    files = set()
+    seen = set()
+    pending = [func]
+    while len(pending) > 0:
+        obj = pending.pop()
+        if isinstance(obj,dict):
+            pending.extend(obj.values())
+            continue
+        if not inspect.isfunction(obj):
+            # Other src objects (e.g., LazyModule plt)
+            module = sys.modules.get(type(obj).__module__)
+            if type(obj).__module__.startswith("src.") and module is not None:
+                files.add(os.path.abspath(module.__file__))
+            continue
+        if obj in seen:
+            continue
+        seen.add(obj)
+        if hasattr(obj,"__wrapped__"):
+            # Decorated functions (e.g., @timed, @contextmanager)
+            pending.append(obj.__wrapped__)
+        if os.path.dirname(os.path.abspath(obj.__code__.co_filename))!=srcdir:
+            continue
+        files.add(os.path.abspath(obj.__code__.co_filename))
+        imports = import_files(obj.__code__.co_filename)
+        for cell in obj.__closure__ or []:
+            try:
+                pending.append(cell.cell_contents)
+            except ValueError:
+                continue
+        codes = [obj.__code__]
+        while len(codes) > 0:
+            code = codes.pop()
+            codes.extend([c for c in code.co_consts if inspect.iscode(c)])
+            imported = None
+            for ins in dis.get_instructions(code):
+                if ins.opname=="IMPORT_NAME":
+                    imported = importlib.import_module(ins.argval) if ins.argval.startswith("src.") else None
+                elif ins.opname=="IMPORT_FROM" and imported is not None:
+                    pending.append(getattr(imported,ins.argval,None))
+                elif ins.opname in ["LOAD_GLOBAL","LOAD_NAME"] and ins.argval in obj.__globals__.keys():
+                    pending.append(obj.__globals__[ins.argval])
+                    if ins.argval in imports.keys():
+                        # Names imported from other src modules (including constants, e.g., alphabet)
+                        files.add(imports[ins.argval])
+    return sorted(files)
+
+def stage_key(stage,params,upstream=[],files=[]):
+    """
+    This function fingerprints the inputs of a stage
+    :param stage: str, stage name (e.g., "1a")
+    :param params: dict, parameters of the stage
+    :param upstream: list, output from get_key() for the stages providing input (e.g., [key_1a])
+    :param files: list, input files (e.g., .csv site sources); missing files (e.g., gage numbers) are skipped
+    :return: str, key
+    """
+    h = hashlib.sha256()
+    h.update(stage.encode())
+    h.update(json.dumps(params,sort_keys=True,default=str).encode())
+    h.update(json.dumps(kernel_engines,sort_keys=True).encode())
+    h.update(json.dumps({k:render_settings[k] for k in ["output","thumbnails"]},sort_keys=True).encode())
+    for key in upstream:
+        h.update(str(key).encode())
+    if stage in stage_code.keys():
+        code = code_files(stage_code[stage])
+    else:
+        code = [f"{os.path.dirname(os.path.abspath(__file__))}/stage_functions.py"]
+    for f in list(files)+code:
+        if isinstance(f,str) and os.path.isfile(f):
+            h.update(f.encode())
+            hash_file(f,h)
+    return h.hexdigest()
+
+def source_files(site_sources):
+    """
+    This function lists the local input files of a list of site sources
+    :param site_sources: list, .csv files or other site info for supported data
+    :return: list, files
+    """
+    return [s for s in site_sources if isinstance(s,str) and os.path.isfile(s)]
+
+def get_manifest(stage,cache_dir="cache"):
+    """
+    This function loads the manifest of a stage
+    :param stage: str, stage name
+    :param cache_dir: str, directory of manifests
+    :return: dict, manifest (None if not found)
+    """
+    filename = f"{cache_dir}/{stage}_manifest.json"
+    if not os.path.isfile(filename):
+        return None
+    with open(filename,"r") as f:
+        return json.load(f)
+
+def get_key(stage,cache_dir="cache"):
+    """
+    This function returns the upstream key of the stages following a stage: a hash of the contents of the data (tables)
+    written by its last run, so the following stages are rerun only when the data they read change (not each time this
+    stage is rerun). Work queue runs (and manifests without content hashes) use the key and run id of the stage, as the
+    outputs recorded depend on the process that saved the manifest.
+    :param stage: str, stage name
+    :param cache_dir: str, directory of manifests
+    :return: str, key ("" if not found)
+    """
+    manifest = get_manifest(stage,cache_dir)
+    if manifest is None:
+        return ""
+    outputs = manifest["outputs"]
+    if manifest["run"]==manifest["key"] or not all([isinstance(output,dict) for output in outputs.values()]):
+        return f"{manifest['key']}_{manifest['run']}"
+    h = hashlib.sha256()
+    for filename in sorted(outputs.keys()):
+        if not filename.lower().endswith(figure_types):
+            h.update(f"{filename} {outputs[filename]['sha256']}".encode())
+    return h.hexdigest()
+
+def check_cache(stage,key,cache_dir="cache"):
+    """
+    This function checks if a stage can be skipped (same key and all outputs exist)
+    :param stage: str, stage name
+    :param key: str, output from stage_key()
+    :param cache_dir: str, directory of manifests
+    :return: boolean
+    """
+    manifest = get_manifest(stage,cache_dir)
+    if manifest is None or manifest["key"]!=key:
+        return False
+    for filename in manifest["outputs"].keys():
+        if not os.path.isfile(filename):
+            return False
+    return True
+
+def dir_snapshot(dirs):
+    """
+    This function records the files in directories (e.g., before a stage)
+    :param dirs: list, directories to search (e.g., sites)
+    :return: dict, modification time (ns) and size of each file
+    """
+    snapshot = dict()
+    for dir in dirs:
+        if dir is None or not os.path.isdir(dir):
+            continue
+        for root,subdirs,files in os.walk(dir):
+            for f in files:
+                filename = os.path.join(root,f).replace("\\","/")
+                stat = os.stat(filename)
+                snapshot[filename] = (stat.st_mtime_ns,stat.st_size)
+    return snapshot
+
+def stage_outputs(dirs,before):
+    """
+    This function finds the files written during a stage (new or changed since the snapshot taken before the stage, so
+    file times from other clocks, e.g., network shares, do not matter)
+    :param dirs: list, directories to search (e.g., sites)
+    :param before: dict, output from dir_snapshot() before the stage
+    :return: dict, size of each file
+    """
+    return {filename:size for filename,(mtime,size) in dir_snapshot(dirs).items()
+            if before.get(filename)!=(mtime,size)}
+
+def save_manifest(stage,key,outputs,cache_dir="cache",run=None):
+    """
+    This function saves the manifest of a stage
+    :param stage: str, stage name
+    :param key: str, output from stage_key()
+    :param outputs: dict, output from stage_outputs() (the size and content hash of each file are saved)
+    :param cache_dir: str, directory of manifests
+    :param run: str, run id (time of the run if None)
+    :return: None
+    """
+    check_dir(cache_dir)
+    if run is None:
+        run = repr(time.time())
+    outputs = {filename:{"size":size,"sha256":hash_file(filename).hexdigest()} for filename,size in outputs.items()
+               if os.path.isfile(filename)}
+    manifest = {"stage":stage,"key":key,"created":time.strftime("%Y-%m-%d %H:%M:%S"),"run":run,"outputs":outputs}
+    # Write and rename, so other processes never read a partial manifest
+    filename = f"{cache_dir}/{stage}_manifest.json"
+    with open(f"{filename}.{socket.gethostname()}.{os.getpid()}","w") as f:
+        json.dump(manifest,f,indent=1)
+    os.replace(f"{filename}.{socket.gethostname()}.{os.getpid()}",filename)
+
+def run_cached(stage,key,dirs,func,*args,cache=True,cache_dir="cache",journal=None,resume=False,queue=None,stale=600,
+               **kwargs):
+    """
+    This function runs a stage unless its inputs are unchanged since the last run (see check_cache())
+    :param stage: str, stage name
+    :param key: str, output from stage_key()
+    :param dirs: list, directories where the stage writes outputs
+    :param func: function, stage function (e.g., stage_1a) or run_sites()
+    :param cache: boolean, use the cache (False always runs the stage)
+    :param cache_dir: str, directory of manifests
+    :param journal: str, journal file passed to run_sites() with the stage and key (None for no journal)
+    :param resume: boolean, skip sites completed in the journal (see run_sites())
+    :param queue: str, work queue directory passed to func with the stage and key (None for no queue, see run_queue())
+    :param stale: int, seconds before a claimed unit of the work queue is reclaimed
+    :return: output of func (None if skipped)
+    """
+    if cache and check_cache(stage,key,cache_dir):
+        print(f"Script {stage} inputs unchanged; using previous outputs...")
+        return None
+    if journal is not None:
+        kwargs.update({"journal":journal,"stage":stage,"key":key,"resume":resume})
+    if queue is not None:
+        kwargs.update({"queue":queue,"stage":stage,"key":key,"stale":stale})
+    before = dir_snapshot(dirs)
+    result = func(*args,**kwargs)
+    # With a work queue, all workers must find the same upstream keys, so the run id is the key
+    save_manifest(stage,key,stage_outputs(dirs,before),cache_dir,key if queue is not None else None)
+    return result
+
+### JOURNAL FUNCTIONS
+def journal_record(journal,stage,key,site,status,outputs=None,error=None):
+    """
+    This function appends the completion (or failure) of a stage for a site to the run journal
+    :param journal: str, journal file (json lines)
+    :param stage: str, stage name
+    :param key: str, output from stage_key()
+    :param site: str, site name
+    :param status: str, "done" or "failed"
+    :param outputs: dict, output from stage_outputs() for the site
+    :param error: str, error message
+    :return: None
+    """
+    check_dir(os.path.dirname(journal) or ".")
+    entry = {"time":time.strftime("%Y-%m-%d %H:%M:%S"),"stage":stage,"key":key,"site":site,"status":status}
+    if outputs is not None:
+        entry["outputs"] = list(outputs.keys())
+    if error is not None:
+        entry["error"] = error
+    with open(journal,"a") as f:
+        f.write(json.dumps(entry)+"\n")
+
+def journal_done(journal,stage,key):
+    """
+    This function finds the sites completed for a stage (with the same key) in the run journal
+    :param journal: str, journal file (json lines)
+    :param stage: str, stage name
+    :param key: str, output from stage_key()
+    :return: list, sites completed (with all outputs present)
+    """
+    done = dict()
+    if journal is None or not os.path.isfile(journal):
+        return list()
+    with open(journal,"r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Incomplete line (e.g., run stopped while writing)
+                continue
+            if entry["stage"]!=stage or entry["key"]!=key:
+                continue
+            if entry["status"]=="done":
+                done[entry["site"]] = entry.get("outputs",[])
+            else:
+                done.pop(entry["site"],None)
+    return [site for site,outputs in done.items() if all([os.path.isfile(f) for f in outputs])]
+
+### PARALLEL FUNCTIONS
+# In-memory inputs keyed by site (only the site being analyzed is sent to each process)
+site_inputs = ["daily","peaks","flow","voldur"]
+
+def init_worker():
+    """
+    This function prepares each process of the pool (non-interactive plotting, instrumentation if turned on)
+    :return: None
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    resume_profile()
+
+def site_subset(kwargs,site):
+    """
+    This function keeps only the in-memory inputs of a site in the keyword arguments of a stage function
+    :param kwargs: dict, keyword arguments of the stage function
+    :param site: str, site name
+    :return: dict, keyword arguments
+    """
+    kwargs = dict(kwargs)
+    for input in site_inputs:
+        if isinstance(kwargs.get(input),dict):
+            kwargs[input] = {k:v for k,v in kwargs[input].items() if k==site}
+    return kwargs
+
+def run_site(func,site,site_args,kwargs):
+    """
+    This function runs a stage function for a single site (called in each process of the pool)
+    :param func: function, stage function (e.g., stage_2a)
+    :param site: str, site name
+    :param site_args: list, positional arguments for this site after sites (e.g., [site_source])
+    :param kwargs: dict, keyword arguments of the stage function
+    :return: output of func
+    """
+    args = [[arg] for arg in site_args]
+    try:
+        return func([site],*args,**kwargs)
+    finally:
+        # Save the instrumentation records of this process after each site (processes of the pool are not shut down
+        # cleanly)
+        save_profile()
+
+def per_site(workers=1,journal=None):
+    """
+    This function checks if stages are run one site at a time (process pool or run journal)
+    :param workers: int, number of processes
+    :param journal: str, journal file (None for no journal)
+    :return: boolean
+    """
+    return (workers is not None and workers > 1) or journal is not None
+
+def run_sites(func,sites,*site_args,workers=1,journal=None,stage=None,key=None,resume=False,queue=None,stale=600,
+              **kwargs):
+    """
+    This function runs a per-site stage function (1a, 1b, 2a, 4 or 5) for each site over a pool of processes and
+    combines the results (cross-site stages, e.g., 2b and stage_4_concat(), must be run after). If a journal is used,
+    the completion of each site is recorded, other sites continue if a site fails, and completed sites can be skipped
+    when the run is resumed.
+    :param func: function, stage function (e.g., stage_2a)
+    :param sites: list, site or dam names
+    :param site_args: lists, positional arguments matched to sites (e.g., site_sources)
+    :param workers: int, number of processes (1 runs all sites in this process)
+    :param journal: str, journal file (json lines), None for no journal
+    :param stage: str, stage name (for journal)
+    :param key: str, output from stage_key() (for journal)
+    :param resume: boolean, skip sites completed in the journal with the same key
+    :param queue: str, work queue directory (sites are claimed with other batch processes, see run_queue()), or None
+    :param stale: int, seconds before a claimed site of the work queue is reclaimed
+    :param kwargs: keyword arguments of the stage function
+    :return: dict, combined output of func for all sites
+    """
+    if queue is not None:
+        return run_queue(func,sites,*site_args,queue=queue,stage=stage,key=key,stale=stale,**kwargs)
+    if not per_site(workers,journal) or len(sites) <= 1 and journal is None:
+        return func(sites,*site_args,**kwargs)
+
+    # Check for completed sites
+    done = list()
+    if resume:
+        done = journal_done(journal,stage,key)
+        if len(done) > 0:
+            print(f"Script {stage} already complete for {len(done)} sites; resuming...")
+
+    units = list()
+    for i,site in enumerate(sites):
+        if site is None or site in done:
+            continue
+        units.append((site,[arg[i] for arg in site_args],site_subset(kwargs,site)))
+
+    results = dict()
+    failed = list()
+
+    def finish(site,before,result=None,error=None):
+        if error is None:
+            if isinstance(result,dict):
+                results.update(result)
+            if journal is not None:
+                journal_record(journal,stage,key,site,"done",stage_outputs([site],before))
+        else:
+            print(f"Script {stage} failed for {site}: {error}")
+            failed.append(site)
+            if journal is not None:
+                journal_record(journal,stage,key,site,"failed",error=str(error))
+
+    if workers is None or workers <= 1:
+        for site,args,site_kwargs in units:
+            before = dir_snapshot([site])
+            try:
+                result = run_site(func,site,args,site_kwargs)
+            except Exception as error:
+                if journal is None:
+                    raise
+                finish(site,before,error=error)
+                continue
+            finish(site,before,result)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(workers,len(units)),initializer=init_worker) as pool:
+            futures = dict()
+            for site,args,site_kwargs in units:
+                futures[site] = (dir_snapshot([site]),pool.submit(run_site,func,site,args,site_kwargs))
+            # Wait for all sites (barrier before cross-site stages)
+            for site,(before,future) in futures.items():
+                try:
+                    result = future.result()
+                except Exception as error:
+                    if journal is None:
+                        raise
+                    finish(site,before,error=error)
+                    continue
+                finish(site,before,result)
+
+    if len(failed) > 0:
+        raise RuntimeError(f"Script {stage} failed for {failed}. Completed sites are recorded in {journal}; "
+                           f"rerun with resume=True to continue.")
+    return results
+
+def run_stage_4(sites,workers=1,journal=None,stage="4",key=None,resume=False,queue=None,stale=600,**kwargs):
+    """
+    This function runs script 4 for each site over a pool of processes, then combines the tables of all sites
+    :param sites: list, site or dam names
+    :param workers: int, number of processes (1 runs all sites in this process)
+    :param journal: str, journal file (see run_sites())
+    :param stage: str, stage name (for journal)
+    :param key: str, output from stage_key() (for journal)
+    :param resume: boolean, skip sites completed in the journal with the same key
+    :param queue: str, work queue directory (see run_queue()), or None
+    :param stale: int, seconds before a claimed unit of the work queue is reclaimed
+    :param kwargs: keyword arguments of stage_4()
+    :return: dict, output from stage_4()
+    """
+    from src.stage_functions import stage_4,stage_4_concat
+
+    voldur = run_sites(stage_4,sites,workers=workers,journal=journal,stage=stage,key=key,resume=resume,queue=queue,
+                       stale=stale,**kwargs)
+    if (per_site(workers,journal) or queue is not None) and len(sites) > 1 and kwargs.get("concat",True):
+        run_once(stage_4_concat,sites,voldur,dict() if kwargs.get("lowflow",False) else None,queue=queue,
+                 stage=stage,key=key,stale=stale,unit="concat")
+    return voldur
+
+### WORK QUEUE FUNCTIONS
+# Each unit of work (a stage for a site, or a cross-site stage) is claimed by creating its lock file in the work queue
+# directory, so any number of batch processes, on any number of machines sharing the folder (e.g., NFS), can run the
+# batch at the same time. A claimed unit is kept alive by updating its lock file; a lock not updated for stale seconds
+# (e.g., the process or machine stopped) is broken and the unit is claimed again. Units are marked done (or failed) in
+# the same directory, so a stopped batch continues where it left off when restarted.
+def queue_time(queue):
+    """
+    This function finds the current time of the file system holding the work queue (avoids clock differences between
+    machines)
+    :param queue: str, directory
+    :return: float, time
+    """
+    probe = f"{queue}/.clock.{socket.gethostname()}.{os.getpid()}"
+    with open(probe,"w"):
+        pass
+    now = os.path.getmtime(probe)
+    os.remove(probe)
+    return now
+
+def claim_unit(lockfile,stale=600):
+    """
+    This function claims a unit of work by creating its lock file (hard link, atomic on local and NFS file systems). A
+    lock not updated for stale seconds is broken and claimed.
+    :param lockfile: str, lock file of the unit
+    :param stale: int, seconds
+    :return: boolean, True if claimed
+    """
+    owner = f"{socket.gethostname()} {os.getpid()} {time.time()!r}"
+    tmp = f"{lockfile}.{socket.gethostname()}.{os.getpid()}"
+    with open(tmp,"w") as f:
+        f.write(owner)
+    try:
+        for attempt in range(2):
+            try:
+                os.link(tmp,lockfile)
+                return True
+            except FileExistsError:
+                pass
+            except OSError:
+                # NFS may report an error for a link that was created
+                if os.stat(tmp).st_nlink == 2:
+                    return True
+                raise
+
+            # Check for a stale lock
+            try:
+                with open(lockfile) as f:
+                    holder = f.read()
+                age = queue_time(os.path.dirname(lockfile))-os.path.getmtime(lockfile)
+            except FileNotFoundError:
+                continue
+            if age < stale:
+                return False
+            broken = f"{lockfile}.stale.{socket.gethostname()}.{os.getpid()}"
+            try:
+                os.rename(lockfile,broken)
+            except FileNotFoundError:
+                return False
+            with open(broken) as f:
+                if f.read() != holder:
+                    # Claimed by another process in the meantime; restore its lock
+                    try:
+                        os.link(broken,lockfile)
+                    except FileExistsError:
+                        pass
+                    os.remove(broken)
+                    return False
+            os.remove(broken)
+            print(f"Lock {lockfile} not updated for {age:.0f} s ({holder}); reclaiming...")
+        return False
+    finally:
+        os.remove(tmp)
+
+def keep_alive(lockfile,stop,interval):
+    """
+    This function updates a lock file until stopped (run in a thread while the unit is running)
+    :param lockfile: str, lock file of the unit
+    :param stop: threading.Event, set when the unit is complete
+    :param interval: float, seconds between updates
+    :return: None
+    """
+    while not stop.wait(interval):
+        try:
+            os.utime(lockfile)
+        except OSError:
+            return
+
+def mark_unit(unitdir,unit,status,text=""):
+    """
+    This function marks a unit of work as "done" or "failed" (written and renamed, so other processes never read a
+    partial file)
+    :param unitdir: str, work queue directory of the stage
+    :param unit: str, unit name (e.g., site)
+    :param status: str, "done" or "failed"
+    :param text: str, contents (e.g., error message)
+    :return: None
+    """
+    tmp = f"{unitdir}/{unit}.{status}.{socket.gethostname()}.{os.getpid()}"
+    with open(tmp,"w") as f:
+        f.write(f"{socket.gethostname()} {os.getpid()} {time.strftime('%Y-%m-%d %H:%M:%S')}\n{text}")
+    os.replace(tmp,f"{unitdir}/{unit}.{status}")
+    if status == "done" and os.path.isfile(f"{unitdir}/{unit}.failed"):
+        os.remove(f"{unitdir}/{unit}.failed")
+
+def unit_status(unitdir,unit):
+    """
+    This function checks the status of a unit of work
+    :param unitdir: str, work queue directory of the stage
+    :param unit: str, unit name (e.g., site)
+    :return: str, "done", "failed" or None
+    """
+    for status in ["done","failed"]:
+        if os.path.isfile(f"{unitdir}/{unit}.{status}"):
+            return status
+    return None
+
+def run_unit(unitdir,unit,stale,func,*args,**kwargs):
+    """
+    This function runs a claimed unit of work, keeping its lock alive, then marks it and releases the lock
+    :param unitdir: str, work queue directory of the stage
+    :param unit: str, unit name (e.g., site)
+    :param stale: int, seconds before the lock is considered stale (updated every stale/4 seconds)
+    :param func: function, run with args and kwargs
+    :return: output of func, and error (None if completed)
+    """
+    import threading
+
+    lockfile = f"{unitdir}/{unit}.lock"
+    stop = threading.Event()
+    thread = threading.Thread(target=keep_alive,args=(lockfile,stop,stale/4),daemon=True)
+    thread.start()
+    try:
+        result = func(*args,**kwargs)
+        mark_unit(unitdir,unit,"done")
+        return result,None
+    except Exception as error:
+        mark_unit(unitdir,unit,"failed",repr(error))
+        return None,error
+    finally:
+        stop.set()
+        thread.join()
+        if os.path.isfile(lockfile):
+            os.remove(lockfile)
+
+def run_queue(func,sites,*site_args,queue="cache/queue",stage=None,key=None,stale=600,poll=5,**kwargs):
+    """
+    This function runs a per-site stage function for the sites claimed by this process from the work queue, then waits
+    until all sites are complete (reclaiming sites whose lock is stale). Sites that failed in another process are
+    attempted once more; the outputs of sites run by other processes are read from their files by the next stage.
+    :param func: function, stage function (e.g., stage_2a)
+    :param sites: list, site or dam names
+    :param site_args: lists, positional arguments matched to sites (e.g., site_sources)
+    :param queue: str, work queue directory (shared by all batch processes)
+    :param stage: str, stage name
+    :param key: str, output from stage_key() (all processes must use the same settings)
+    :param stale: int, seconds before a claimed site is reclaimed
+    :param poll: int, seconds between checks while waiting for other processes
+    :param kwargs: keyword arguments of the stage function
+    :return: dict, combined output of func for the sites run by this process
+    """
+    unitdir = f"{queue}/{stage}_{str(key)[:16]}"
+    os.makedirs(unitdir,exist_ok=True)
+    units = {site:([arg[i] for arg in site_args],site_subset(kwargs,site)) for i,site in enumerate(sites)
+             if site is not None}
+
+    results = dict()
+    attempted = list()
+    failed = list()
+    pending = list(units.keys())
+    while len(pending) > 0:
+        ran = False
+        for site in list(pending):
+            status = unit_status(unitdir,site)
+            if status == "done" or (status == "failed" and site in attempted):
+                pending.remove(site)
+                if status == "failed":
+                    failed.append(site)
+                continue
+            if site in attempted or not claim_unit(f"{unitdir}/{site}.lock",stale):
+                continue
+            if unit_status(unitdir,site) == "done":
+                # Completed by another process before claimed
+                os.remove(f"{unitdir}/{site}.lock")
+                continue
+            print(f"Script {stage}: claimed {site}")
+            attempted.append(site)
+            ran = True
+            args,kwargs_site = units[site]
+            result,error = run_unit(unitdir,site,stale,run_site,func,site,args,kwargs_site)
+            if error is not None:
+                print(f"Script {stage} failed for {site}: {error}")
+            elif isinstance(result,dict):
+                results.update(result)
+        if len(pending) > 0 and not ran:
+            time.sleep(poll)
+
+    if len(failed) > 0:
+        raise RuntimeError(f"Script {stage} failed for {failed} (see {unitdir}/*.failed). Rerun to retry.")
+    return results
+
+def run_once(func,*args,queue=None,stage=None,key=None,stale=600,poll=5,unit="all",**kwargs):
+    """
+    This function runs a cross-site stage function (e.g., stage_2b) in one process of the work queue; the other
+    processes wait until it is complete
+    :param func: function, stage function
+    :param queue: str, work queue directory (None runs func)
+    :param stage: str, stage name
+    :param key: str, output from stage_key()
+    :param stale: int, seconds before a claimed unit is reclaimed
+    :param poll: int, seconds between checks while waiting
+    :param unit: str, unit name
+    :param kwargs: keyword arguments of the stage function
+    :return: output of func (None if run by another process)
+    """
+    if queue is None:
+        return func(*args,**kwargs)
+    unitdir = f"{queue}/{stage}_{str(key)[:16]}"
+    os.makedirs(unitdir,exist_ok=True)
+    attempted = False
+    while True:
+        status = unit_status(unitdir,unit)
+        if status == "done" or (status == "failed" and attempted):
+            break
+        if not attempted and claim_unit(f"{unitdir}/{unit}.lock",stale):
+            if unit_status(unitdir,unit) == "done":
+                os.remove(f"{unitdir}/{unit}.lock")
+                break
+            print(f"Script {stage}: claimed {unit}")
+            attempted = True
+            result,error = run_unit(unitdir,unit,stale,func,*args,**kwargs)
+            if error is not None:
+                raise error
+            return result
+        time.sleep(poll)
+    if status == "failed":
+        raise RuntimeError(f"Script {stage} failed (see {unitdir}/{unit}.failed). Rerun to retry.")
+    return None
+
+### PIPELINE FUNCTIONS
+def download_site(site_source,peak_source,wy_division="WY",decimal=2,zero=False):
+    """
+    This function imports the daily data and peaks of a site (run in download threads, so nothing is plotted or saved)
+    :param site_source: str or list, .csv file or other site info for supported data
+    :param peak_source: str, .csv file or USGS site number for peaks (None for no peaks)
+    :param wy_division: str, "WY" or "CY"
+    :param decimal: int, number of decimal places to use in data
+    :param zero: False, minimum flow value, or "average" (to handle negative values)
+    :return: dict, output from import_daily() ("daily") and import_peaks() ("peaks", None if no peaks)
+    """
+    from src.data_functions import import_daily,import_peaks
+
+    downloaded = {"daily":import_daily(site_source,wy_division,decimal,zero),"peaks":None}
+    if peak_source is not None:
+        downloaded["peaks"] = import_peaks(peak_source)
+    return downloaded
+
+def analyze_site(site,site_source,peak_source,downloaded,settings):
+    """
+    This function runs the per-site stages (1a, 1b, 2a, 4 and 5) for a site, passing results in memory
+    :param site: str, site name
+    :param site_source: str or list, .csv file or other site info for supported data
+    :param peak_source: str, .csv file or USGS site number for peaks (None for no peaks)
+    :param downloaded: dict, output from download_site()
+    :param settings: dict, keyword arguments of each stage to run (e.g., {"1a":{...},"2a":{...}})
+    :return: dict, in-memory results for the site ("daily", "peaks", "flow" and "voldur")
+    """
+    from src.stage_functions import stage_1a,stage_1b,stage_2a,stage_4,stage_5
+
+    results = {"daily":dict(),"peaks":dict(),"flow":dict(),"voldur":dict()}
+    results["daily"] = stage_1a([site],[site_source],imported={site:downloaded["daily"]},**settings["1a"])
+    if "1b" in settings.keys() and peak_source is not None:
+        results["peaks"] = stage_1b([site],[peak_source],daily=results["daily"],imported={site:downloaded["peaks"]},
+                                    **settings["1b"])
+    if "2a" in settings.keys():
+        results["flow"] = stage_2a([site],daily=results["daily"],**settings["2a"])
+    if "4" in settings.keys():
+        results["voldur"] = stage_4([site],daily=results["daily"],peaks=results["peaks"],**settings["4"])
+    if "5" in settings.keys():
+        stage_5([site],voldur=results["voldur"],peaks=results["peaks"],**settings["5"])
+    return results
+
+def run_pipeline(sites,site_sources,peak_sources,settings,downloads=4,queue_size=2,workers=1,journal=None,
+                 stage="pipeline",key=None,resume=False):
+    """
+    This function imports the data of each site in download threads while the sites already imported are analyzed
+    (analyze_site()), so that network and analysis time overlap. Downloaded sites wait in a bounded queue; download
+    threads wait while the queue is full, limiting the data held in memory. Cross-site stages (2b and the script 4
+    concatenation tables) must be run after.
+    :param sites: list, site or dam names
+    :param site_sources: list, .csv file or other site info for supported data
+    :param peak_sources: list, .csv file or USGS site number for peaks matched to sites (None for no peaks)
+    :param settings: dict, keyword arguments of each stage to run (see analyze_site())
+    :param downloads: int, number of download threads
+    :param queue_size: int, max. number of sites downloaded but not yet analyzed
+    :param workers: int, number of processes analyzing sites (1 analyzes sites in this process)
+    :param journal: str, journal file (see run_sites())
+    :param stage: str, stage name (for journal)
+    :param key: str, output from stage_key() (for journal)
+    :param resume: boolean, skip sites completed in the journal with the same key
+    :return: dict, combined in-memory results for all sites ("daily", "peaks", "flow" and "voldur")
+    """
+    import queue
+    import threading
+    from concurrent.futures import ThreadPoolExecutor,ProcessPoolExecutor,wait,FIRST_COMPLETED
+
+    # Check for completed sites
+    done = list()
+    if resume:
+        done = journal_done(journal,stage,key)
+        if len(done) > 0:
+            print(f"Script {stage} already complete for {len(done)} sites; resuming...")
+    units = [(site,site_source,peak_source) for site,site_source,peak_source in zip(sites,site_sources,peak_sources)
+             if site is not None and site not in done]
+
+    results = {"daily":dict(),"peaks":dict(),"flow":dict(),"voldur":dict()}
+    failed = list()
+
+    def finish(site,before,result=None,error=None):
+        if error is None:
+            for input in results.keys():
+                results[input].update(result[input])
+            if journal is not None:
+                journal_record(journal,stage,key,site,"done",stage_outputs([site],before))
+        else:
+            print(f"Script {stage} failed for {site}: {error}")
+            failed.append(site)
+            if journal is not None:
+                journal_record(journal,stage,key,site,"failed",error=str(error))
+
+    # Download threads put each site in the queue as soon as it is imported (waiting while the queue is full)
+    downloaded = queue.Queue(maxsize=max(queue_size,1))
+    stop = threading.Event()
+    import_settings = {k:v for k,v in settings["1a"].items() if k in ["wy_division","decimal","zero"]}
+
+    def download(site,site_source,peak_source):
+        if stop.is_set():
+            return
+        try:
+            item = (site,site_source,peak_source,download_site(site_source,peak_source,**import_settings),None)
+        except Exception as error:
+            item = (site,site_source,peak_source,None,error)
+        while not stop.is_set():
+            try:
+                downloaded.put(item,timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def collect(future,site,before):
+        try:
+            result = future.result()
+        except Exception as error:
+            if journal is None:
+                raise
+            finish(site,before,error=error)
+            return
+        finish(site,before,result)
+
+    threads = ThreadPoolExecutor(max_workers=max(downloads,1))
+    pool = None
+    if workers is not None and workers > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers,max(len(units),1)),initializer=init_worker)
+    try:
+        for site,site_source,peak_source in units:
+            threads.submit(download,site,site_source,peak_source)
+
+        # Analyze each site as soon as it lands
+        running = dict()
+        for n in range(len(units)):
+            site,site_source,peak_source,data,error = downloaded.get()
+            print(f"Data imported for {site} ({n+1} of {len(units)})")
+            before = dir_snapshot([site])
+            if error is not None:
+                if journal is None:
+                    raise error
+                finish(site,before,error=error)
+            elif pool is None:
+                try:
+                    result = analyze_site(site,site_source,peak_source,data,settings)
+                except Exception as error:
+                    if journal is None:
+                        raise
+                    finish(site,before,error=error)
+                    continue
+                finish(site,before,result)
+            else:
+                # Only send as many sites to the pool as workers (the others wait in the queue)
+                if len(running) >= workers:
+                    wait(list(running.keys()),return_when=FIRST_COMPLETED)
+                    for future in [f for f in running.keys() if f.done()]:
+                        collect(future,*running.pop(future))
+                running[pool.submit(analyze_site,site,site_source,peak_source,data,settings)] = (site,before)
+
+        # Wait for the remaining sites
+        for future,(site,before) in running.items():
+            collect(future,site,before)
+    finally:
+        stop.set()
+        threads.shutdown(cancel_futures=True)
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if len(failed) > 0:
+        raise RuntimeError(f"Script {stage} failed for {failed}. Completed sites are recorded in {journal}; "
+                           f"rerun with resume=True to continue.")
+
+    # Script 4 concatenation tables (all sites)
+    if "4" in settings.keys() and settings["4"].get("concat",True) and len(sites) > 1:
+        from src.stage_functions import stage_4_concat
+        stage_4_concat(sites,results["voldur"],dict() if settings["4"].get("lowflow",False) else None)
+    return results
@@ -8,13 +8,14 @@ This script contains the critical duration functions and pre-defined variables u
 """
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 import datetime as dt
-from src.vol_functions import analyze_voldur
-from src.plot_functions import calc_pp
-from src.functions import interp
+from src.vol_functions import voldur_surface
+from src.functions import plt,mpl,interp,get_varlabel
+from src.profile_functions import timed
+from src.engine_functions import register_engine,get_engine
+from src.render_functions import render,register_template,close_family
 
+@timed
 def identify_thresh_events(data, thresh):
     """
     This function loops through daily data and identifies periods of time when data exceed the threshold provided.
@@ -22,6 +23,9 @@ def identify_thresh_events(data, thresh):
     :param thresh: float, variable value threshold
     :return: df, list of events with indices, date, duration and peak
     """
+    engine = get_engine("evs")
+    if engine is not None:
+        return engine(data,thresh)
     var = data.columns[0]
     evs = pd.DataFrame(columns=("start_idx", "end_idx", "month","duration", "peak"))
     ev = False
@@ -48,6 +52,39 @@ def identify_thresh_events(data, thresh):
 
     return (evs)
 
+@register_engine("evs","numpy")
+def identify_thresh_events_numpy(data, thresh):
+    """
+    This function identifies periods of time when data exceed the threshold provided from run starts and ends of the
+    whole record ("numpy" engine of identify_thresh_events(); missing values neither start nor end an event)
+    :param data: df, data including at least date, variable (continuous daily, sorted by date)
+    :param thresh: float, variable value threshold
+    :return: df, list of events with indices, date, duration and peak
+    """
+    var = data.columns[0]
+    vals = data[var].values.astype(float)
+    # 1 above, 0 at or below the threshold, carried over missing values
+    state = pd.Series(np.where(vals>thresh,1.0,np.where(vals<=thresh,0.0,np.nan))).ffill().fillna(0).values
+    change = np.diff(np.concatenate([[0],state]))
+    starts = np.flatnonzero(change==1)
+    ends = np.flatnonzero(change==-1) # first day at or below the threshold
+    closed = len(ends)
+
+    if "month" in data.columns:
+        months = data["month"].values[starts]
+    else:
+        months = pd.DatetimeIndex(data.index[starts]).month.values
+    evs = pd.DataFrame({"start_idx":data.index[starts],"end_idx":pd.NaT,"month":months,"duration":np.nan,
+                        "peak":np.nan},columns=("start_idx", "end_idx", "month","duration", "peak")).astype(object)
+    if closed > 0:
+        evs.loc[:closed-1,"end_idx"] = list(data.index[ends-1])
+        evs.loc[:closed-1,"duration"] = list(ends-starts[:closed])
+        # Peak from the start through the first day at or below the threshold (missing values skipped)
+        bounds = np.ravel(np.column_stack([starts[:closed],ends+1]))
+        evs.loc[:closed-1,"peak"] = list(np.fmax.reduceat(np.append(vals,np.nan),bounds)[::2])
+    evs.loc[closed:,["end_idx","duration","peak"]] = np.nan
+    return evs
+
 def init_duration_plot(evs,plot_max):
     """
     This function initializes plots for output from identify_thresh_events() by their peak and volume and calculates averages
@@ -174,6 +211,15 @@ def plot_thresh_duration(data,evs,e,thresh,buffer=1,tangent=True):
     plt.ylabel(ylab)
     plt.legend()
 
+def thresh_duration_spec(data,evs,e,thresh,buffer=1,tangent=True):
+    """
+    This function selects the data of an event for plot_thresh_duration() (e.g., to send to a render process)
+    :return: dict, keyword arguments of plot_thresh_duration()
+    """
+    var = data.columns[0]
+    window = data.loc[evs.loc[e,"start_idx"]-dt.timedelta(days=buffer):evs.loc[e,"end_idx"]+dt.timedelta(days=buffer),[var]]
+    return {"data":window,"evs":evs.loc[[e]],"e":e,"thresh":thresh,"buffer":buffer,"tangent":tangent}
+
 def analyze_volwindow_duration(data,evs,e,resdat,buffer=1,plot=True):
     """
     This function produces volume-window plots as used for the Folsom WCM
@@ -283,6 +329,7 @@ def analyze_volwindow_duration(data,evs,e,resdat,buffer=1,plot=True):
 
 cfs_af = 24*60*60/43560
 
+@timed
 def route(hydro,start,rating):
     output = pd.DataFrame()
     start_af = interp(start,rating.FB,rating.AF)
@@ -308,26 +355,33 @@ def route(hydro,start,rating):
     return output
 
 
-def analyze_cvhs_duration(data,evs,min_peak,hydro_dur,by,rating_file,start,plot=False):
-    if min_peak == 0:
-        print("Warning! Highly recommended a minumum peak be used for CVHS method!")
-
-    # First, develop proxy curves
+@timed
+def cvhs_vol_table(data,durations,decimal=2):
+    """
+    This function develops the proxy volume table used by the CVHS method (largest ann. max. average for each duration)
+    :param data: df, data including at least date, variable, wy
+    :param durations: list, durations to analyze
+    :param decimal: int, number of decimals to use
+    :return: df, pp and flow of the largest event for each duration
+    """
+    # Use the duration surface (single cumulative sum) for all durations
+    surface = voldur_surface(data,durations,decimal)
+    vol_table = pd.DataFrame(index=list(durations))
+    # select largest event, record pp
+    vol_table["pp"] = 1/(surface.count().values+1)
+    vol_table["flow"] = surface.max().values
+    return vol_table
+
+def cvhs_hydros(data,evs,min_peak,hydro_dur):
+    """
+    This function extracts a hydro_dur hydrograph for each event above the peak limit
+    :param data: df, data including at least date, variable
+    :param evs: df, output from identify_thresh_events()
+    :param min_peak: float, user specified peak limit
+    :param hydro_dur: int, max duration to analyze
+    :return: df, hydrographs (columns are event start dates)
+    """
     var = data.columns[0]
-    durations = range(1,hydro_dur+1,by)
-    vol_table = pd.DataFrame()
-
-    for dur in durations:
-        # identify duration volumes
-        df_dur = analyze_voldur(data,dur)
-        # identify pp
-        df_dur_pp = calc_pp(df_dur["avg_flow"])
-        # select largest event, record pp
-        vol_table.loc[dur,"pp"] = df_dur_pp.loc[0,"pp"]
-        vol_table.loc[dur,"flow"] = df_dur_pp.loc[0,"avg_flow"]
-    vol_table.to_csv("critical/cvhs/vol_table.csv")
-
-    # Second, identify hydrographs
     evs_sel = evs.loc[evs["peak"] > min_peak]
     hydros = pd.DataFrame()
     for e in evs_sel.index:
@@ -336,33 +390,21 @@ def analyze_cvhs_duration(data,evs,min_peak,hydro_dur,by,rating_file,start,plot=
         elif evs_sel.loc[e,"duration"] == hydro_dur:
             shift = 0
         hydros.loc[:,evs_sel.loc[e,"start_idx"]] = data.loc[evs_sel.loc[e,"start_idx"]-dt.timedelta(days=np.floor(shift/3)):evs_sel.loc[e,"end_idx"]+dt.timedelta(days=np.ceil(2*shift/3)),var].reset_index(drop=True)
-    hydros.to_csv("critical/cvhs/hydros.csv")
-
-    # Third, define rating curve and check start
-    rating = pd.read_csv(rating_file)
-    if start < rating.FB.min() or start > rating.FB.max():
-        print("Start outside of range of FB in rating file; please correct!")
-        return
-
-    # Fourth, begin analysis
-    output = vol_table.copy()
-    route_out = np.zeros((len(hydros.columns),hydro_dur,hydro_dur,4))
-    for h,hydro in enumerate(hydros.columns):
-        if plot:
-            colors = ['#a6cee3','#1f78b4','#b2df8a','#33a02c','#fb9a99','#e31a1c','#fdbf6f','#ff7f00','#cab2d6','#6a3d9a','#ffff99','#b15928']
-            while len(durations)>len(colors):
-                colors=colors*2
-
-            fig, ax = plt.subplots(figsize=(8, 3.5))
-            plt.title = f"{hydro}"
-            ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
-            plt.ylabel('Flow (ft$^3$s)')
-            plt.xlabel('Day')
-
-        for d,dur in enumerate(durations):
+    return hydros
 
+def cvhs_scale_hydros(hydros,vol_table,durations):
+    """
+    This function volume scales each hydrograph to the proxy volume of each duration
+    :param hydros: df, output from cvhs_hydros()
+    :param vol_table: df, output from cvhs_vol_table()
+    :param durations: list, durations to analyze
+    :return: dict, scaled hydrographs keyed by (hydro, dur)
+    """
+    scaled = dict()
+    for hydro in hydros.columns:
+        hydro_in = hydros.loc[:,hydro]
+        for dur in durations:
             # create volume scaled hydrograph
-            hydro_in = hydros.loc[:,hydro]
             hydro_vol = hydro_in.rolling(dur).mean()
             hydro_vol_max = hydro_vol.idxmax()
             hydro_scale = hydro_in.copy()
@@ -375,26 +417,181 @@ def analyze_cvhs_duration(data,evs,min_peak,hydro_dur,by,rating_file,start,plot=
                     hydro_scale.loc[hydro_vol_max-dur+1:hydro_vol_max+1]*vr
             else:
                 hydro_scale.loc[hydro_vol_max] = hydro_scale.loc[hydro_vol_max]*vr
+            scaled[(hydro,dur)] = hydro_scale
+    return scaled
+
+def check_start(start,rating):
+    """
+    This function checks that the start elevation is within the rating
+    :param start: float, start elevation
+    :param rating: df, rating including at least FB
+    :return: boolean
+    """
+    if start < rating.FB.min() or start > rating.FB.max():
+        print(f"Start ({start}) outside of range of FB in rating file; please correct!")
+        return False
+    return True
+
+def plot_cvhs_hydro(hydro,hydro_in,inflows):
+    """
+    This function plots the volume scaled and routed inflow of each duration for a hydrograph (CVHS)
+    :param hydro: timestamp, hydrograph (event start)
+    :param hydro_in: series, raw hydrograph
+    :param inflows: list, routed inflow of each duration
+    :return: figure
+    """
+    colors = ['#a6cee3','#1f78b4','#b2df8a','#33a02c','#fb9a99','#e31a1c','#fdbf6f','#ff7f00','#cab2d6','#6a3d9a','#ffff99','#b15928']
+    while len(inflows)>len(colors):
+        colors=colors*2
+
+    fig, ax = plt.subplots(figsize=(8, 3.5))
+    plt.title(f"{hydro}")
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    plt.ylabel('Flow (ft$^3$s)')
+    plt.xlabel('Day')
+    for d,inflow in enumerate(inflows):
+        if d==0:
+            inf_lab = "Inflow"
+        else:
+            inf_lab = "_nolegend_"
+        plt.plot(inflow,color=colors[d],linestyle="solid",label=inf_lab)
+    plt.plot(hydro_in,color="black",linestyle="dashed",linewidth=0.5,label='Raw Hydro')
+    plt.legend()
+
+@register_template(plot_cvhs_hydro)
+def update_cvhs_hydro(fig,hydro,hydro_in,inflows):
+    """
+    This function updates a CVHS hydrograph plot (from plot_cvhs_hydro()) with another hydrograph
+    :param fig: figure, output from plot_cvhs_hydro()
+    :return: boolean, False if the number of durations differs
+    """
+    ax = fig.axes[0]
+    if len(ax.lines) != len(inflows)+1:
+        return False
+    for line,flow in zip(ax.lines,inflows+[hydro_in]):
+        line.set_data(flow.index,flow.values)
+    ax.set_title(f"{hydro}")
+    ax.relim()
+    ax.autoscale_view()
+    return True
+
+@timed
+def analyze_cvhs_duration(data,evs,min_peak,hydro_dur,by,rating_file,start,plot=False,decimal=2,outdir="critical/cvhs",vol_table=None):
+    if min_peak == 0:
+        print("Warning! Highly recommended a minumum peak be used for CVHS method!")
+
+    # First, develop proxy curves
+    durations = range(1,hydro_dur+1,by)
+    if vol_table is None:
+        vol_table = cvhs_vol_table(data,durations,decimal)
+    vol_table.to_csv(f"{outdir}/vol_table.csv")
+
+    # Second, identify hydrographs
+    hydros = cvhs_hydros(data,evs,min_peak,hydro_dur)
+    hydros.to_csv(f"{outdir}/hydros.csv")
+
+    # Third, define rating curve and check start
+    rating = pd.read_csv(rating_file)
+    if not check_start(start,rating):
+        return
+
+    # Fourth, begin analysis
+    output = vol_table.copy()
+    scaled = cvhs_scale_hydros(hydros,vol_table,durations)
+    route_out = np.zeros((len(hydros.columns),hydro_dur,hydro_dur,4))
+    for h,hydro in enumerate(hydros.columns):
+        hydro_in = hydros.loc[:,hydro]
+        inflows = list()
+
+        for d,dur in enumerate(durations):
             # route hydrograph
-            routed = route(hydro_scale,start,rating)
-            routed.to_csv(f"critical/cvhs/{hydro.year}_{dur}.csv")
+            routed = route(scaled[(hydro,dur)],start,rating)
+            routed.to_csv(f"{outdir}/{hydro.year}_{dur}.csv")
 
             route_out[h,d,:,:] = np.array(routed)
             output.loc[dur,hydro.year] = route_out[h,d,:,1].max()
+            inflows.append(routed.q)
+
+        # Plot routed hydrographs (in a render process if set)
+        if plot:
+            render(plot_cvhs_hydro,f"{outdir}/{hydro.year}.jpg",dpi=300,bbox_inches="tight",
+                   family=f"{outdir}/cvhs_hydrographs",hydro=hydro,hydro_in=hydro_in,inflows=inflows)
 
-            if plot:
-                if d==0:
-                    inf_lab = "Inflow"
-                    out_lab = "Outflow"
-                else:
-                    inf_lab = "_nolegend_"
-                    out_lab = "_nolegend_"
-                plt.plot(routed.q,color=colors[d],linestyle="solid",label=inf_lab)
-                #plt.plot(routed.qd,color=colors[d],linestyle="dotted",label=out_lab)
-        plt.plot(hydro_in,color="black",linestyle="dashed",linewidth=0.5,label='Raw Hydro')
-        plt.legend()
-        plt.savefig(f"critical/cvhs/{hydro.year}.jpg", dpi=300, bbox_inches="tight")
-        plt.close()
+    close_family(f"{outdir}/cvhs_hydrographs")
 
     output.loc[:,"mean"] = output.iloc[:,2:].mean(axis=1)
     return(output)
+
+@timed
+def analyze_cvhs_sweep(data,evs,min_peak,hydro_dur,by,rating_files,starts,decimal=2,outdir="critical/cvhs",vol_table=None):
+    """
+    This function repeats the CVHS analysis for a grid of start elevations (and rating curves). The proxy volume table
+    and volume scaled hydrographs are developed once; only the routing is repeated.
+    :param data: df, data including at least date, variable, wy
+    :param evs: df, output from identify_thresh_events()
+    :param min_peak: float, user specified peak limit
+    :param hydro_dur: int, max duration to analyze
+    :param by: int, step between durations
+    :param rating_files: str or list, .csv file(s) with FB (elevation), QD (discharge), AF (storage)
+    :param starts: float or list, start elevations
+    :param decimal: int, number of decimals to use
+    :param outdir: str, output directory
+    :param vol_table: df, output from cvhs_vol_table() (developed if None)
+    :return: df, max stage for each rating, start and duration (cube)
+    """
+    if min_peak == 0:
+        print("Warning! Highly recommended a minumum peak be used for CVHS method!")
+    if not isinstance(rating_files,list):
+        rating_files = [rating_files]
+    if not isinstance(starts,list):
+        starts = [starts]
+
+    # Develop proxy curves, hydrographs and scaled hydrographs once
+    durations = range(1,hydro_dur+1,by)
+    if vol_table is None:
+        vol_table = cvhs_vol_table(data,durations,decimal)
+    vol_table.to_csv(f"{outdir}/vol_table.csv")
+    hydros = cvhs_hydros(data,evs,min_peak,hydro_dur)
+    hydros.to_csv(f"{outdir}/hydros.csv")
+    scaled = cvhs_scale_hydros(hydros,vol_table,durations)
+
+    # Route for each rating and start
+    cube = list()
+    for rating_file in rating_files:
+        rating = pd.read_csv(rating_file)
+        for start in starts:
+            if not check_start(start,rating):
+                continue
+            print(f"Routing {rating_file} from {start}")
+            output = vol_table.copy()
+            for hydro in hydros.columns:
+                for dur in durations:
+                    routed = route(scaled[(hydro,dur)],start,rating)
+                    output.loc[dur,hydro.year] = routed["fb"].max()
+            output.loc[:,"mean"] = output.iloc[:,2:].mean(axis=1)
+            output.index.name = "duration"
+            output.insert(0,"start",start)
+            output.insert(0,"rating",rating_file)
+            cube.append(output.reset_index())
+
+    if len(cube)==0:
+        return
+    cube = pd.concat(cube,ignore_index=True)
+    cube = cube.set_index(["rating","start","duration"])
+    return cube
+
+def summarize_cvhs_sweep(cube):
+    """
+    This function summarizes the critical (max mean stage) duration for each rating and start
+    :param cube: df, output from analyze_cvhs_sweep()
+    :return: df, critical duration and max mean stage for each rating and start
+    """
+    summary = pd.DataFrame()
+    for (rating,start),group in cube.groupby(level=["rating","start"],sort=False):
+        mean = group["mean"].droplevel(["rating","start"])
+        summary.loc[f"{rating}|{start}","rating"] = rating
+        summary.loc[f"{rating}|{start}","start"] = start
+        summary.loc[f"{rating}|{start}","crit_dur"] = mean.idxmax()
+        summary.loc[f"{rating}|{start}","max_stage"] = mean.max()
+    summary = summary.reset_index(drop=True)
+    return summary
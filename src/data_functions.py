@@ -6,13 +6,33 @@
 This script contains the data preparation functions and pre-defined variables used in the duration analyses 1a and b
 
 """
-import dataretrieval.nwis as nwis
-import dataretrieval as dr
+import os
 import pandas as pd
 import numpy as np
 import datetime as dt
-from requests import get as r_get
 from io import StringIO
+from src.functions import season_mask
+from src.profile_functions import timed
+
+### WEB SERVICES ###
+# Base url of each web service (DURATION_SERVICE_URL, e.g., a local mock server, replaces all; see src/mock_functions.py)
+service_urls = {"nwis":"https://waterservices.usgs.gov/nwis/",
+                "nwis_peak":"https://nwis.waterdata.usgs.gov/nwis/",
+                "snotel":"https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR/",
+                "cpn":"https://www.usbr.gov/pn-bin/",
+                "mbart":"https://www.usbr.gov/gp-bin/",
+                "ucb":"https://www.usbr.gov/uc/water/hydrodata/reservoir_data/"}
+
+def service_url(service):
+    """
+    Function to find the base url of a web service
+    :param service: str, key of service_urls
+    :return: str, base url (ending with /)
+    """
+    base = os.environ.get("DURATION_SERVICE_URL")
+    if base is None or base == "":
+        return service_urls[service]
+    return f"{base.rstrip('/')}/{service}/"
 
 ### DATA PREP FUNCTIONS ###
 def csv_daily_import(filename,single=True):
@@ -48,6 +68,7 @@ def csv_daily_import(filename,single=True):
 
     return(out)
 
+@timed
 def nwis_import(site, dtype, start=None, end=None):
     """
     Imports flows from NWIS site
@@ -58,6 +79,10 @@ def nwis_import(site, dtype, start=None, end=None):
     :param wy: str, "WY
     :return: dataframe with date index, dates, flows, month, year and water year
     """
+    import dataretrieval.nwis as nwis
+    import dataretrieval as dr
+    nwis.WATERSERVICE_URL = service_url("nwis")
+
     if dtype == "dv":
         parameter = "00060_Mean"
     elif dtype == "iv":
@@ -111,6 +136,7 @@ def nwis_import(site, dtype, start=None, end=None):
 
     return(out)
 
+@timed
 def import_snotel(site,stype,vars=["WTEQ","SNWD","PREC","TAVG"],verbose=False,inc=False):
     """Download NRCS SNOTEL data
 
@@ -129,6 +155,8 @@ def import_snotel(site,stype,vars=["WTEQ","SNWD","PREC","TAVG"],verbose=False,in
         dataframe
 
     """
+    from requests import get as r_get
+
     print(site)
     # Get snotel file
     snotel_sites = pd.read_csv("src/snotel_sites.csv")
@@ -151,7 +179,7 @@ def import_snotel(site,stype,vars=["WTEQ","SNWD","PREC","TAVG"],verbose=False,in
     for var in vars:
         if verbose == True:
             print("Importing {} data".format(var))
-        site_url = f"https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR/{var}/{state}/{name}.csv"
+        site_url = f"{service_url('snotel')}{var}/{state}/{name}.csv"
         print(site_url)
         if verbose == True:
             print(site_url)
@@ -207,7 +235,6 @@ def import_snotel(site,stype,vars=["WTEQ","SNWD","PREC","TAVG"],verbose=False,in
             # Set appropriate rows in snotel_in
             snotel_in.loc[year_data.index,var] = year_data
 
-
         # For precip, calculate incremental precip and remove negative values
         if var == "PREC" and inc==True:
             if verbose == True:
@@ -241,25 +268,28 @@ def import_snotel(site,stype,vars=["WTEQ","SNWD","PREC","TAVG"],verbose=False,in
 
     return (data)
 
+@timed
 def import_hydromet(site,var,region,verbose=False):
+    from requests import get as r_get
+
     # Set today's date
     today = dt.datetime.today()
 
     # Build site url depending on region
     if region in ["cpn","CPN","pn","PN"]:
         reg = "CPN"
-        site_url = f"https://www.usbr.gov/pn-bin/daily.pl?station={site}&format=html&year={1900}&month={10}&day={1}&year={today.year}&month={today.month}&day={today.day}&pcode={var}"
+        site_url = f"{service_url('cpn')}daily.pl?station={site}&format=html&year={1900}&month={10}&day={1}&year={today.year}&month={today.month}&day={today.day}&pcode={var}"
 
     elif region in ["GP","gp","MBART","mbart","MB","mb"]:
         reg = "MBART"
-        site_url = f"https://www.usbr.gov/gp-bin/webarccsv.pl?parameter={site}%20{var}&syer={1900}&smnth={10}&sdy={1}&eyer={today.year}&emnth={today.month}&edy={today.day}&format=2"
+        site_url = f"{service_url('mbart')}webarccsv.pl?parameter={site}%20{var}&syer={1900}&smnth={10}&sdy={1}&eyer={today.year}&emnth={today.month}&edy={today.day}&format=2"
 
     elif region in ["UC","uc","UCB","ucb"]:
         reg = "UCB"
         ucb_dict = {"af":"17","storage":"17","in":"29","qu":"29","qd":"42","fb":"49","elev":"49","stage":"49"}
         if var in ucb_dict.keys():
             var = ucb_dict[var]
-        site_url = f"https://www.usbr.gov/uc/water/hydrodata/reservoir_data/{site}/csv/{var}.csv"
+        site_url = f"{service_url('ucb')}{site}/csv/{var}.csv"
 
     else:
         return None
@@ -323,6 +353,7 @@ def import_hydromet(site,var,region,verbose=False):
 
     return out
 
+@timed
 def import_daily(site_source,wy_division,decimal,zero=False):
     if isinstance(site_source,list):
         if site_source[2] in ["sntl","SNTL"]:
@@ -411,16 +442,19 @@ def summarize_daily(site_daily,var=None):
     summary.loc["all","mean"] = site_daily[var].mean()
     summary.loc["all","median"] = site_daily[var].median()
     summary.loc["all", "sd"] = site_daily[var].std()
-    for wy in site_daily["wy"].unique():
-        wy_daily = site_daily.loc[site_daily["wy"] == wy]
-        summary.loc[wy, "start"] = wy_daily.index.min()
-        summary.loc[wy, "end"] = wy_daily.index.max()
-        summary.loc[wy, "count"] = wy_daily[var].count()
-        summary.loc[wy, "max"] = wy_daily[var].max()
-        summary.loc[wy, "min"] = wy_daily[var].min()
-        summary.loc[wy, "mean"] = wy_daily[var].mean()
-        summary.loc[wy, "median"] = wy_daily[var].median()
-        summary.loc[wy, "sd"] = wy_daily[var].std()
+
+    # Summarize each WY in a single grouped pass
+    dates = site_daily.index.to_series()
+    wy_group = site_daily[var].groupby(site_daily["wy"],sort=False)
+    wy_summary = pd.DataFrame({"start":dates.groupby(site_daily["wy"],sort=False).min(),
+                               "end":dates.groupby(site_daily["wy"],sort=False).max(),
+                               "count":wy_group.count(),
+                               "max":wy_group.max(),
+                               "min":wy_group.min(),
+                               "mean":wy_group.mean(),
+                               "median":wy_group.median(),
+                               "sd":wy_group.std()})
+    summary = pd.concat([summary,wy_summary])
 
     return summary
 
@@ -447,12 +481,17 @@ def csv_peak_import(filename):
 
     return(out)
 
+@timed
 def nwis_peak_import(site):
     """
     Imports flows from NWIS site
     :param site: str, USGS site number
     :return: dataframe with date index, dates, flows, month, year and water year
     """
+    import dataretrieval.nwis as nwis
+    import dataretrieval as dr
+    nwis.WATERDATA_URL = service_url("nwis_peak")
+
     parameter = "00060"
     dtype = "peaks"
 
@@ -480,6 +519,7 @@ def nwis_peak_import(site):
 
     return(out)
 
+@timed
 def import_peaks(site_source):
     if ".csv" in site_source:
         # Load from .csv file
@@ -500,19 +540,11 @@ def season_subset(data,season_idx,var):
     """
     Function to screen out data by season
     :param data: df, input data with at least var,month,doy
-    :param season_idx: list, either months (cy) or [min,max] doy (cy)
+    :param season_idx: list, either months (cy) or [min,max] doy (cy); min > max wraps the end of the year
     :return: df, seasonal data
     """
     data = data.copy()
-    # If all values are < 12; assume to be months
-    if max(season_idx) <= 12:
-        data.loc[~data["month"].isin(season_idx), var] = np.nan
-    # Else, if only two values are given; assume to be DOYs [S,F]
-    elif len(season_idx) == 2:
-        data.loc[data["doy"] < season_idx[0], var] = np.nan
-        data.loc[data["doy"] > season_idx[1], var] = np.nan
-    else:
-        print("Format of season not recognized. Please provide a list of months (CY) or start and end day of year (CY)")
+    data.loc[~season_mask(data,season_idx), var] = np.nan
     return data
 
 
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+### ENGINE FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the engine switch of the analysis kernels that have more than one implementation (engine):
+    durtable -- flow duration tables (analyze_dur()); "single_sort" (tied values of _raw files may be in another date
+                order)
+    evs -- threshold events (identify_thresh_events()); "numpy"
+    doy_data -- day of WY traces (plot_wytraces()); "numpy"
+    volumes -- ann. max. volumes of script 4 (stage_4()); "multi" (all durations and seasons from a single cumulative
+               sum, used by default); the reference runs analyze_voldur() for each season and duration
+The "reference" engine of each kernel is the original implementation; other engines are registered with
+@register_engine(kernel,name) next to the reference. Only engines shown to give the same tables as the reference (see
+compare_engines() in src/equivalence_functions.py) should be used for production runs.
+
+"""
+import os
+import json
+
+# Engine used for each kernel, and engines available for each kernel
+kernel_engines = {"durtable":"reference","evs":"reference","doy_data":"reference","volumes":"multi"}
+engine_registry = {kernel:{"reference":None} for kernel in kernel_engines.keys()}
+
+def register_engine(kernel,name):
+    """
+    Decorator to register an alternative engine of a kernel
+    :param kernel: str, kernel name
+    :param name: str, engine name
+    :return: function
+    """
+    def register(func):
+        engine_registry.setdefault(kernel,{"reference":None})[name] = func
+        return func
+    return register
+
+def set_engines(engines=None,**kwargs):
+    """
+    Function to select the engine of each kernel, in this process and in processes started after (e.g., batch workers)
+    :param engines: dict, engine for each kernel (e.g., {"evs":"numpy"}); kernels not listed are not changed
+    :return: dict, previous engines
+    """
+    previous = dict(kernel_engines)
+    engines = dict() if engines is None else dict(engines)
+    engines.update(kwargs)
+    for kernel,name in engines.items():
+        if kernel not in kernel_engines.keys():
+            raise ValueError(f"Unknown kernel {kernel}; kernels are {list(kernel_engines.keys())}")
+        kernel_engines[kernel] = "reference" if name is None else name
+    os.environ["DURATION_ENGINES"] = json.dumps(kernel_engines)
+    return previous
+
+def get_engine(kernel):
+    """
+    Function to find the engine used for a kernel
+    :param kernel: str, kernel name
+    :return: function, engine (None for the reference engine)
+    """
+    name = kernel_engines.get(kernel,"reference")
+    if name == "reference":
+        return None
+    if name not in engine_registry[kernel].keys():
+        raise ValueError(f"Unknown engine {name} for {kernel}; engines are {list(engine_registry[kernel].keys())}")
+    return engine_registry[kernel][name]
+
+# Engines selected by the parent process (e.g., of batch workers)
+if os.environ.get("DURATION_ENGINES"):
+    kernel_engines.update(json.loads(os.environ["DURATION_ENGINES"]))
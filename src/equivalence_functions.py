@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+### EQUIVALENCE FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used to check that the alternative engines of the analysis kernels (see
+src/engine_functions.py, e.g., the "multi" engine of script 4 volumes) give the same tables as the reference engine.
+Each kernel is run with the reference and every other engine on synthetic and real records, and every output table is
+compared cell by cell within tolerance (dates and text exactly; the dates of tied values in sorted flow duration
+values are compared in date order). Reference tables can be saved to a golden directory and compared with later runs
+(e.g., after changing a kernel or updating pandas).
+
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+from src.engine_functions import engine_registry,set_engines,get_engine
+from src.functions import wy_completeness
+from src.flow_functions import analyze_dur,wytrace_table,annualcombos,monthcombos,standard
+from src.vol_functions import analyze_voldur
+from src.crit_functions import identify_thresh_events
+
+# Settings of the kernel cases
+eq_quantiles = [0,0.5,0.9,0.98] # thresholds of the evs kernel (quantiles of the record)
+eq_durations = ["WY",1,3,7,15,30] # durations of the volumes kernel
+
+### RECORD FUNCTIONS
+def golden_records(years=[5,30],missing=[0.0,0.05],seed=0,site_sources=[],wy_division="WY",decimal=1):
+    """
+    Function to create the records used to compare engines
+    :param years: list, record lengths of synthetic records
+    :param missing: list, missing-data rates of synthetic records
+    :param seed: int, random seed of synthetic records
+    :param site_sources: list, real records: site_daily files (output of script 1a) or site sources (as for script 1a)
+    :param wy_division: str, "WY" or "CY"
+    :param decimal: int, number of decimal places to use in data
+    :return: dict, site_daily df for each record
+    """
+    from src.synthetic_functions import synthetic_daily
+    records = dict()
+    for n in years:
+        for m in missing:
+            # Records start within a WY and with missing values, as real records often do
+            records[f"synthetic_{n}y_{m}"] = synthetic_daily(n,m,1.0,"D",seed+n,"1951-11-15",wy_division,decimal)
+    for site_source in site_sources:
+        if isinstance(site_source,str) and site_source.endswith("_site_daily.csv"):
+            name = os.path.basename(site_source).replace("_site_daily.csv","")
+            records[name] = pd.read_csv(site_source,parse_dates=True,index_col=0)
+        else:
+            from src.data_functions import import_daily
+            name = site_source[0] if isinstance(site_source,list) else os.path.basename(site_source).split(".")[0]
+            records[name] = import_daily(site_source,wy_division,decimal)
+    return records
+
+### KERNEL CASES
+def data_decimal(data):
+    var = data.columns[0]
+    return max(str(data[var].dropna().head(1).item()).find('.'),0) if data[var].notna().any() else 1
+
+def tie_order(dur_ep):
+    """
+    Function to sort the dates of tied values of sorted values with exceedance probability (output from calculate_ep()),
+    as the order of tied values depends on the sort algorithm
+    :param dur_ep: df, sorted values with exceedance probability
+    :return: df, dur_ep with the dates of tied values in order
+    """
+    date_col,var = dur_ep.columns[0],dur_ep.columns[1]
+    order = np.lexsort((dur_ep[date_col].values,-dur_ep[var].values))
+    dur_ep = dur_ep.copy()
+    dur_ep[date_col] = dur_ep[date_col].values[order]
+    return dur_ep
+
+def case_durtable(data):
+    import matplotlib.pyplot as plt
+    var = data.columns[0]
+    tables = dict()
+    for name,combos in [("annual",annualcombos),("monthly",monthcombos)]:
+        tables[name],raw = analyze_dur(data,combos,standard,var,data_decimal(data))
+        plt.close("all")
+        for key,dur_ep in zip(tables[name].columns,raw):
+            tables[f"{name}_raw_{key}"] = tie_order(dur_ep)
+    return tables
+
+def case_evs(data):
+    var = data.columns[0]
+    return {f"q{q}":identify_thresh_events(data,data[var].quantile(q)) for q in eq_quantiles}
+
+def case_doy_data(data):
+    return {"WY":wytrace_table(data,"WY",complete=wy_completeness(data)),"CY":wytrace_table(data,"CY")}
+
+def case_volumes(data):
+    # Annual volumes, as run by stage_4()
+    engine = get_engine("volumes")
+    if engine is not None:
+        return engine(data,eq_durations,data_decimal(data),{None:np.ones(len(data),dtype=bool)})[None]
+    complete = wy_completeness(data)
+    return {dur:analyze_voldur(data,dur,data_decimal(data),complete)[0] for dur in eq_durations}
+
+kernel_cases = {"durtable":case_durtable,"evs":case_evs,"doy_data":case_doy_data,"volumes":case_volumes}
+
+def kernel_engine_names(kernel):
+    """
+    Function to list the engines of a kernel
+    :param kernel: str, kernel name
+    :return: list, engines (reference first)
+    """
+    return list(engine_registry[kernel].keys())
+
+def run_kernel(kernel,engine,data):
+    """
+    Function to run a kernel case with an engine
+    :param kernel: str, kernel name
+    :param engine: str, engine name
+    :param data: df, site_daily
+    :return: dict, dict: output tables, and wall time (s)
+    """
+    start = time.perf_counter()
+    previous = set_engines({kernel:engine})
+    try:
+        tables = kernel_cases[kernel](data)
+    finally:
+        set_engines({kernel:previous[kernel]})
+    return tables,time.perf_counter()-start
+
+### COMPARISON FUNCTIONS
+def column_values(col):
+    """
+    Function to find the kind and values of a table column for comparison
+    :param col: series, column
+    :return: str, array: "datetime" (ns), "number" or "text", and values
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return "datetime",col.values.astype("datetime64[ns]").astype("int64").astype(float)
+    non_null = col.dropna()
+    if len(non_null)>0 and col.dtype==object and all(isinstance(v,(pd.Timestamp,np.datetime64)) for v in non_null):
+        dates = pd.to_datetime(col)
+        return "datetime",np.where(dates.isna(),np.nan,dates.values.astype("datetime64[ns]").astype("int64").astype(float))
+    numbers = pd.to_numeric(col,errors="coerce")
+    if numbers.notna().sum() == non_null.shape[0]:
+        return "number",numbers.values.astype(float)
+    return "text",col.astype(str).where(col.notna(),"").values
+
+def diff_tables(ref,alt,rtol=1e-9,atol=1e-9):
+    """
+    Function to compare an engine table with the reference table (|alt-ref| <= atol+rtol*|ref| for numbers, dates and
+    text exactly; missing values must match)
+    :param ref: df, reference table
+    :param alt: df, engine table
+    :param rtol: float, relative tolerance
+    :param atol: float, absolute tolerance
+    :return: dict, match, number of cells compared and different, largest differences and notes
+    """
+    notes = list()
+    missing_cols = [c for c in ref.columns if c not in alt.columns]
+    extra_cols = [c for c in alt.columns if c not in ref.columns]
+    if len(missing_cols)>0:
+        notes.append(f"missing columns {missing_cols}")
+    if len(extra_cols)>0:
+        notes.append(f"extra columns {extra_cols}")
+    if len(ref) != len(alt) or not np.array_equal(ref.index.astype(str),alt.index.astype(str)):
+        notes.append(f"index differs ({len(ref)} vs {len(alt)} rows)")
+        return {"match":False,"cells":0,"diffs":None,"max_abs":None,"max_rel":None,"notes":"; ".join(notes)}
+
+    cells,diffs,max_abs,max_rel = 0,0,0.0,0.0
+    for c in [c for c in ref.columns if c in alt.columns]:
+        kind,a = column_values(ref[c])
+        alt_kind,b = column_values(alt[c])
+        cells += len(a)
+        if kind != alt_kind:
+            notes.append(f"{c}: {kind} vs {alt_kind}")
+            diffs += len(a)
+            continue
+        if kind == "text":
+            diffs += int((a!=b).sum())
+            continue
+        nan_diff = np.isnan(a)!=np.isnan(b)
+        ok = ~np.isnan(a) & ~np.isnan(b)
+        err = np.abs(a[ok]-b[ok])
+        tol = 0 if kind == "datetime" else atol+rtol*np.abs(a[ok])
+        diffs += int(nan_diff.sum()+(err>tol).sum())
+        if len(err)>0 and kind == "number":
+            max_abs = max(max_abs,float(err.max()))
+            max_rel = max(max_rel,float((err/np.maximum(np.abs(a[ok]),1e-300)).max()))
+    match = diffs==0 and len(missing_cols)==0
+    return {"match":match,"cells":cells,"diffs":diffs,"max_abs":max_abs,"max_rel":max_rel,"notes":"; ".join(notes)}
+
+def compare_engines(records=None,kernels=None,engines=None,rtol=1e-9,atol=1e-9,golden_dir=None,outdir=None):
+    """
+    Function to compare the tables of every engine of the kernels with the reference tables
+    :param records: dict, site_daily df for each record (golden_records() if None)
+    :param kernels: list, kernels to compare (all if None: durtable, evs, doy_data, volumes)
+    :param engines: dict, engines to compare for each kernel (all registered engines if None)
+    :param rtol: float, relative tolerance
+    :param atol: float, absolute tolerance
+    :param golden_dir: str, directory of saved reference tables (saved when missing), or None to run the reference
+    :param outdir: str, directory to save the reference and engine tables that differ (.csv), or None
+    :return: df, comparison of each record, kernel, engine and table (with wall times of reference and engine)
+    """
+    if records is None:
+        records = golden_records()
+    if kernels is None:
+        kernels = list(kernel_cases.keys())
+    if golden_dir is not None:
+        os.makedirs(golden_dir,exist_ok=True)
+
+    report = list()
+    for record,data in records.items():
+        for kernel in kernels:
+            names = kernel_engine_names(kernel)
+            reference = names[0]
+            golden = None if golden_dir is None else f"{golden_dir}/{record}_{kernel}.pkl"
+            if golden is not None and os.path.isfile(golden):
+                ref_tables,ref_s = pd.read_pickle(golden),None
+            else:
+                ref_tables,ref_s = run_kernel(kernel,reference,data)
+                if golden is not None:
+                    pd.to_pickle(ref_tables,golden)
+            sel = names[1:] if engines is None or kernel not in engines.keys() else engines[kernel]
+            for engine in sel:
+                alt_tables,alt_s = run_kernel(kernel,engine,data)
+                for table,ref in ref_tables.items():
+                    if table not in alt_tables.keys():
+                        result = {"match":False,"cells":0,"diffs":None,"max_abs":None,"max_rel":None,"notes":"missing table"}
+                    else:
+                        result = diff_tables(ref,alt_tables[table],rtol,atol)
+                    report.append({"record":record,"kernel":kernel,"engine":engine,"table":str(table),**result,
+                                   "reference_s":None if ref_s is None else round(ref_s,4),"engine_s":round(alt_s,4)})
+                    if outdir is not None and not result["match"] and table in alt_tables.keys():
+                        os.makedirs(outdir,exist_ok=True)
+                        ref.to_csv(f"{outdir}/{record}_{kernel}_{table}_{reference}.csv")
+                        alt_tables[table].to_csv(f"{outdir}/{record}_{kernel}_{table}_{engine}.csv")
+    report = pd.DataFrame(report)
+    if len(report)>0:
+        by = ["kernel","engine"]
+        summary = report.groupby(by,sort=False).agg(tables=("match","size"),matched=("match","sum"),
+                                                    max_abs=("max_abs","max"))
+        # Wall times of each record (not each table)
+        runs = report.drop_duplicates(["record"]+by).groupby(by,sort=False)[["reference_s","engine_s"]].sum(min_count=1)
+        print(summary.join(runs).to_string())
+        failed = report.loc[~report["match"]]
+        if len(failed)>0:
+            print(f"{len(failed)} tables differ from the reference:")
+            print(failed[["record","kernel","engine","table","diffs","max_abs","notes"]].to_string(index=False))
+        else:
+            print("All engines match the reference.")
+    return report
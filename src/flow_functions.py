@@ -8,9 +8,9 @@ This script contains the flow duration analysis functions and pre-defined variab
 """
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from src.functions import get_varlabel
+from src.functions import plt,mpl,get_varlabel,wy_completeness
+from src.profile_functions import timed
+from src.engine_functions import register_engine,get_engine
 
 
 ### FLOW DURATION FUNCTIONS ###
@@ -87,15 +87,20 @@ standard = ["Max",
             "Min"]
 
 # Define functions
-def calculate_ep(data, combo):
+@timed
+def calculate_ep(data, combo, mask=None):
     """
     Calculates exceedance probabilities for flow duration given selected months
     :param data: df, containing at least date, month and flow
     :param combo: list, months being analyzed
+    :param mask: array, boolean season mask (output from season_mask()) or None
     :return: df, sorted values with exceedance probability
     """
     var = data.columns[0]
-    x = data.loc[data["month"].isin(combo), var]
+    sel = data["month"].isin(combo)
+    if mask is not None:
+        sel = sel & mask
+    x = data.loc[sel, var]
     x = x.dropna()
     dur_ep = x.sort_values(ascending=False)
     dur_ep = dur_ep.reset_index()
@@ -106,6 +111,41 @@ def calculate_ep(data, combo):
     #    dur_ep["flow"] = [0,0]
     return (dur_ep)
 
+@timed
+def calculate_ep_seasonal(data, masks, combo=annualcombos["Annual"]):
+    """
+    Calculates exceedance probabilities for flow duration for each season with a single sort
+    :param data: df, containing at least date, month and flow
+    :param masks: dict, boolean array for each season (output from season_masks())
+    :param combo: list, months being analyzed
+    :return: dict, sorted values with exceedance probability for each season (as from calculate_ep())
+    """
+    var = data.columns[0]
+    x = data[var]
+    sel = data["month"].isin(combo).values & x.notna().values
+    order = np.argsort(-x.values[sel], kind="stable")
+    sorted_x = x[sel].iloc[order]
+    sorted_pos = np.flatnonzero(sel)[order]
+    season_eps = dict()
+    for season in masks.keys():
+        dur_ep = sorted_x[masks[season][sorted_pos]]
+        dur_ep = dur_ep.reset_index()
+        dur_ep["exceeded"] = (dur_ep.index.values+1)/(len(dur_ep)+1)
+        season_eps[season] = dur_ep
+    return season_eps
+
+@register_engine("durtable","single_sort")
+def calculate_ep_combos(data, combos):
+    """
+    Calculates exceedance probabilities for flow duration for all month combinations with a single sort ("single_sort"
+    engine of analyze_dur())
+    :param data: df, containing at least date, month and flow
+    :param combos: dict, months being analyzed for each combination
+    :return: dict, sorted values with exceedance probability for each combination (as from calculate_ep())
+    """
+    masks = {key:data["month"].isin(combo).values for key,combo in combos.items()}
+    return calculate_ep_seasonal(data,masks)
+
 def summarize_ep(dur_ep,pcts,decimal):
     """
     Creates table using user defined pcts
@@ -130,6 +170,8 @@ def plot_dur_ep():
     Initializes standard duration plot
     :return:
     """
+    import probscale  # registers the 'prob' axis scale
+
     fig, ax = plt.subplots(figsize=(6.25, 4))
     plt.get_cmap("viridis")
     plt.xlabel('Exceedance Probability')
@@ -184,7 +226,8 @@ def plot_monthly_dur_ep(durtable,combos,var):
     ax.set_position([box.x0, box.y0, box.width * 0.9, box.height])
     plt.legend(title="Ex. Prob.",bbox_to_anchor=(1, 0.5), loc='center left',prop={'size': 10})
 
-def analyze_dur(data,combos,pcts,var,decimal):
+@timed
+def analyze_dur(data,combos,pcts,var,decimal,dur_eps=None):
     """
     Conducts flow duration analysis
     :param data: df, raw data with at least date, month, flow
@@ -192,10 +235,14 @@ def analyze_dur(data,combos,pcts,var,decimal):
     :param pcts: list, decimal exceedance probabilities included
     :param var: str, variable name
     :param decimal: int, number of decimals to use
+    :param dur_eps: dict, precomputed output from calculate_ep() for each combo (e.g., calculate_ep_seasonal()) or None
     :return: df, table of results
     """
     full_table = pd.DataFrame(index=pcts)
     plot_dur_ep()
+    engine = get_engine("durtable")
+    if dur_eps is None and engine is not None:
+        dur_eps = engine(data,combos)
 
     b = -1
 
@@ -211,7 +258,10 @@ def analyze_dur(data,combos,pcts,var,decimal):
         b += 1
         print(key)
         combo = combos[key]
-        dur_ep = calculate_ep(data,combo)
+        if dur_eps is not None and key in dur_eps.keys():
+            dur_ep = dur_eps[key]
+        else:
+            dur_ep = calculate_ep(data,combo)
         if dur_ep[var].empty:
             continue
         all_durflows.append(dur_ep)
@@ -229,13 +279,103 @@ def analyze_dur(data,combos,pcts,var,decimal):
         plt.legend()
     return (full_table,all_durflows)
 
-def plot_wytraces(data,wy_division,quantiles=[0.05,0.5,0.95],ax=None,legend=True,sel_wy=None,log=True):
+def wytrace_years(data,wy_division,complete=None):
+    """
+    Finds the WYs (or CYs) of the data for day of WY traces
+    :param data: df, inflows including at least date, flow, wy (or year)
+    :param wy_division: str, "WY" or "CY"
+    :param complete: df, output from wy_completeness() (WYs without valid data are skipped)
+    :return: str, array: column of WYs ("wy" or "year") and WYs
+    """
+    col = "year" if wy_division=="CY" else "wy"
+    WYs = data[col].unique().astype(int)
+    if complete is not None and col!="wy":
+        # Completeness of the CYs (complete is indexed by the WYs of the data, i.e., the division used in script 1a)
+        complete = wy_completeness(data,col=col)
+    if complete is not None:
+        WYs = np.array([wy for wy in WYs if (wy not in complete.index) or (complete.loc[wy,"count"]>0)])
+    return col,WYs
+
+def wytrace_doy(index,wy_division):
+    """
+    Finds the day of WY (or CY) of the dates of a single WY (first 92 days of a WY are Oct-Dec)
+    :param index: DatetimeIndex, dates of the WY
+    :param wy_division: str, "WY" or "CY"
+    :return: array, day of WY
+    """
+    doy_idx = np.array(index.dayofyear)
+    if wy_division=="WY":
+        doy_idx = doy_idx + 92
+        doy_idx[0:92] = np.where(doy_idx[0:92]>365,doy_idx[0:92]-365,doy_idx[0:92])
+    return doy_idx
+
+def wytrace_stats(doy_data,WYs,quantiles):
+    """
+    Adds the mean and quantiles of each day to the day of WY traces
+    :return: df, doy_data
+    """
+    doy_vals = doy_data[WYs].astype(float)
+    doy_data["mean"] = doy_vals.mean(axis=1)
+    for q in quantiles:
+        doy_data[q] = doy_vals.quantile(q,axis=1)
+    return doy_data
+
+def wytrace_table(data,wy_division,quantiles=[0.05,0.5,0.95],complete=None):
+    """
+    Arranges the data by day of WY (rows) and WY (columns), with the mean and quantiles of each day
+    :param data: df, inflows including at least date, flow, wy (or year)
+    :param wy_division: str, "WY" or "CY"
+    :param quantiles: list, quantiles of each day
+    :param complete: df, output from wy_completeness() (WYs without valid data are skipped)
+    :return: df, doy_data
+    """
+    engine = get_engine("doy_data")
+    if engine is not None:
+        return engine(data,wy_division,quantiles,complete)
+    var = data.columns[0]
+    col,WYs = wytrace_years(data,wy_division,complete)
+    doy_data = pd.DataFrame(index=range(1,367),columns=WYs)
+
+    # Split data by WY in a single grouped pass
+    for wy,wy_data in data.groupby(col,sort=False):
+        if int(wy) not in doy_data.columns:
+            continue
+        doy_data.loc[wytrace_doy(wy_data.index,wy_division),int(wy)] = wy_data[var].values
+    return wytrace_stats(doy_data,WYs,quantiles)
+
+@register_engine("doy_data","numpy")
+def wytrace_table_numpy(data,wy_division,quantiles=[0.05,0.5,0.95],complete=None):
+    """
+    Arranges the data by day of WY with a single scatter of all values ("numpy" engine of wytrace_table())
+    :return: df, doy_data
+    """
+    var = data.columns[0]
+    col,WYs = wytrace_years(data,wy_division,complete)
+    doy_idx = np.array(pd.DatetimeIndex(data.index).dayofyear)
+    if wy_division=="WY":
+        pos = data.groupby(col,sort=False).cumcount().values
+        doy_idx = doy_idx + 92
+        doy_idx = np.where((pos<92)&(doy_idx>365),doy_idx-365,doy_idx)
+    cols = pd.Index(WYs).get_indexer(data[col].values.astype(int))
+    sel = cols>=0
+    flat = (doy_idx[sel]-1)*len(WYs)+cols[sel]
+    vals = data[var].values.astype(float)[sel]
+    # Repeated days (e.g., leap years) keep the last value
+    last = len(flat)-1-np.unique(flat[::-1],return_index=True)[1]
+    table = np.full(366*len(WYs),np.nan)
+    table[flat[last]] = vals[last]
+    doy_data = pd.DataFrame(table.reshape(366,len(WYs)),index=range(1,367),columns=WYs)
+    return wytrace_stats(doy_data,WYs,quantiles)
+
+@timed
+def plot_wytraces(data,wy_division,quantiles=[0.05,0.5,0.95],ax=None,legend=True,sel_wy=None,log=True,complete=None):
     """
     This function produces a single plot of the WY with all WYs plotted as traces and the max, min, mean and median.
     :param data: df, inflows including at least date, flow
     :param evs: df, output from analyze_voldur() for WY
     :param wy_division: str, "WY" or "CY"
     :param sel_wy: list, selected WYs to plot colored traces for
+    :param complete: df, output from wy_completeness() (WYs without valid data are skipped)
     :return: figure
     """
     var = data.columns[0]
@@ -249,29 +389,21 @@ def plot_wytraces(data,wy_division,quantiles=[0.05,0.5,0.95],ax=None,legend=True
     if wy_division=="CY":
         ax.set_xticks([1,32,60,91,121,152,182,213,244,274,305,335])
         ax.set_xticklabels(["J","F","M","A","M","J","J","A","S","O","N","D"])
-        col = "year"
     else:
         ax.set_xticks([1,32,62,93,124,153,184,214,245,275,306,337])
         ax.set_xticklabels(["O","N","D","J","F","M","A","M","J","J","A","S"])
-        col = "wy"
 
-    WYs = data[col].unique().astype(int)
-    i=-1
-    doy_data = pd.DataFrame(index=range(1,367),columns=WYs)
-    dates = pd.date_range("2020-01-01", "2020-12-31", freq="D", tz='UTC')
-
-    for wy in WYs:
-        i=+1
-        doy_flow = data.loc[data[col]==wy,var]
-        doy_idx = np.array(data.loc[data[col]==wy].index.dayofyear)
-        if wy_division=="WY":
-            doy_idx = doy_idx + 92
-            doy_idx[0:92] = np.where(doy_idx[0:92]>365,doy_idx[0:92]-365,doy_idx[0:92])
-        doy_data.loc[doy_idx,wy] = doy_flow.values
-        plt.plot(doy_idx, doy_flow, color="grey",alpha=0.2)
+    col,WYs = wytrace_years(data,wy_division,complete)
+    doy_data = wytrace_table(data,wy_division,quantiles,complete)
+
+    # Plot each WY
+    for wy,wy_data in data.groupby(col,sort=False):
+        if int(wy) not in WYs:
+            continue
+        plt.plot(wytrace_doy(wy_data.index,wy_division), wy_data[var], color="grey",alpha=0.2)
 
     # Plot min and max year, volume
-    annual_vol = doy_data.sum().sort_values()
+    annual_vol = doy_data[WYs].sum().sort_values()
     annual_vol = annual_vol[annual_vol.values>0]
     minwy = annual_vol.index[0]
     maxwy = annual_vol.index[len(annual_vol)-1]
@@ -283,11 +415,6 @@ def plot_wytraces(data,wy_division,quantiles=[0.05,0.5,0.95],ax=None,legend=True
         for sel in range(0,len(sel_wy)):
             plt.plot(doy_data.index, doy_data[sel_wy[sel]], color=sel_col[sel], linestyle="dashdot", label=f"{sel_wy[sel]}")
 
-    for d in doy_data.index:
-        doy_data.loc[d,"mean"] = doy_data.loc[d,WYs].mean()
-        for q in quantiles:
-            doy_data.loc[d, q] = doy_data.loc[d,WYs].quantile(q)
-
     plt.plot(doy_data.index, doy_data["mean"], color="black", linestyle="dashed", linewidth=2,label="Mean")
     for q in quantiles:
         plt.plot(doy_data.index, doy_data[q], linestyle="solid",linewidth=2,label=q)
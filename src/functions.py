@@ -7,11 +7,31 @@ This script contains all of the functions and pre-defined variables used in the
 
 """
 import os
+import importlib
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import probscale
+
+class LazyModule:
+    """
+    Module imported on first use, so importing the src modules (e.g., for a dry run or a cached batch stage) does not
+    load matplotlib
+    :param name: str, module name
+    :param loads: str, submodules to import with the module (e.g., "matplotlib.ticker" for mpl.ticker)
+    """
+    def __init__(self,name,*loads):
+        self.name = name
+        self.loads = loads
+        self.module = None
+
+    def __getattr__(self,attr):
+        if self.module is None:
+            for load in self.loads:
+                importlib.import_module(load)
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module,attr)
+
+plt = LazyModule("matplotlib.pyplot")
+mpl = LazyModule("matplotlib","matplotlib.ticker")
 
 def getsites(input_file):
     # First, check for the type of input_file provided
@@ -90,6 +110,147 @@ def get_seasons(site):
     season_df = pd.read_csv(f"{site}/{site}_seasons.csv",index_col=0)
     return season_df
 
+def wy_completeness(data,var=None,col="wy"):
+    """
+    Function to summarize the completeness of each WY in a single pass
+    :param data: df, daily data including at least date, variable, wy
+    :param var: str, variable name (inferred from column 0 if None)
+    :param col: str, column of WYs ("wy", or "year" for CYs)
+    :return: df, days, count, missing, missing_frac, first_valid and last_valid for each WY
+    """
+    if var is None:
+        var = data.columns[0]
+    valid = data[var].notna()
+    wy = data[col]
+    complete = pd.DataFrame()
+    complete["days"] = wy.groupby(wy,sort=False).size()
+    complete["count"] = valid.groupby(wy,sort=False).sum()
+    complete["missing"] = complete["days"]-complete["count"]
+    complete["missing_frac"] = (complete["missing"]/complete["days"]).round(4)
+    dates = data.index.to_series()[valid]
+    complete["first_valid"] = dates.groupby(wy[valid],sort=False).min()
+    complete["last_valid"] = dates.groupby(wy[valid],sort=False).max()
+    complete.index = complete.index.astype(int)
+    complete.index.name = "wy"
+    return complete
+
+def save_completeness(site,complete,s="",define=None):
+    """
+    Function to save WY completeness table
+    :param site: str, site name
+    :param complete: df, output from wy_completeness()
+    :param s: str, season suffix (e.g., "_spring")
+    :param define: list or str, season definition (as in the seasons file), saved with seasonal tables so they are
+    updated if the season changes
+    :return:
+    """
+    if define is not None:
+        complete = complete.assign(define=define if isinstance(define,str) else str(define))
+    complete.to_csv(f"{site}/data/{site}{s}_wy_completeness.csv")
+    print(f"WY completeness saved to {site}/data/{site}{s}_wy_completeness.csv")
+
+def get_completeness(site,s="",data=None):
+    """
+    Function to load WY completeness table (calculated from data if file not found, and saved again if older than the
+    daily data or, for seasons, if the season definition changed)
+    :param site: str, site name
+    :param s: str, season suffix (e.g., "_spring")
+    :param data: df, daily data (used if file not found or outdated)
+    :return: df, output from wy_completeness()
+    """
+    filename = f"{site}/data/{site}{s}_wy_completeness.csv"
+    daily_file = f"{site}/data/{site}_site_daily.csv"
+    season_file = f"{site}/{site}_seasons.csv"
+    define = None
+    if s!="" and os.path.isfile(season_file):
+        season_df = get_seasons(site)
+        if s[1:] in season_df.index:
+            define = season_df.loc[s[1:],"define"]
+    complete = None
+    if os.path.isfile(filename):
+        complete = pd.read_csv(filename,index_col=0,parse_dates=["first_valid","last_valid"])
+        if os.path.isfile(daily_file) and os.path.getmtime(daily_file) > os.path.getmtime(filename):
+            print(f"{filename} is older than {daily_file}; updating...")
+            complete = None
+        elif define is not None and ("define" not in complete.columns or set(complete["define"].astype(str))!={define}):
+            print(f"{filename} is not for the season {define}; updating...")
+            complete = None
+        if complete is None:
+            complete = wy_completeness(get_daily(site,s) if data is None else data)
+            save_completeness(site,complete,s,define)
+    elif data is not None:
+        complete = wy_completeness(data)
+    else:
+        print(f"{filename} not found...")
+        return None
+    return complete.drop(columns="define",errors="ignore")
+
+def get_daily(site,s="",daily=None):
+    """
+    Function to load daily data for a site and season (from memory if available, file otherwise)
+    :param site: str, site name
+    :param s: str, season suffix (e.g., "_spring")
+    :param daily: dict, site_daily df for each site (e.g., output from stage_1a())
+    :return: df, daily data (values outside of the season are NaN)
+    """
+    if daily is None or site not in daily.keys():
+        filename = f"{site}/data/{site}{s}_site_daily.csv"
+        if s=="" or os.path.isfile(filename):
+            return pd.read_csv(filename,parse_dates=True,index_col=0)
+        data = pd.read_csv(f"{site}/data/{site}_site_daily.csv",parse_dates=True,index_col=0)
+    else:
+        data = daily[site]
+        if s=="":
+            return data
+        data = data.copy()
+    season = s[1:]
+    data.loc[~season_masks(data,get_seasons(site),[season])[season],data.columns[0]] = np.nan
+    return data
+
+def season_mask(data,season_idx):
+    """
+    Function to identify the rows of data within a season
+    :param data: df, input data with at least month, doy
+    :param season_idx: list, either months (cy) or [start,stop] doy (cy); start > stop wraps the end of the year
+    :return: array, boolean (True within season)
+    """
+    # If all values are < 12; assume to be months
+    if max(season_idx) <= 12:
+        mask = data["month"].isin(season_idx).values
+    # Else, if only two values are given; assume to be DOYs [S,F]
+    elif len(season_idx) == 2:
+        doy = data["doy"].values
+        if season_idx[0] <= season_idx[1]:
+            mask = (doy >= season_idx[0]) & (doy <= season_idx[1])
+        else:
+            mask = (doy >= season_idx[0]) | (doy <= season_idx[1])
+    else:
+        print("Format of season not recognized. Please provide a list of months (CY) or start and end day of year (CY)")
+        mask = np.ones(len(data),dtype=bool)
+    return mask
+
+def season_masks(data,season_df,seasons=None):
+    """
+    Function to identify the rows of data within each season
+    :param data: df, input data with at least month, doy
+    :param season_df: df, output from get_seasons() or dict of seasons (as for save_seasons())
+    :param seasons: list, seasons to include (all if None; None or "all" is the entire year)
+    :return: dict, boolean array for each season
+    """
+    if isinstance(season_df,pd.DataFrame):
+        defines = {season:get_list(season_df.loc[season,"define"]) for season in season_df.index}
+    else:
+        defines = dict(season_df)
+    if seasons is None:
+        seasons = list(defines.keys())
+    masks = dict()
+    for season in seasons:
+        if season is None or season=="all":
+            masks[season] = np.ones(len(data),dtype=bool)
+        else:
+            masks[season] = season_mask(data,defines[season])
+    return masks
+
 def get_list(season_str):
     print(season_str)
     if season_str is None or pd.isna(season_str):
@@ -111,12 +272,11 @@ def check_dir(dir,sub=False):
     :param sub: str, sub directory to be created
     :return: str, directory
     """
-    if not os.path.isdir(dir):
-        os.mkdir(dir)
+    # exist_ok, as other processes (e.g., batch workers) may create the same directory
+    os.makedirs(dir,exist_ok=True)
     if sub!=False:
         outdir = f"{dir}/{sub}"
-        if not os.path.isdir(outdir):
-            os.mkdir(outdir)
+        os.makedirs(outdir,exist_ok=True)
     else:
         outdir = dir
     return outdir
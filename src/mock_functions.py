@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+### MOCK SERVICE FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains a local stand-in for the web services used by nwis_import(), nwis_peak_import(), import_snotel()
+and import_hydromet() (CPN, MBART and UCB regions), so that downloads (and caching, pooling and concurrency of
+downloads) can be tested and timed offline. The server answers the same url shapes as the real services (see
+service_urls in src/data_functions.py) with:
+    - replayed fixtures (fixture_dir/{service}_{site}_{var}.txt), recorded from the real services (record=True, online)
+    - otherwise, deterministic synthetic records (see src/synthetic_functions.py) of the requested site and variable
+Latency, bandwidth, errors and payload size (years of record) are configurable. While the server is in use,
+DURATION_SERVICE_URL points the import functions (including those of batch workers started after) to it.
+
+"""
+import os
+import re
+import json
+import time
+import zlib
+import random
+import threading
+import numpy as np
+import pandas as pd
+from urllib.parse import urlsplit,parse_qs,unquote
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from src.data_functions import service_urls
+from src.synthetic_functions import synthetic_flow
+
+### PAYLOAD FUNCTIONS
+def mock_record(service,site,var,years,freq="D"):
+    """
+    Function to create the synthetic record of a site and variable (the same for every request)
+    :param service: str, service (key of service_urls)
+    :param site: str, site
+    :param var: str, variable
+    :param years: float, years of record
+    :param freq: str, pandas frequency
+    :return: series, values with date index
+    """
+    seed = zlib.crc32(f"{service}_{site}_{var}".encode())
+    days = int(round(years*365.25))
+    flow = synthetic_flow(max(int(np.ceil(years)),1),0.0,1.0,freq,seed,"1950-10-01")
+    flow.index = pd.to_datetime(flow.pop("date"),format="%d-%b-%Y %H:%M" if freq!="D" else "%d-%b-%Y")
+    return flow["flow"].loc[:flow.index[0]+pd.Timedelta(days=days)]
+
+def nwis_payload(site,dtype,years,iv_days):
+    """
+    Function to create a NWIS water services response (json, as for dataretrieval.nwis.get_record(service=dtype))
+    :return: str, response
+    """
+    if dtype == "iv":
+        values = mock_record("nwis",site,dtype,iv_days/365.25,"15min")
+        option,fmt = None,"%Y-%m-%dT%H:%M:%S.000-07:00"
+    else:
+        values = mock_record("nwis",site,dtype,years)
+        option,fmt = "Mean","%Y-%m-%dT00:00:00.000"
+    records = [{"value":str(v),"qualifiers":["A"],"dateTime":d}
+               for d,v in zip(values.index.strftime(fmt),values.values)]
+    series = {"sourceInfo":{"siteCode":[{"value":site}]},
+              "variable":{"variableCode":[{"value":"00060"}],"options":{"option":[{"value":option}]}},
+              "values":[{"value":records,"method":[{"methodDescription":""}]}]}
+    return json.dumps({"value":{"timeSeries":[series]}})
+
+def peak_payload(site,years):
+    """
+    Function to create a NWIS peak-flow response (rdb, as for dataretrieval.nwis.get_record(service="peaks"))
+    :return: str, response
+    """
+    values = mock_record("nwis",site,"dv",years)
+    wy = values.index.year+(values.index.month>=10)
+    peaks = values.groupby(wy).agg(["idxmax","max"])
+    lines = ["# Mock peak-flow file","agency_cd\tsite_no\tpeak_dt\tpeak_tm\tpeak_va\tpeak_cd\tgage_ht","5s\t15s\t10d\t6s\t8s\t27s\t8s"]
+    lines += [f"USGS\t{site}\t{d:%Y-%m-%d}\t\t{round(v*1.5)}\t\t" for d,v in zip(peaks["idxmax"],peaks["max"])]
+    return "\n".join(lines)+"\n"
+
+def snotel_payload(site,var,years):
+    """
+    Function to create a SNOTEL period of record response (csv of day by water year)
+    :return: str, response
+    """
+    values = mock_record("snotel",site,var,years)
+    if var in ["WTEQ","SNWD","PREC"]:
+        # Accumulates over the water year
+        wy = values.index.year+(values.index.month>=10)
+        values = (values/1000).groupby(wy).cumsum().round(1)
+    else:
+        values = (values/100-5).round(1)
+    table = pd.DataFrame({"value":values.values,"date":values.index.strftime("%m-%d"),
+                          "wy":values.index.year+(values.index.month>=10)})
+    table = table.pivot(index="date",columns="wy",values="value")
+    # Water year order of days
+    order = sorted(table.index,key=lambda d:(int(d[:2])<10,d))
+    table = table.loc[order]
+    table["Median ('91-'20)"] = table.median(axis=1).round(1)
+    return table.to_csv()
+
+def hydromet_payload(region,site,var,years):
+    """
+    Function to create a Hydromet response (html table for CPN, text for MBART, csv for UCB)
+    :return: str, response
+    """
+    values = mock_record(region,site,var,years)
+    if region == "cpn":
+        table = pd.DataFrame({"DateTime":values.index.strftime("%m/%d/%Y"),f"{site.upper()}_{var.upper()}":values.values})
+        return f"<html><body>{table.to_html(index=False,na_rep='')}</body></html>"
+    elif region == "mbart":
+        lines = ["<HTML><PRE>",f"Mock archive data for {site} {var}","BEGIN DATA",f"DATE       , {site} {var}"]
+        lines += [f"{d}, {v:.2f}" for d,v in zip(values.index.strftime("%m/%d/%Y"),values.values)]
+        return "\n".join(lines+["END DATA","</PRE></HTML>"])+"\n"
+    else:
+        table = pd.DataFrame({"datetime":values.index.strftime("%Y-%m-%d"),var:values.values})
+        return table.to_csv(index=False)
+
+def parse_request(path):
+    """
+    Function to find the service, site and variable of a request (url shapes of service_urls)
+    :param path: str, request path and query
+    :return: tuple, service, site, var, (None if not a known url shape)
+    """
+    url = urlsplit(path)
+    parts = [unquote(p) for p in url.path.strip("/").split("/")]
+    query = {k:v[0] for k,v in parse_qs(url.query).items()}
+    service = parts[0]
+    if service == "nwis" and len(parts)==2 and parts[1] in ["dv","iv"] and "sites" in query:
+        return service,query["sites"],parts[1]
+    if service == "nwis_peak" and len(parts)==2 and parts[1]=="peaks" and "site_no" in query:
+        return service,query["site_no"],"peaks"
+    if service == "snotel" and len(parts)==4 and parts[3].endswith(".csv"):
+        return service,parts[3][:-4],parts[1]
+    if service == "cpn" and len(parts)==2 and parts[1]=="daily.pl" and "station" in query:
+        return service,query["station"],query.get("pcode","")
+    if service == "mbart" and len(parts)==2 and parts[1]=="webarccsv.pl" and "parameter" in query:
+        site,var = (query["parameter"].split(" ")+[""])[:2]
+        return service,site,var
+    if service == "ucb" and len(parts)==4 and parts[2]=="csv" and parts[3].endswith(".csv"):
+        return service,parts[1],parts[3][:-4]
+    return None
+
+def mock_payload(service,site,var,years=30,iv_days=30):
+    """
+    Function to create the synthetic response of a request
+    :param service: str, service (key of service_urls)
+    :param site: str, site
+    :param var: str, variable ("dv", "iv" or "peaks" for NWIS)
+    :param years: float, years of record
+    :param iv_days: float, days of record of instantaneous (15-minute) data
+    :return: str, response
+    """
+    if service == "nwis":
+        return nwis_payload(site,var,years,iv_days)
+    elif service == "nwis_peak":
+        return peak_payload(site,years)
+    elif service == "snotel":
+        return snotel_payload(site,var,years)
+    else:
+        return hydromet_payload(service,site,var,years)
+
+### FIXTURE FUNCTIONS
+def fixture_file(fixture_dir,service,site,var):
+    """
+    Function to find the fixture file of a request (dates in the url are ignored, so fixtures can be replayed)
+    :return: str, file path
+    """
+    name = re.sub(r"[^A-Za-z0-9.-]+","_",f"{service}_{site}_{var}")
+    return f"{fixture_dir}/{name}.txt"
+
+def fetch_real(path,timeout=60):
+    """
+    Function to download a request from the real service (for recording fixtures)
+    :param path: str, request path and query of the mock server
+    :return: str, response
+    """
+    from urllib.request import urlopen
+    service,rest = path.lstrip("/").split("/",1)
+    with urlopen(service_urls[service]+rest,timeout=timeout) as res:
+        return res.read().decode("utf-8",errors="replace")
+
+### SERVER FUNCTIONS
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the mock server (settings and statistics are attributes of the server)
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self,format,*args):
+        if self.server.settings["verbose"]:
+            BaseHTTPRequestHandler.log_message(self,format,*args)
+
+    def send_text(self,status,body,content_type="text/plain"):
+        settings = self.server.settings
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type",f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        # Throttle to the bandwidth (bytes/s)
+        chunk = 65536 if settings["bandwidth"] is None else max(int(settings["bandwidth"]/20),1024)
+        for i in range(0,len(body),chunk):
+            self.wfile.write(body[i:i+chunk])
+            if settings["bandwidth"] is not None:
+                time.sleep(len(body[i:i+chunk])/settings["bandwidth"])
+        return len(body)
+
+    def do_GET(self):
+        server,settings = self.server,self.server.settings
+        start,source = time.perf_counter(),None
+        request = parse_request(self.path)
+        service = "unknown" if request is None else request[0]
+        with server.lock:
+            draw = server.rng.random()
+            jitter = server.rng.random()
+        time.sleep(settings["latency"]*(1+settings["jitter"]*jitter))
+
+        error = request is not None and draw < settings["error_rate"]
+        if error and settings["error_mode"] == "reset":
+            # Close the connection without a response
+            self.close_connection = True
+            nbytes,status = 0,0
+        elif error:
+            status = settings["error_status"]
+            nbytes = self.send_text(status,"<html><body>Service Unavailable</body></html>","text/html")
+        elif request is None:
+            status = 404
+            nbytes = self.send_text(status,f"The requested URL {self.path} was not found on this server.","text/html")
+        else:
+            body,source = self.response(*request)
+            status = 200
+            content_type = "text/html" if service=="cpn" else "application/json" if service=="nwis" else "text/plain"
+            nbytes = self.send_text(status,body,content_type)
+        with server.lock:
+            stats = server.stats.setdefault(service,{"requests":0,"errors":0,"fixtures":0,"bytes":0,"seconds":0.0})
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["fixtures"] += int(source in ["fixture","recorded"])
+            stats["bytes"] += nbytes
+            stats["seconds"] += time.perf_counter()-start
+
+    def response(self,service,site,var):
+        """
+        Response of a request: fixture (replayed or recorded) or synthetic record
+        """
+        settings = self.server.settings
+        if settings["fixture_dir"] is not None:
+            filename = fixture_file(settings["fixture_dir"],service,site,var)
+            if os.path.isfile(filename):
+                with open(filename,"r",encoding="utf-8") as f:
+                    return f.read(),"fixture"
+            if settings["record"]:
+                body = fetch_real(self.path)
+                with open(f"{filename}.tmp","w",encoding="utf-8") as f:
+                    f.write(body)
+                os.replace(f"{filename}.tmp",filename)
+                return body,"recorded"
+        key = (service,site,var)
+        with self.server.lock:
+            body = self.server.payloads.get(key)
+        if body is None:
+            body = mock_payload(service,site,var,settings["years"],settings["iv_days"])
+            with self.server.lock:
+                self.server.payloads[key] = body
+        return body,"synthetic"
+
+def start_mock_server(port=0,fixture_dir=None,record=False,latency=0.0,jitter=0.0,bandwidth=None,error_rate=0.0,
+                      error_mode="status",error_status=503,years=30,iv_days=30,seed=0,use=True,verbose=False):
+    """
+    Function to start the mock server in a background thread
+    :param port: int, port (0 for any free port)
+    :param fixture_dir: str, directory of fixtures to replay (or None for synthetic records only)
+    :param record: boolean, download fixtures missing from fixture_dir from the real services (needs internet)
+    :param latency: float, delay before each response (s)
+    :param jitter: float, random extra delay, as a fraction of latency
+    :param bandwidth: float, transfer rate of responses (bytes/s), or None for no limit
+    :param error_rate: float, fraction of requests that fail
+    :param error_mode: str, "status" (error_status response) or "reset" (connection closed without response)
+    :param error_status: int, http status of failed requests
+    :param years: float, years of record of synthetic responses (payload size)
+    :param iv_days: float, days of record of synthetic instantaneous (15-minute) NWIS responses
+    :param seed: int, random seed of latency jitter and errors
+    :param use: boolean, point the import functions to the server (sets DURATION_SERVICE_URL)
+    :param verbose: boolean, print each request
+    :return: server, with url, settings and stats (requests, errors, fixture responses, bytes and seconds of each service)
+    """
+    if fixture_dir is not None:
+        os.makedirs(fixture_dir,exist_ok=True)
+    server = ThreadingHTTPServer(("127.0.0.1",port),MockHandler)
+    server.daemon_threads = True
+    server.settings = {"fixture_dir":fixture_dir,"record":record,"latency":latency,"jitter":jitter,
+                       "bandwidth":bandwidth,"error_rate":error_rate,"error_mode":error_mode,
+                       "error_status":error_status,"years":years,"iv_days":iv_days,"verbose":verbose}
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.lock = threading.Lock()
+    server.rng = random.Random(seed)
+    server.stats,server.payloads = dict(),dict()
+    server.previous_url = os.environ.get("DURATION_SERVICE_URL")
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    if use:
+        os.environ["DURATION_SERVICE_URL"] = server.url
+    print(f"Mock services at {server.url}")
+    return server
+
+def reset_mock_stats(server):
+    """
+    Function to clear the statistics (and cached synthetic responses) of the mock server
+    :param server: server, output from start_mock_server()
+    :return: None
+    """
+    with server.lock:
+        server.stats.clear()
+        server.payloads.clear()
+
+def stop_mock_server(server):
+    """
+    Function to stop the mock server (and point the import functions back to the real services)
+    :param server: server, output from start_mock_server()
+    :return: dict, statistics of each service
+    """
+    server.shutdown()
+    server.server_close()
+    if os.environ.get("DURATION_SERVICE_URL") == server.url:
+        if server.previous_url is None:
+            os.environ.pop("DURATION_SERVICE_URL")
+        else:
+            os.environ["DURATION_SERVICE_URL"] = server.previous_url
+    return server.stats
@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+"""
+### PLAN FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used to plan a run of the duration analyses without running it (dry run). For each
+stage, the files that would be written are listed (following the same rules as the stage functions) from the data
+already available (daily data in memory, previous outputs or local .csv sources); events are identified for script 3.
+The disk space and run time are estimated from per-unit costs (seconds and bytes per figure, per table cell and per
+site-year of analysis), which can be calibrated on this machine with calibrate_costs().
+
+Sites without available data (e.g., USGS gages not yet imported) are planned with default_years of record; these
+rows are flagged as "assumed".
+
+"""
+import os
+import json
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from src.functions import plt,check_dir,get_daily,get_seasons,get_list,season_masks
+from src.data_functions import import_daily,csv_daily_import
+from src.flow_functions import annualcombos,monthcombos,allcombos,standard
+from src.crit_functions import identify_thresh_events
+from src.synthetic_functions import synthetic_flow
+from src.render_functions import output_file
+
+### UNIT COSTS
+# Default per-unit costs (replaced by cache/unit_costs.json, see calibrate_costs())
+unit_costs = {"figure_s":{100:0.11,300:0.15,600:0.25}, # seconds to plot and save a figure at each dpi
+              "figure_bytes":{100:22e3,300:105e3,600:290e3}, # bytes of a figure at each dpi
+              "stage_figure_bytes":dict(), # bytes of a figure for each stage (from calibration or manifests)
+              "cell_s":8e-7, # seconds to write a table cell
+              "cell_bytes":7.6, # bytes of a table cell
+              "year_s":{"1a":0.012,"1b":0.02,"2a":0.006,"2b":0.01,"3":0.18,"4":0.04,"5":0.026}, # seconds of analysis per unit
+              "route_s":0.004, # seconds to route one CVHS hydrograph for one duration
+              "download_s":10.0} # seconds to import one site from a web service
+
+def get_costs(cache_dir="cache"):
+    """
+    Function to load the calibrated unit costs (defaults if not calibrated)
+    :param cache_dir: str, directory of unit_costs.json
+    :return: dict, unit costs
+    """
+    costs = json.loads(json.dumps(unit_costs))
+    filename = f"{cache_dir}/unit_costs.json"
+    if os.path.isfile(filename):
+        with open(filename,"r") as f:
+            costs.update(json.load(f))
+    # json keys are str
+    for key in ["figure_s","figure_bytes"]:
+        costs[key] = {int(dpi):v for dpi,v in costs[key].items()}
+    return costs
+
+def manifest_costs(costs,cache_dir="cache"):
+    """
+    Function to update the bytes of a figure for each stage from the outputs of previous batch runs (manifests)
+    :param costs: dict, unit costs (updated)
+    :param cache_dir: str, directory of manifests
+    :return: dict, unit costs
+    """
+    for stage in unit_costs["year_s"].keys():
+        filename = f"{cache_dir}/{stage}_manifest.json"
+        if not os.path.isfile(filename):
+            continue
+        with open(filename,"r") as f:
+            outputs = json.load(f)["outputs"]
+        sizes = [output["size"] if isinstance(output,dict) else output for file,output in outputs.items()
+                 if file.endswith(".jpg")]
+        if len(sizes)>0:
+            costs["stage_figure_bytes"][stage] = float(np.mean(sizes))
+    return costs
+
+### PLAN FUNCTIONS
+def plan_row(stage,site,kind,file="",dpi=None,cells=0,assumed=False):
+    """
+    Function to create a row of a plan
+    :param stage: str, stage name (e.g., "1a")
+    :param site: str, site name ("all" for cross-site outputs)
+    :param kind: str, "figure", "table", "analysis", "events", "selected", "route" or "download"
+    :param file: str, output file (figures and tables)
+    :param dpi: int, resolution (figures)
+    :param cells: int, number of cells (tables), units of analysis, events or routings
+    :param assumed: boolean, planned without data (default_years)
+    :return: dict
+    """
+    return {"stage":stage,"site":site,"kind":kind,"file":file,"dpi":dpi,"cells":int(cells),"assumed":assumed}
+
+def plan_data(site,site_source=None,daily=None,wy_division="WY",decimal=2,zero=False):
+    """
+    Function to find the daily data for a site without downloading (memory, local .csv source, previous output)
+    :param site: str, site name
+    :param site_source: str, site source (only local .csv files are imported)
+    :param daily: dict, site_daily df for each site
+    :param wy_division: str, "WY" or "CY"
+    :param decimal: int, number of decimal places to use in data
+    :param zero: False, minimum flow value, or "average"
+    :return: df, daily data (None if not available)
+    """
+    if daily is not None and site in daily.keys() and daily[site] is not None:
+        return daily[site]
+    if isinstance(site_source,str) and ".csv" in site_source and os.path.isfile(site_source):
+        return import_daily(site_source,wy_division,decimal,zero)
+    if os.path.isfile(f"{site}/data/{site}_site_daily.csv"):
+        return get_daily(site)
+    return None
+
+def plan_daily(sites,site_sources,wy_division="WY",decimal=2,zero=False):
+    """
+    Function to find the daily data for each site without downloading (see plan_data())
+    :param sites: list, site or dam names
+    :param site_sources: list, .csv file or other site info for supported data
+    :param wy_division: str, "WY" or "CY"
+    :param decimal: int, number of decimal places to use in data
+    :param zero: False, minimum flow value, or "average"
+    :return: dict, site_daily df (or None) for each site
+    """
+    return {site:plan_data(site,site_source,None,wy_division,decimal,zero) for site,site_source in zip(sites,site_sources)}
+
+def data_size(data,default_years=50):
+    """
+    Function to find the size of the daily data of a site
+    :param data: df, daily data (or None)
+    :param default_years: int, years of record assumed if data is None
+    :return: int, int, int, boolean: water years with data, days, columns and assumed
+    """
+    if data is None:
+        return default_years,int(default_years*365.25),4,True
+    var = data.columns[0]
+    return int(data.loc[data[var].notna(),"wy"].nunique()),len(data),len(data.columns)+1,False
+
+def data_wys(data,mask=None):
+    """
+    Function to list the water years with data (in a season)
+    :param data: df, daily data
+    :param mask: array, boolean array of the season (see season_masks())
+    :return: list, water years
+    """
+    valid = data[data.columns[0]].notna().values
+    if mask is not None:
+        valid = valid & mask
+    return sorted(data.loc[valid,"wy"].astype(int).unique())
+
+def plan_seasons(site,seasons=None):
+    """
+    Function to find the seasons of a site (seasons file, or seasons planned for script 1a)
+    :param site: str, site name
+    :param seasons: dict, seasons by months or start/stop, OR False (used if the seasons file is not found)
+    :return: df, seasons (as for get_seasons())
+    """
+    if os.path.isfile(f"{site}/{site}_seasons.csv"):
+        return get_seasons(site)
+    season_df = pd.DataFrame()
+    season_df.loc["all","define"] = str([1,2,3,4,5,6,7,8,9,10,11,12])
+    if isinstance(seasons,dict):
+        for s in seasons.keys():
+            season_df.loc[s,"define"] = str(seasons[s])
+    return season_df
+
+def plan_1a(sites,site_sources,wy_division="WY",decimal=2,zero=False,seasons=False,season_files=True,daily=None,
+            default_years=50):
+    """
+    Function to plan script 1a (see stage_1a())
+    :param daily: dict, site_daily df for each site (e.g., output from plan_daily()); local sources used if None
+    :param default_years: int, years of record assumed for sites without data
+    :return: df, plan (see plan_row())
+    """
+    plan = list()
+    for site,site_source in zip(sites,site_sources):
+        data = plan_data(site,site_source,daily,wy_division,decimal,zero)
+        years,days,cols,assumed = data_size(data,default_years)
+        if not (isinstance(site_source,str) and os.path.isfile(site_source)):
+            plan.append(plan_row("1a",site,"download",assumed=assumed))
+        plan.append(plan_row("1a",site,"analysis",cells=years,assumed=assumed))
+        plan.append(plan_row("1a",site,"table",f"{site}/data/{site}_site_daily.csv",cells=days*cols,assumed=assumed))
+        plan.append(plan_row("1a",site,"table",f"{site}/data/{site}_site_summary.csv",cells=20))
+        plan.append(plan_row("1a",site,"table",f"{site}/data/{site}_wy_completeness.csv",cells=years*7,assumed=assumed))
+        if isinstance(seasons,dict):
+            for s in seasons.keys():
+                if season_files:
+                    plan.append(plan_row("1a",site,"table",f"{site}/data/{site}_{s}_site_daily.csv",cells=days*cols,assumed=assumed))
+                plan.append(plan_row("1a",site,"table",f"{site}/data/{site}_{s}_wy_completeness.csv",cells=years*7,assumed=assumed))
+        plan.append(plan_row("1a",site,"table",f"{site}/{site}_seasons.csv",cells=2*(1+len(seasons) if isinstance(seasons,dict) else 1)))
+        plan.append(plan_row("1a",site,"figure",f"{site}/data/{site}_site_daily.jpg",600))
+    return pd.DataFrame(plan)
+
+def plan_1b(sites,site_sources,seasons=False,daily=None,default_years=50):
+    """
+    Function to plan script 1b (see stage_1b()); instantaneous peaks imported for seasons are not included
+    :param daily: dict, site_daily df for each site (files used if None)
+    :param default_years: int, years of record assumed for sites without data
+    :return: df, plan (see plan_row())
+    """
+    plan = list()
+    for site,site_source in zip(sites,site_sources):
+        if site_source is None:
+            continue
+        data = plan_data(site,None,daily)
+        years,days,cols,assumed = data_size(data,default_years)
+        if not (isinstance(site_source,str) and os.path.isfile(site_source)):
+            plan.append(plan_row("1b",site,"download",assumed=assumed))
+        plan.append(plan_row("1b",site,"analysis",cells=years,assumed=assumed))
+        plan.append(plan_row("1b",site,"table",f"{site}/data/{site}_site_peak.csv",cells=years*5,assumed=assumed))
+        plan.append(plan_row("1b",site,"figure",f"{site}/data/{site}_site_peak.jpg",300))
+        if isinstance(seasons,dict):
+            for s in seasons.keys():
+                plan.append(plan_row("1b",site,"table",f"{site}/data/{site}_{s}_site_peak.csv",cells=years*5,assumed=assumed))
+                plan.append(plan_row("1b",site,"figure",f"{site}/data/{site}_{s}_site_peak.jpg",300))
+        plan.append(plan_row("1b",site,"table",f"{site}/{site}_seasons.csv",cells=2*len(plan_seasons(site,seasons))))
+    return pd.DataFrame(plan)
+
+def plan_2a(sites,analyze=["annual","monthly"],pcts=standard,wytrace=True,wy_division="WY",quantiles=[0.05,0.5,0.95],
+            boxplot=True,daily=None,seasons=None,default_years=50):
+    """
+    Function to plan script 2a (see stage_2a())
+    :param daily: dict, site_daily df for each site (files used if None)
+    :param seasons: dict, seasons planned for script 1a (used if the seasons file is not found)
+    :param default_years: int, years of record assumed for sites without data
+    :return: df, plan (see plan_row())
+    """
+    plan = list()
+    for site in sites:
+        outdir = f"{site}/flow"
+        data = plan_data(site,None,daily)
+        years,days,cols,assumed = data_size(data,default_years)
+        for a in analyze:
+            if a == "seasonal":
+                names = [f"_{season}" for season in plan_seasons(site,seasons).index if season!="all"]
+                combos = annualcombos
+            else:
+                names = [""]
+                combos = {"annual":annualcombos,"monthly":monthcombos,"all":allcombos}[a]
+            for s in names:
+                plan.append(plan_row("2a",site,"analysis",cells=years*len(combos),assumed=assumed))
+                plan.append(plan_row("2a",site,"table",f"{outdir}/{site}{s}_{a}.csv",cells=len(combos)*len(pcts)*2))
+                if a in ["annual","seasonal"]:
+                    plan.append(plan_row("2a",site,"table",f"{outdir}/{site}{s}_annual_raw.csv",cells=days,assumed=assumed))
+                plan.append(plan_row("2a",site,"figure",f"{outdir}/{site}{s}_{a}_plot.jpg",300))
+                if a == "monthly":
+                    plan.append(plan_row("2a",site,"figure",f"{outdir}/{site}_{a}_monthly_plot.jpg",300))
+                if a in ["annual","seasonal"] and wytrace:
+                    plan.append(plan_row("2a",site,"figure",f"{outdir}/{site}{s}_WY_plot.jpg",300))
+                    plan.append(plan_row("2a",site,"table",f"{outdir}/{site}{s}_doy.csv",cells=366*(years+len(quantiles))))
+                if a in ["annual","seasonal"] and boxplot:
+                    plan.append(plan_row("2a",site,"figure",f"{outdir}/{site}{s}_boxplot.jpg",300))
+    return pd.DataFrame(plan)
+
+def plan_2b(sites,seasonal=False,durcurve=True,wytrace=True,boxplot=True,summarize=True,daily=None,default_years=50,
+            **kwargs):
+    """
+    Function to plan script 2b (see stage_2b(); other settings do not change the outputs)
+    :param daily: dict, site_daily df for each site (files used if None)
+    :param default_years: int, years of record assumed for sites without data
+    :return: df, plan (see plan_row())
+    """
+    plan = list()
+    outdir = "flow_comparison"
+    site = sites[-1]
+    for s in sites:
+        years,days,cols,assumed = data_size(plan_data(s,None,daily),default_years)
+        plan.append(plan_row("2b",s,"analysis",cells=years,assumed=assumed))
+    if durcurve:
+        plan.append(plan_row("2b","all","figure",f"{outdir}/{site}_all_annual_multiplot.jpg",300))
+        plan.append(plan_row("2b","all","table",f"{outdir}/{site}_allplot_combine.csv",cells=len(standard)*len(sites)))
+    if wytrace:
+        plan.append(plan_row("2b","all","figure",f"{outdir}/{site}_all_wy_plots.jpg",600))
+    if boxplot:
+        plan.append(plan_row("2b","all","figure",f"{outdir}/{site}_all_boxplot.jpg",600))
+    if summarize:
+        plan.append(plan_row("2b","all","table",f"{outdir}/{site}_all_summaries.csv",cells=10*len(sites)))
+    return pd.DataFrame(plan)
+
+def plan_3(site,season=False,event_thresh=0,min_dur=None,min_peak=None,analyze_standard=True,standard_plots=False,
+           analyze_volwindow=False,volwindow_plots=True,res_file=None,analyze_cvhs=False,cvhs_plots=True,hydro_dur=30,
+           by=1,cvhs_sweep=False,sweep_starts=[],sweep_rating_files=[],daily=None,memo=None,default_years=50,**kwargs):
+    """
+    Function to plan script 3 (see stage_3(); other settings do not change the outputs). Events are identified from
+    the daily data (one event per year is assumed without data).
+    :param daily: dict, site_daily df for each site (files used if None)
+    :param memo: dict, daily data and events from previous calls (updated, see stage_3())
+    :param default_years: int, years of record assumed without data
+    :return: df, plan (see plan_row())
+    """
+    if memo is None:
+        memo = dict()
+    for key in ["data","evs"]:
+        memo.setdefault(key,dict())
+    if season == "all" or season == False:
+        s = ""
+    else:
+        s = f"_{season}"
+    if min_peak is None:
+        min_peak = 0
+    if min_dur is None:
+        min_dur = 0
+    outdir = f"{site}/critical"
+    name = f"{site}_{str(event_thresh)}_p{str(min_peak)}_d{str(min_dur)}"
+
+    # Identify events (as for stage_3())
+    if (site,s) not in memo["data"].keys() and (plan_data(site,None,daily) is not None):
+        memo["data"][(site,s)] = get_daily(site,s,daily)
+    if (site,s) in memo["data"].keys():
+        data = memo["data"][(site,s)]
+        years,days,cols,assumed = data_size(data,default_years)
+        if (site,s,event_thresh) not in memo["evs"].keys():
+            memo["evs"][(site,s,event_thresh)] = identify_thresh_events(data,event_thresh)
+        evs = memo["evs"][(site,s,event_thresh)]
+        evs_sel = evs.loc[evs["peak"] > min_peak]
+        dates = pd.to_datetime(evs_sel["start_idx"])
+    else:
+        years,days,cols,assumed = data_size(None,default_years)
+        evs = evs_sel = pd.DataFrame(index=range(default_years))
+        dates = pd.Series(pd.date_range(f"{2000-default_years}-01-01",periods=default_years,freq="YS"))
+        print(f"No daily data for {site}; assuming one event per year...")
+
+    plan = list()
+    plan.append(plan_row("3",site,"analysis",cells=years,assumed=assumed))
+    plan.append(plan_row("3",site,"events",name,cells=len(evs),assumed=assumed))
+    plan.append(plan_row("3",site,"selected",name,cells=len(evs_sel),assumed=assumed))
+    if analyze_standard:
+        plan.append(plan_row("3",site,"figure",f"{outdir}/thresh/{name}_peakvsdur.jpg",300))
+        plan.append(plan_row("3",site,"table",f"{outdir}/thresh/{name}_peakvsdur.csv",cells=len(evs)*6))
+        plan.append(plan_row("3",site,"table",f"{outdir}/thresh/{name}_peakvsdur_selected.csv",cells=len(evs_sel)*6))
+        if standard_plots:
+            for edate in dates.dt.strftime("%Y-%m-%d").unique():
+                plan.append(plan_row("3",site,"figure",output_file(f"{outdir}/thresh/{site}_thresh_{edate}.jpg",
+                                                                  f"{outdir}/thresh/{site}_thresh_events"),300,assumed=assumed))
+
+    if analyze_volwindow and res_file is not None:
+        vw_dates = dates
+        if os.path.isfile(res_file):
+            vw_dates = dates.loc[dates>=csv_daily_import(res_file,False).index.min()]
+        for edate in vw_dates.dt.strftime("%Y-%m-%d").unique():
+            plan.append(plan_row("3",site,"table",f"critical/vw/{edate}_volumes.csv",cells=50,assumed=assumed))
+            if volwindow_plots:
+                plan.append(plan_row("3",site,"figure",output_file(f"{outdir}/vw/{site}_volwindow_{edate}.jpg",
+                                                                  f"{outdir}/vw/{site}_volwindow_events"),300,assumed=assumed))
+        plan.append(plan_row("3",site,"table",f"{outdir}/vw/{name}_peakvsdur_volwindow.csv",cells=len(vw_dates)*6))
+        plan.append(plan_row("3",site,"figure",f"{outdir}/vw/{name}_peakvsdur_volwindow.jpg",300))
+
+    # CVHS routes each selected event for each duration; files are named by year
+    durations = range(1,hydro_dur+1,by)
+    hydro_years = dates.dt.year.unique()
+    if analyze_cvhs:
+        cvhsdir = f"{outdir}/cvhs"
+        plan.append(plan_row("3",site,"table",f"{cvhsdir}/vol_table.csv",cells=len(durations)*(years+3)))
+        plan.append(plan_row("3",site,"table",f"{cvhsdir}/hydros.csv",cells=hydro_dur*len(dates)))
+        plan.append(plan_row("3",site,"route",cells=len(dates)*len(durations),assumed=assumed))
+        for year in hydro_years:
+            for dur in durations:
+                plan.append(plan_row("3",site,"table",f"{cvhsdir}/{year}_{dur}.csv",cells=hydro_dur*5,assumed=assumed))
+            if cvhs_plots:
+                plan.append(plan_row("3",site,"figure",output_file(f"{cvhsdir}/{year}.jpg",f"{cvhsdir}/cvhs_hydrographs"),100,
+                                     assumed=assumed))
+        plan.append(plan_row("3",site,"table",f"{cvhsdir}/{name}_cvhs.csv",cells=len(durations)*(years+len(dates)+4)))
+        plan.append(plan_row("3",site,"figure",f"{cvhsdir}/{name}_cvhs.jpg",100))
+    if cvhs_sweep:
+        sweepdir = f"{outdir}/cvhs_sweep"
+        routes = len(dates)*len(durations)*len(sweep_starts)*len(sweep_rating_files)
+        plan.append(plan_row("3",site,"table",f"{sweepdir}/vol_table.csv",cells=len(durations)*(years+3)))
+        plan.append(plan_row("3",site,"table",f"{sweepdir}/hydros.csv",cells=hydro_dur*len(dates)))
+        plan.append(plan_row("3",site,"route",cells=routes,assumed=assumed))
+        plan.append(plan_row("3",site,"table",f"{sweepdir}/{name}_cvhs_sweep.csv",cells=routes//max(len(dates),1)*(years+len(dates)+6)))
+        plan.append(plan_row("3",site,"table",f"{sweepdir}/{name}_cvhs_sweep_summary.csv",cells=len(sweep_starts)*len(sweep_rating_files)*6))
+        plan.append(plan_row("3",site,"figure",f"{sweepdir}/{name}_cvhs_sweep.jpg",100))
+    return pd.DataFrame(plan)
+
+def plan_4(sites,seasonal=False,durations=[1,3,7,15,30],wy_division="WY",plot_vol=True,plot_wy=True,concat=True,
+           surface=False,surface_durations=range(1,366),lowflow=False,lowflow_durations=[1,7,30],lowflow_start=4,
+           lowflow_return=[2,10],save_series=None,daily=None,peaks=None,seasons=None,default_years=50):
+    """
+    Function to plan script 4 (see stage_4()), including the concatenation tables
+    :param daily: dict, site_daily df for each site (files used if None)
+    :param peaks: dict, peaks for each site (e.g., output from stage_1b(); files used if None)
+    :param seasons: dict, seasons planned for script 1a (used if the seasons file is not found)
+    :param default_years: int, years of record assumed for sites without data
+    :return: df, plan (see plan_row())
+    """
+    plan = list()
+    keys = list()
+    for site in sites:
+        outdir = f"{site}/volume"
+        data = plan_data(site,None,daily)
+        years,days,cols,assumed = data_size(data,default_years)
+        season_df = plan_seasons(site,seasons)
+        if seasonal:
+            season_list = season_df.index.to_list()
+        else:
+            season_list = [None]
+        if data is not None:
+            masks = season_masks(data,season_df,season_list)
+
+        plan.append(plan_row("4",site,"table",f"{site}/{site}_seasons.csv",cells=3*len(season_df)))
+        if lowflow:
+            for dur in lowflow_durations:
+                plan.append(plan_row("4",site,"table",f"{outdir}/{site}_lowflow_{dur}.csv",cells=years*4,assumed=assumed))
+            plan.append(plan_row("4",site,"table",f"{outdir}/{site}_lowflow_stats.csv",cells=len(lowflow_durations)*(len(lowflow_return)+1)))
+
+        for season in season_list:
+            if isinstance(durations,dict):
+                durations_sel = list(durations["all" if season is None else season])
+            else:
+                durations_sel = list(durations)
+            if season is None or season=="all":
+                s = ""
+                if "WY" not in durations_sel:
+                    durations_sel.insert(0,"WY")
+            else:
+                s = f"_{season}"
+            if "peak" in durations_sel:
+                durations_sel.remove("peak")
+                if (peaks is not None and site in peaks.keys() and s in peaks[site].keys()) or \
+                        os.path.isfile(f"{site}/data/{site}{s}_site_peak.csv"):
+                    if (s,"peak") not in keys:
+                        keys.append((s,"peak"))
+            wys = data_wys(data,masks[season]) if data is not None else list(range(2000-years,2000))
+
+            plan.append(plan_row("4",site,"analysis",cells=len(wys)*len(durations_sel),assumed=assumed))
+            for dur in durations_sel:
+                plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_{dur}.csv",cells=len(wys)*5,assumed=assumed))
+                if save_series=="csv" and dur!="WY":
+                    plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_{dur}_data.csv",cells=days*3,assumed=assumed))
+                if (s,dur) not in keys:
+                    keys.append((s,dur))
+            plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_stats_summary.csv",cells=len(durations_sel)*10))
+            if save_series=="compressed":
+                plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_series.csv.gz",cells=days*len(durations_sel)//3,assumed=assumed))
+            if surface:
+                plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_surface.csv",cells=len(wys)*len(surface_durations),assumed=assumed))
+                plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_surface_pp.csv",cells=len(wys)*len(surface_durations),assumed=assumed))
+            if concat:
+                plan.append(plan_row("4",site,"table",f"{outdir}/{site}{s}_all_durations.csv",cells=len(wys)*len(durations_sel)*5,assumed=assumed))
+            if plot_vol and "WY" in durations_sel:
+                plan.append(plan_row("4",site,"figure",f"{outdir}/{site}{s}_wy_cumulative_plot.jpg",300))
+            if plot_wy:
+                for wy in wys:
+                    plan.append(plan_row("4",site,"figure",output_file(f"{outdir}/{site}{s}_{wy}.jpg",f"{outdir}/{site}{s}_wy_plots"),
+                                         300,assumed=assumed))
+
+    # Concatenation tables (see stage_4_concat())
+    if concat and len(sites)>1:
+        site = sites[-1]
+        if lowflow:
+            plan.append(plan_row("4","all","table",f"volume_concat/{site}_all_lowflow_stats.csv",cells=len(sites)*10))
+        for (s,dur) in keys:
+            name = "peaks" if dur=="peak" else dur
+            plan.append(plan_row("4","all","table",f"volume_concat/{site}{s}_all_{name}.csv",cells=default_years*len(sites)*5))
+    return pd.DataFrame(plan)
+
+def plan_5(sites,seasonal=False,wy_division="WY",idaplot=True,ppplot=True,pdfplot=True,monthplot=True,
+           eventdate="start",voldur=None,peaks=None,daily=None,durations=None,seasons=None,default_years=50):
+    """
+    Function to plan script 5 (see stage_5())
+    :param voldur: dict, output from stage_4() (files used if None)
+    :param peaks: dict, peaks for each site (e.g., output from stage_1b(); files used if None)
+    :param daily: dict, site_daily df for each site (files used if None), for the number of events without tables
+    :param durations: list, durations planned for script 4 (used if not found in the seasons file)
+    :param seasons: dict, seasons planned for script 1a (used if the seasons file is not found)
+    :param default_years: int, years of record assumed for sites without data
+    :return: df, plan (see plan_row())
+    """
+    plan = list()
+    for site in sites:
+        outdir = f"{site}/plot"
+        data = plan_data(site,None,daily)
+        years,days,cols,assumed = data_size(data,default_years)
+        season_df = plan_seasons(site,seasons)
+        season_list = season_df.index.to_list() if seasonal else [None]
+        for season in season_list:
+            season_durs = None
+            if "durations" in season_df.columns:
+                season_durs = get_list(season_df.loc["all" if season is None else season,"durations"])
+            if season_durs is None:
+                season_durs = durations
+            if season_durs is None:
+                continue
+            if isinstance(season_durs,dict):
+                season_durs = season_durs.get("all" if season is None else season)
+            durations_sel = [dur for dur in season_durs if dur not in ["WY","peak"]]
+            s = "" if season is None or season=="all" else f"_{season}"
+            if s=="":
+                durations_sel.append("WY")
+            if "peak" in season_durs and ((peaks is not None and site in peaks.keys()) or \
+                    os.path.isfile(f"{site}/data/{site}{s}_site_peak.csv")):
+                durations_sel.append("peak")
+
+            events = dict()
+            for dur in durations_sel:
+                # Number of events (from the tables of script 4 if available)
+                if voldur is not None and site in voldur.keys() and s in voldur[site].keys() and dur in voldur[site][s].keys():
+                    n = len(voldur[site][s][dur].dropna(how="all"))
+                elif dur!="peak" and os.path.isfile(f"{site}/volume/{site}{s}_{dur}.csv"):
+                    n = len(pd.read_csv(f"{site}/volume/{site}{s}_{dur}.csv",index_col=0).dropna(how="all"))
+                else:
+                    n = years
+                events[dur] = n
+                plan.append(plan_row("5",site,"analysis",cells=n,assumed=assumed))
+                if idaplot:
+                    for plot in ["trends&shifts","start_trends&shifts","mannwhitney"]+(["acf"] if n>=20 else [])+(["normality"] if n>=20 and dur!="WY" else []):
+                        plan.append(plan_row("5",site,"figure",f"{outdir}/{site}{s}_{dur}_{plot}_plot.jpg",600,assumed=assumed))
+            if ppplot:
+                plan.append(plan_row("5",site,"figure",f"{outdir}/{site}{s}_pp_plot.jpg",600))
+                # Plotting positions are saved without the season suffix
+                for dur,n in events.items():
+                    if dur!="WY":
+                        plan.append(plan_row("5",site,"table",f"{outdir}/{site}_{dur}_pp.csv",cells=n*8,assumed=assumed))
+            if pdfplot:
+                plan.append(plan_row("5",site,"figure",f"{outdir}/{site}{s}_pdf_plot.jpg",600))
+            if monthplot:
+                for stat in ["count","mean","max"]:
+                    plan.append(plan_row("5",site,"figure",f"{outdir}/{site}{s}_{eventdate}_month_{stat}_plot.jpg",600))
+    return pd.DataFrame(plan)
+
+### ESTIMATE FUNCTIONS
+def figure_cost(dpi,stage,costs):
+    """
+    Function to estimate the seconds and bytes of a figure
+    :param dpi: int, resolution
+    :param stage: str, stage name
+    :param costs: dict, unit costs (see get_costs())
+    :return: float, float: seconds and bytes
+    """
+    dpi = 100 if dpi is None or pd.isna(dpi) else int(dpi)
+    # Nearest calibrated dpi, scaled by the number of pixels
+    ref = min(costs["figure_s"].keys(),key=lambda d: abs(d-dpi))
+    scale = (dpi/ref)**2
+    seconds = costs["figure_s"][ref]*scale
+    if stage in costs["stage_figure_bytes"].keys() and dpi!=100:
+        size = costs["stage_figure_bytes"][stage]
+    else:
+        size = costs["figure_bytes"][ref]*scale
+    return seconds,size
+
+def estimate_plan(plan,costs=None,cache_dir="cache"):
+    """
+    Function to estimate the seconds and bytes of each row of a plan
+    :param plan: df, plan (e.g., output from plan_1a())
+    :param costs: dict, unit costs (loaded with get_costs() if None)
+    :param cache_dir: str, directory of unit_costs.json and manifests
+    :return: df, plan with seconds and bytes
+    """
+    if costs is None:
+        costs = manifest_costs(get_costs(cache_dir),cache_dir)
+    plan = plan.copy()
+    plan["seconds"] = 0.0
+    plan["bytes"] = 0.0
+    for i in plan.index:
+        kind,cells = plan.loc[i,"kind"],plan.loc[i,"cells"]
+        if kind == "figure":
+            plan.loc[i,["seconds","bytes"]] = figure_cost(plan.loc[i,"dpi"],plan.loc[i,"stage"],costs)
+        elif kind == "table":
+            plan.loc[i,["seconds","bytes"]] = [cells*costs["cell_s"],cells*costs["cell_bytes"]]
+        elif kind == "analysis":
+            plan.loc[i,"seconds"] = cells*costs["year_s"].get(plan.loc[i,"stage"],0)
+        elif kind == "route":
+            plan.loc[i,"seconds"] = cells*costs["route_s"]
+        elif kind == "download":
+            plan.loc[i,"seconds"] = costs["download_s"]
+    return plan
+
+def summarize_plan(plan,by="stage"):
+    """
+    Function to summarize an estimated plan
+    :param plan: df, output from estimate_plan()
+    :param by: str or list, columns to summarize by (e.g., "stage" or ["stage","site"])
+    :return: df, events, selected events, figures, files, MB and minutes
+    """
+    plan = plan.copy()
+    plan["events"] = plan["cells"].where(plan["kind"]=="events",0)
+    plan["selected"] = plan["cells"].where(plan["kind"]=="selected",0)
+    plan["figures"] = (plan["kind"]=="figure").astype(int)
+    # Figures of a plot family share a file (see set_render())
+    plan["files"] = (plan["kind"].isin(["figure","table"]) & ~plan["file"].duplicated()).astype(int)
+    plan["MB"] = plan["bytes"]/1e6
+    plan["minutes"] = plan["seconds"]/60
+    plan["assumed"] = plan["assumed"].astype(int)
+    summary = plan.groupby(by,sort=False)[["events","selected","figures","files","MB","minutes","assumed"]].sum()
+    summary.loc["total"] = summary.sum()
+    summary[["events","selected","figures","files"]] = summary[["events","selected","figures","files"]].astype(int)
+    summary["assumed"] = summary["assumed"]>0
+    return summary.round(2)
+
+def plan_report(plan,costs=None,cache_dir="cache",outfile=None):
+    """
+    Function to estimate, print and save a plan
+    :param plan: df or list, plan(s) (e.g., output from stage_1a(...,dry_run=True))
+    :param costs: dict, unit costs (loaded with get_costs() if None)
+    :param cache_dir: str, directory of unit_costs.json and manifests
+    :param outfile: str, .csv file for the estimated plan (one row per output) or None
+    :return: df, output from summarize_plan()
+    """
+    if isinstance(plan,list):
+        plan = pd.concat(plan,ignore_index=True)
+    plan = estimate_plan(plan,costs,cache_dir)
+    summary = summarize_plan(plan)
+    print("Dry run (no stages were run):")
+    print(summary.to_string())
+    if summary.loc["total","assumed"]:
+        print("Some sites have no data yet; their outputs are planned with default_years of record (assumed).")
+    if not os.path.isfile(f"{cache_dir}/unit_costs.json"):
+        print("Unit costs are defaults; run calibrate_costs() (src/plan_functions.py) for this machine.")
+    if outfile is not None:
+        check_dir(os.path.dirname(outfile) or ".")
+        plan.to_csv(outfile,index=False)
+        print(f"Plan saved to {outfile}")
+    return summary
+
+### CALIBRATION FUNCTIONS
+def calibrate_costs(years=30,dpis=[100,300,600],repeats=3,cache_dir="cache"):
+    """
+    Function to calibrate the unit costs on this machine: figures and tables are timed directly, and scripts 1a, 2a,
+    3, 4 and 5 are run for a synthetic site (in a temporary folder) to find the analysis time per unit and the bytes of
+    their figures. Results are saved to cache_dir/unit_costs.json.
+    :param years: int, years of synthetic record
+    :param dpis: list, resolutions of the figures
+    :param repeats: int, repeats of each figure (median is used)
+    :param cache_dir: str, directory of unit_costs.json
+    :return: dict, unit costs
+    """
+    from src.stage_functions import stage_1a,stage_2a,stage_3,stage_4,stage_5
+    from src.batch_functions import dir_snapshot,stage_outputs
+    cache_dir = os.path.abspath(cache_dir)
+    costs = json.loads(json.dumps(unit_costs))
+    costs["figure_s"],costs["figure_bytes"] = dict(),dict()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            synthetic_flow(years).to_csv("calibrate.csv",index=False)
+
+            # Figures: one water year of daily flows, as for the script 4 plots
+            data = csv_daily_import("calibrate.csv").iloc[:366]
+            for dpi in dpis:
+                seconds = list()
+                for r in range(repeats):
+                    start = time.perf_counter()
+                    fig,ax = plt.subplots(figsize=(6.25,4))
+                    ax.plot(data.index,data["flow"],label="flow")
+                    ax.legend()
+                    fig.savefig(f"figure_{dpi}.jpg",bbox_inches="tight",dpi=dpi)
+                    plt.close(fig)
+                    seconds.append(time.perf_counter()-start)
+                costs["figure_s"][dpi] = float(np.median(seconds))
+                costs["figure_bytes"][dpi] = os.path.getsize(f"figure_{dpi}.jpg")
+
+            # Tables
+            table = pd.DataFrame(np.random.default_rng(0).normal(1000,300,(20000,5)).round(1))
+            start = time.perf_counter()
+            table.to_csv("table.csv")
+            costs["cell_s"] = (time.perf_counter()-start)/table.size
+            costs["cell_bytes"] = os.path.getsize("table.csv")/table.size
+
+            # Stages, for a synthetic site
+            site = "calibrate"
+            daily = {site:None}
+            runs = {"1a":(stage_1a,plan_1a,dict(sites=[site],site_sources=["calibrate.csv"])),
+                    "2a":(stage_2a,plan_2a,dict(sites=[site],analyze=["annual","monthly"],boxplot=True)),
+                    "4":(stage_4,plan_4,dict(sites=[site],durations=[1,7,30],plot_wy=True)),
+                    "5":(stage_5,plan_5,dict(sites=[site],monthplot=False)),
+                    "3":(stage_3,plan_3,dict(site=site,standard_plots=True))}
+            for stage,(stage_func,plan_func,settings) in runs.items():
+                if stage=="3":
+                    settings["event_thresh"] = float(daily[site]["flow"].quantile(0.98).round(0))
+                    settings["min_peak"] = settings["event_thresh"]*2
+                if stage in ["2a","3","4"]:
+                    settings["daily"] = daily
+                before = dir_snapshot([site])
+                start = time.perf_counter()
+                result = stage_func(**settings)
+                seconds = time.perf_counter()-start
+                if stage=="1a":
+                    daily = result
+                plan = estimate_plan(plan_func(**dict(settings,daily=daily)),costs)
+                outputs = stage_outputs([site],before)
+                sizes = [size for file,size in outputs.items() if file.endswith(".jpg")]
+                if len(sizes)>0:
+                    costs["stage_figure_bytes"][stage] = float(np.mean(sizes))
+                units = plan.loc[plan["kind"]=="analysis","cells"].sum()
+                other = plan.loc[plan["kind"]!="analysis","seconds"].sum()
+                costs["year_s"][stage] = max(seconds-other,0)/max(units,1)
+                print(f"Script {stage}: {seconds:.1f} s, {len(outputs)} files (planned {plan['kind'].isin(['figure','table']).sum()})")
+        finally:
+            plt.close("all")
+            os.chdir(cwd)
+
+    check_dir(cache_dir)
+    with open(f"{cache_dir}/unit_costs.json","w") as f:
+        json.dump(costs,f,indent=1)
+    print(f"Unit costs saved to {cache_dir}/unit_costs.json")
+    return get_costs(cache_dir)
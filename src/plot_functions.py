@@ -9,14 +9,7 @@ This script contains the plotting functions and pre-defined variables used in th
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from scipy.stats import mannwhitneyu
-from scipy.stats import kendalltau
-from scipy.stats.mstats import theilslopes
-from scipy.stats import norm
-from src.functions import get_varlabel
-from statsmodels.graphics import tsaplots
+from src.functions import plt,mpl,get_varlabel
 
 def plot_trendsshifts(evs,dur,var):
     """
@@ -26,6 +19,9 @@ def plot_trendsshifts(evs,dur,var):
     :param var: str, parameter to plot (e.g., "avg_{parameter}")
     :return: figure
     """
+    from scipy.stats import kendalltau
+    from scipy.stats.mstats import theilslopes
+
     # calculate plotting positions
     fig, ax = plt.subplots(figsize=(6.25, 4))
     plt.get_cmap("viridis")
@@ -56,6 +52,8 @@ def plot_date_trend(evs,dur,WY):
     :param var: str, parameter to plot (e.g., "avg_{parameter}")
     :return: figure
     """
+    from scipy.stats import kendalltau
+    from scipy.stats.mstats import theilslopes
 
     # Convert dates to DOY
     dates = pd.DatetimeIndex(evs.start).day_of_year
@@ -84,6 +82,8 @@ def plot_date_trend(evs,dur,WY):
 
 
 def mannwhitney(evs,dur,var):
+    from scipy.stats import mannwhitneyu
+
     fig, ax = plt.subplots(figsize=(6.25, 4))
     plt.get_cmap("viridis")
     plt.ylabel(f"{dur} {get_varlabel(var)}")
@@ -106,6 +106,8 @@ def mannwhitney(evs,dur,var):
     plt.legend(bbox_to_anchor=(0.5, -0.2), loc='upper center', prop={'size': 10})
 
 def acf(evs,var):
+    from statsmodels.graphics import tsaplots
+
     # Drop nans
     evs = evs[var].dropna()
     # Create figure
@@ -122,6 +124,8 @@ def plot_normality(evs,dur,var):
     :param var: str, parameter to plot (e.g., "avg_{parameter}")
     :return: figure
     """
+    from scipy.stats import norm
+
     # calculate plotting positions
     if dur=="WY":
         return
@@ -168,6 +172,8 @@ def plot_voldurpp(site,site_dur,durations,alpha=0):
     :param alpha: float, alpha value for plotting positions
     :return: figure
     """
+    import probscale  # registers the 'prob' axis scale
+
     fig, ax = plt.subplots(figsize=(6.25, 4))
     plt.get_cmap("viridis")
     plt.xlabel('Exceedance Probability')
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+### PROFILE FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used to instrument the duration analyses: the wall time and number of calls of the
+hot functions (decorated with @timed, and every savefig), the total time of each stage and site, and optionally the
+peak memory of each stage and site (tracemalloc) and cProfile statistics of each stage (.pstats).
+
+Instrumentation is off (and costs one check per call) until start_profile() is called. Each process (e.g., batch
+workers) saves its records to report_dir/report_{run}_{host}_{pid}.json; profile_report() combines the reports of a run
+into report_dir/run_report_{run}.json.
+
+"""
+import os
+import json
+import time
+import socket
+import threading
+import functools
+
+# Settings and records of this process
+profile_state = {"on":False,"dir":None,"run":None,"memory":False,"cprofile":False,"records":dict(),"memory_peaks":dict(),
+                 "profiles":dict(),"savefig":None}
+profile_lock = threading.RLock()
+profile_local = threading.local() # stage and site of each thread
+
+### RECORD FUNCTIONS
+def current():
+    """
+    Function to find the stage and site of this thread
+    :return: str, str: stage and site ("" if not set)
+    """
+    return getattr(profile_local,"stage",""),getattr(profile_local,"site","")
+
+def record(name,seconds,stage=None,site=None):
+    """
+    Function to record a call of a function
+    :param name: str, function name
+    :param seconds: float, wall time of the call
+    :param stage: str, stage (current stage if None)
+    :param site: str, site (current site if None)
+    :return: None
+    """
+    cur_stage,cur_site = current()
+    key = (cur_stage if stage is None else stage,cur_site if site is None else site,name)
+    with profile_lock:
+        rec = profile_state["records"].setdefault(key,[0,0.0,0.0])
+        rec[0] += 1
+        rec[1] += seconds
+        rec[2] = max(rec[2],seconds)
+
+def record_memory():
+    """
+    Function to record the peak memory (tracemalloc) of the current stage and site, and reset the peak
+    :return: None
+    """
+    if not profile_state["memory"]:
+        return
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        return
+    key = current()
+    if key == ("",""):
+        return
+    size,peak = tracemalloc.get_traced_memory()
+    with profile_lock:
+        profile_state["memory_peaks"][key] = max(profile_state["memory_peaks"].get(key,0),peak)
+    tracemalloc.reset_peak()
+
+def end_site():
+    """
+    Function to record the time and peak memory of the site being analyzed by this thread
+    :return: None
+    """
+    if getattr(profile_local,"site","") != "":
+        record("(site)",time.perf_counter()-profile_local.site_start)
+    record_memory()
+
+def set_site(site):
+    """
+    Function to set the site being analyzed by this thread (records are attributed to it)
+    :param site: str, site name
+    :return: None
+    """
+    if not profile_state["on"]:
+        return
+    end_site()
+    profile_local.site,profile_local.site_start = site,time.perf_counter()
+
+def timed(func=None,stage=None,name=None):
+    """
+    Decorator to record the wall time and calls of a function (when instrumentation is on). Stage functions are
+    decorated with their stage (e.g., @timed(stage="1a")); they also set the current stage, record the peak memory and
+    collect cProfile statistics for the stage.
+    :param func: function
+    :param stage: str, stage name (stage functions only)
+    :param name: str, name of the records (function name if None)
+    :return: function
+    """
+    if func is None:
+        return lambda f: timed(f,stage,name)
+    label = func.__name__ if name is None else name
+
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        if not profile_state["on"]:
+            return func(*args,**kwargs)
+        # Stages called within a stage (e.g., stage_4_concat) are timed as functions of the outer stage
+        if stage is None or getattr(profile_local,"stage","") != "":
+            start = time.perf_counter()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                record(label,time.perf_counter()-start)
+
+        profile_local.stage,profile_local.site = stage,""
+        profiler = None
+        if profile_state["cprofile"]:
+            with profile_lock:
+                profiler = profile_state["profiles"].get(stage)
+                if profiler is None:
+                    import cProfile
+                    profiler = profile_state["profiles"][stage] = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            return func(*args,**kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            end_site()
+            # Stage total (all sites of this call)
+            record(label,time.perf_counter()-start,site="")
+            profile_local.stage,profile_local.site = "",""
+    return wrapper
+
+### SETUP FUNCTIONS
+def start_profile(report_dir="cache/profile",memory=False,cprofile=False,run=None):
+    """
+    Function to turn on instrumentation in this process (and in processes started after, see resume_profile())
+    :param report_dir: str, directory of reports and .pstats files
+    :param memory: boolean, record peak memory of each stage and site (tracemalloc, slows the analyses)
+    :param cprofile: boolean, collect cProfile statistics of each stage
+    :param run: str, run id (start time if None)
+    :return: str, run id
+    """
+    if run is None:
+        run = time.strftime("%Y%m%d_%H%M%S")
+    os.makedirs(report_dir,exist_ok=True)
+    with profile_lock:
+        profile_state.update({"on":True,"dir":report_dir,"run":run,"memory":memory,"cprofile":cprofile,
+                              "records":dict(),"memory_peaks":dict(),"profiles":dict()})
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    # Time every savefig (including plt.savefig)
+    if profile_state["savefig"] is None:
+        from matplotlib.figure import Figure
+        profile_state["savefig"] = Figure.savefig
+        Figure.savefig = timed(Figure.savefig,name="savefig")
+    # Settings for worker processes
+    os.environ["DURATION_PROFILE"] = json.dumps({"report_dir":report_dir,"memory":memory,"cprofile":cprofile,"run":run})
+    return run
+
+def resume_profile():
+    """
+    Function to turn on instrumentation in a worker process if it was turned on in the parent process (records copied
+    from the parent are cleared)
+    :return: None
+    """
+    settings = os.environ.get("DURATION_PROFILE")
+    if settings is not None:
+        start_profile(**json.loads(settings))
+
+def max_rss():
+    """
+    Function to find the peak resident memory of this process
+    :return: float, MB (None if not available, e.g., on Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3,1)
+
+def save_profile():
+    """
+    Function to save the records (and .pstats files) of this process
+    :return: str, report file (None if instrumentation is off)
+    """
+    if not profile_state["on"]:
+        return None
+    record_memory()
+    report_dir,run = profile_state["dir"],profile_state["run"]
+    name = f"{run}_{socket.gethostname()}_{os.getpid()}"
+    with profile_lock:
+        records = [{"stage":stage,"site":site,"function":func,"calls":calls,"seconds":round(seconds,6),
+                    "max_seconds":round(max_seconds,6)}
+                   for (stage,site,func),(calls,seconds,max_seconds) in profile_state["records"].items()]
+        memory = [{"stage":stage,"site":site,"peak_mb":round(peak/1e6,3)}
+                  for (stage,site),peak in profile_state["memory_peaks"].items()]
+        pstats = list()
+        for stage,profiler in profile_state["profiles"].items():
+            pstats.append(f"{report_dir}/{stage}_{name}.pstats")
+            profiler.dump_stats(pstats[-1])
+    report = {"run":run,"host":socket.gethostname(),"pid":os.getpid(),"saved":time.strftime("%Y-%m-%d %H:%M:%S"),
+              "max_rss_mb":max_rss(),"records":records,"memory":memory,"pstats":pstats}
+    # Write and rename, so a partial report is never read
+    filename = f"{report_dir}/report_{name}.json"
+    with open(f"{filename}.tmp","w") as f:
+        json.dump(report,f,indent=1)
+    os.replace(f"{filename}.tmp",filename)
+    return filename
+
+def stop_profile():
+    """
+    Function to save the records and turn off instrumentation in this process
+    :return: str, report file
+    """
+    filename = save_profile()
+    with profile_lock:
+        profile_state["on"] = False
+    if profile_state["savefig"] is not None:
+        from matplotlib.figure import Figure
+        Figure.savefig = profile_state["savefig"]
+        profile_state["savefig"] = None
+    if profile_state["memory"]:
+        import tracemalloc
+        tracemalloc.stop()
+    os.environ.pop("DURATION_PROFILE",None)
+    return filename
+
+### REPORT FUNCTIONS
+def profile_report(report_dir="cache/profile",run=None,top=15):
+    """
+    Function to combine the reports of all processes of a run, save the run report (and combined .pstats for each
+    stage) and print the slowest functions
+    :param report_dir: str, directory of reports
+    :param run: str, run id (run of this process, or latest run, if None)
+    :param top: int, number of functions to print
+    :return: dict, run report
+    """
+    import glob
+    import pandas as pd
+    if run is None:
+        run = profile_state["run"]
+    if run is None:
+        reports = sorted(glob.glob(f"{report_dir}/report_*.json"),key=os.path.getmtime)
+        if len(reports)==0:
+            print(f"No reports found in {report_dir}")
+            return None
+        with open(reports[-1],"r") as f:
+            run = json.load(f)["run"]
+
+    processes,records,memory,pstats = list(),list(),list(),dict()
+    for filename in sorted(glob.glob(f"{report_dir}/report_{run}_*.json")):
+        with open(filename,"r") as f:
+            report = json.load(f)
+        processes.append({k:report[k] for k in ["host","pid","saved","max_rss_mb"]})
+        records += report["records"]
+        memory += report["memory"]
+        for filename in report["pstats"]:
+            stage = os.path.basename(filename).split(f"_{run}_")[0]
+            pstats.setdefault(stage,list()).append(filename)
+
+    # Combine processes (e.g., batch workers)
+    records = pd.DataFrame(records,columns=["stage","site","function","calls","seconds","max_seconds"])
+    records = records.groupby(["stage","site","function"],sort=False).agg(
+        {"calls":"sum","seconds":"sum","max_seconds":"max"}).reset_index()
+    memory = pd.DataFrame(memory,columns=["stage","site","peak_mb"])
+    memory = memory.groupby(["stage","site"],sort=False).max().reset_index()
+    combined = list()
+    if len(pstats)>0:
+        import pstats as ps
+        for stage,files in pstats.items():
+            ps.Stats(*files).dump_stats(f"{report_dir}/{stage}_{run}.pstats")
+            combined.append(f"{report_dir}/{stage}_{run}.pstats")
+
+    run_report = {"run":run,"created":time.strftime("%Y-%m-%d %H:%M:%S"),"processes":processes,
+                  "records":records.round(6).to_dict("records"),"memory":memory.to_dict("records"),"pstats":combined}
+    filename = f"{report_dir}/run_report_{run}.json"
+    with open(filename,"w") as f:
+        json.dump(run_report,f,indent=1)
+
+    # Stage totals, and slowest functions over all stages and sites
+    totals = records.loc[records["site"]==""].loc[records["function"].str.startswith("stage_")]
+    print("Stage times (s):")
+    print(totals.groupby("stage",sort=False)["seconds"].sum().round(2).to_string())
+    funcs = records.loc[~records["function"].str.startswith("stage_") & (records["function"]!="(site)")]
+    funcs = funcs.groupby("function")[["calls","seconds"]].sum().sort_values("seconds",ascending=False)
+    print(f"Slowest functions:\n{funcs.head(top).round(3).to_string()}")
+    if len(memory)>0:
+        print(f"Peak memory (MB):\n{memory.groupby('stage',sort=False)['peak_mb'].max().to_string()}")
+    print(f"Run report saved to {filename}")
+    return run_report
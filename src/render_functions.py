@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+### RENDER FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used to draw, save and close figures. figure_context() saves the figure drawn in
+its block and closes every figure opened in it (also if the block fails), so figures do not pile up over many sites and
+years.
+
+The per-year and per-event figures (script 4 WY plots, script 3 event plots and CVHS hydrograph plots) are described by
+a plot function and a lightweight spec (keyword arguments with only the data of the year or event); with render
+workers set (set_render()), figures are drawn and saved in a pool of processes while the analysis continues. The same
+plot function draws the figure in either case, so the saved files are identical to drawing them one by one. With reuse
+set, plot functions with a registered template update (register_template()) draw the first figure only and update the
+data of its artists for the next years (the figure is drawn again when the layout differs, e.g., a missing peak).
+
+With output set to "pdf" or "sheet", the figures of a plot family (e.g., the WY plots of a site) are written to a single
+multi-page .pdf or a tiled contact sheet (.jpg) instead of one file each, with an index (_index.csv) of the file each
+page or tile stands for, and optionally small thumbnails (thumbs folder). Pages of a .pdf are drawn in this process;
+tiles of a contact sheet are drawn in the render processes if set.
+
+"""
+import os
+import io
+import json
+import warnings
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from src.functions import plt,mpl
+
+# Render settings: processes drawing figures (0 draws in this process), figures waiting per process before the
+# analysis waits (the data of each is held until drawn), reuse of figure templates, output of plot families ("files",
+# "pdf" or "sheet") and thumbnails
+render_settings = {"workers":0,"pending":4,"reuse":False,"output":"files","thumbnails":False}
+render_state = {"pool":None,"futures":list(),"pid":None,"templates":dict(),"families":dict()}
+output_modes = ["files","pdf","sheet"]
+
+# Contact sheet layout: tiles per row, resolution of tiles and thumbnails
+sheet_layout = {"columns":5,"tile_dpi":60,"thumb_dpi":30}
+
+# Template update of each plot function (see register_template())
+figure_templates = dict()
+
+@contextmanager
+def figure_context(file=None,dpi=300,bbox_inches="tight",family=None):
+    """
+    Context to save the current figure at the end of the block and close all figures opened in the block (nothing is
+    saved if the block opens no figure, e.g., a plot skipped for the WY duration; figure templates are kept open)
+    :param file: str, output file (None to only close the figures)
+    :param dpi: int, resolution (None for the matplotlib default)
+    :param bbox_inches: str, bounding box (e.g., "tight") or None
+    :param family: str, plot family of the figure (see save_figure())
+    :return: None
+    """
+    before = set(plt.get_fignums())
+    try:
+        yield
+        if file is not None and set(plt.get_fignums())-before:
+            save_figure(plt.gcf(),file,dpi,bbox_inches,family)
+    finally:
+        templates = {fig.number for fig in render_state["templates"].values()}
+        for num in set(plt.get_fignums())-before-templates:
+            plt.close(num)
+
+def set_render(workers=None,pending=None,reuse=None,output=None,thumbnails=None):
+    """
+    Function to select the number of render processes, the reuse of figure templates and the output of plot families,
+    in this process and in processes started after (e.g., batch workers, each with its own render processes)
+    :param workers: int, number of render processes (0 draws figures in this process), None to keep
+    :param pending: int, figures waiting per render process before the analysis waits, None to keep
+    :param reuse: boolean, update the artists of a figure template between years instead of drawing each figure, None
+    to keep
+    :param output: str, "files" (one file per figure), "pdf" (multi-page .pdf per plot family) or "sheet" (contact sheet
+    per plot family), None to keep
+    :param thumbnails: boolean, also save small thumbnails of the figures of plot families, None to keep
+    :return: dict, previous settings
+    """
+    if output is not None and output not in output_modes:
+        raise ValueError(f"Unknown output {output}; outputs are {output_modes}")
+    previous = dict(render_settings)
+    if (workers is not None and int(workers) != render_settings["workers"]) or \
+            (reuse is not None and bool(reuse) != render_settings["reuse"]):
+        close_render_pool()
+    if workers is not None:
+        render_settings["workers"] = max(int(workers),0)
+    if pending is not None:
+        render_settings["pending"] = max(int(pending),1)
+    if reuse is not None:
+        render_settings["reuse"] = bool(reuse)
+    if output is not None:
+        close_families()
+        render_settings["output"] = output
+    if thumbnails is not None:
+        render_settings["thumbnails"] = bool(thumbnails)
+    os.environ["DURATION_RENDER"] = json.dumps(render_settings)
+    return previous
+
+def init_render_worker(rc):
+    """
+    Function to prepare each render process (non-interactive plotting, same style as the analysis process)
+    :param rc: dict, matplotlib rcParams of the analysis process
+    :return: None
+    """
+    mpl.use("Agg")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        mpl.rcParams.update(rc)
+
+def own_renders():
+    """
+    Function to forget the render processes and figures of a parent process (e.g., copied to a batch worker)
+    :return: None
+    """
+    if render_state["pid"] != os.getpid():
+        render_state.update({"pool":None,"futures":list(),"pid":os.getpid(),"templates":dict(),"families":dict()})
+
+def register_template(plot):
+    """
+    Decorator to register the function updating a figure drawn by a plot function with the spec of another figure
+    (update(fig,**spec) returns False if the layout differs, and the figure is drawn again)
+    :param plot: function, plot function
+    :return: function
+    """
+    def register(update):
+        figure_templates[f"{plot.__module__}.{plot.__name__}"] = update
+        return update
+    return register
+
+def close_templates():
+    """
+    Function to close the figure templates of this process
+    :return: None
+    """
+    own_renders()
+    for fig in render_state["templates"].values():
+        plt.close(fig)
+    render_state["templates"] = dict()
+
+def render_pool():
+    """
+    Function to start (or find) the pool of render processes
+    :return: ProcessPoolExecutor
+    """
+    own_renders()
+    if render_state["pool"] is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing.util import Finalize
+        rc = {k:v for k,v in mpl.rcParams.items() if k!="backend"}
+        # New processes (not forked: batch workers may have running threads), with the style of this process
+        render_state["pool"] = ProcessPoolExecutor(max_workers=render_settings["workers"],
+                                                   mp_context=multiprocessing.get_context("spawn"),
+                                                   initializer=init_render_worker,initargs=(rc,))
+        # Processes of a pool (e.g., batch workers) exit without atexit and wait for their render processes; shut them
+        # down before the queues of the pool are closed
+        Finalize(None,close_render_pool,exitpriority=100)
+    return render_state["pool"]
+
+def family_file(family):
+    """
+    Function to find the file of a plot family in the current output
+    :param family: str, plot family (path without extension, e.g., "site/volume/site_wy_plots")
+    :return: str, .pdf or contact sheet (.jpg) file
+    """
+    return f"{family}.pdf" if render_settings["output"]=="pdf" else f"{family}_sheet.jpg"
+
+def output_file(file,family=None):
+    """
+    Function to find the file a figure is written to (its own file, or the file of its plot family)
+    :param file: str, output file of the figure
+    :param family: str, plot family of the figure or None
+    :return: str, file
+    """
+    if family is None or render_settings["output"]=="files":
+        return file
+    return family_file(family)
+
+def figure_tile(fig,bbox_inches="tight"):
+    """
+    Function to draw a figure as a tile of a contact sheet
+    :param fig: figure
+    :param bbox_inches: str, bounding box (e.g., "tight") or None
+    :return: array, RGB pixels
+    """
+    buffer = io.BytesIO()
+    fig.savefig(buffer,format="png",dpi=sheet_layout["tile_dpi"],bbox_inches=bbox_inches)
+    buffer.seek(0)
+    return (plt.imread(buffer)[:,:,:3]*255).astype(np.uint8)
+
+def save_thumbnail(fig,file,family,bbox_inches="tight"):
+    """
+    Function to save a small thumbnail of a figure of a plot family (thumbs folder next to the family file)
+    :param fig: figure
+    :param file: str, output file of the figure
+    :param family: str, plot family
+    :param bbox_inches: str, bounding box (e.g., "tight") or None
+    :return: None
+    """
+    thumbdir = os.path.join(os.path.dirname(family),"thumbs")
+    os.makedirs(thumbdir,exist_ok=True)
+    fig.savefig(os.path.join(thumbdir,os.path.basename(file)),dpi=sheet_layout["thumb_dpi"],bbox_inches=bbox_inches)
+
+def open_family(family):
+    """
+    Function to start (or find) the .pdf or contact sheet of a plot family
+    :param family: str, plot family
+    :return: dict, family file, pages (.pdf), tiles (contact sheet) and files (index)
+    """
+    own_renders()
+    if family not in render_state["families"].keys():
+        pages = None
+        if render_settings["output"]=="pdf":
+            from matplotlib.backends.backend_pdf import PdfPages
+            pages = PdfPages(family_file(family))
+        render_state["families"][family] = {"file":family_file(family),"pages":pages,"tiles":list(),"files":list()}
+    return render_state["families"][family]
+
+def save_figure(fig,file,dpi=300,bbox_inches="tight",family=None):
+    """
+    Function to save a figure to its file or, with output "pdf" or "sheet" (see set_render()), add it to its plot family
+    :param fig: figure
+    :param file: str, output file
+    :param dpi: int, resolution (None for the matplotlib default)
+    :param bbox_inches: str, bounding box (e.g., "tight") or None
+    :param family: str, plot family (path of the family file without extension) or None
+    :return: None
+    """
+    if family is None or render_settings["output"]=="files":
+        fig.savefig(file,bbox_inches=bbox_inches,dpi=dpi)
+        return
+    if render_settings["thumbnails"]:
+        save_thumbnail(fig,file,family,bbox_inches)
+    members = open_family(family)
+    members["files"].append(file)
+    if members["pages"] is not None:
+        members["pages"].savefig(fig,bbox_inches=bbox_inches)
+    else:
+        members["tiles"].append(figure_tile(fig,bbox_inches))
+
+def save_sheet(file,tiles):
+    """
+    Function to tile figures in a contact sheet (white background, in rows of sheet_layout["columns"])
+    :param file: str, output file
+    :param tiles: list, RGB arrays (see figure_tile())
+    :return: None
+    """
+    columns = min(sheet_layout["columns"],len(tiles))
+    rows = -(-len(tiles)//columns)
+    height = max(t.shape[0] for t in tiles)
+    width = max(t.shape[1] for t in tiles)
+    sheet = np.full((rows*height,columns*width,3),255,dtype=np.uint8)
+    for n,tile in enumerate(tiles):
+        r,c = divmod(n,columns)
+        sheet[r*height:r*height+tile.shape[0],c*width:c*width+tile.shape[1]] = tile
+    plt.imsave(file,sheet)
+
+def close_family(family):
+    """
+    Function to finish the .pdf or contact sheet of a plot family and save its index (waits for its tiles)
+    :param family: str, plot family
+    :return: str, family file (None if the family has no figures)
+    """
+    own_renders()
+    members = render_state["families"].pop(family,None)
+    if members is None:
+        return None
+    if members["pages"] is not None:
+        members["pages"].close()
+        index = pd.DataFrame({"file":members["files"]},index=pd.RangeIndex(1,len(members["files"])+1,name="page"))
+    else:
+        tiles = [t.result() if hasattr(t,"result") else t for t in members["tiles"]]
+        save_sheet(members["file"],tiles)
+        columns = min(sheet_layout["columns"],len(tiles))
+        index = pd.DataFrame({"row":[n//columns+1 for n in range(len(tiles))],
+                              "column":[n%columns+1 for n in range(len(tiles))],"file":members["files"]},
+                             index=pd.RangeIndex(1,len(tiles)+1,name="tile"))
+    index["file"] = [os.path.basename(f) for f in index["file"]]
+    index.to_csv(f"{family}_index.csv")
+    return members["file"]
+
+def close_families():
+    """
+    Function to finish the plot families of this process
+    :return: None
+    """
+    own_renders()
+    for family in list(render_state["families"].keys()):
+        close_family(family)
+
+def render_figure(plot,file,dpi=300,bbox_inches="tight",spec=None,family=None,tile=False):
+    """
+    Function to draw a figure with a plot function and save it (in this process or a render process)
+    :param plot: function, plot function (module level, draws a new figure with pyplot)
+    :param file: str, output file
+    :param dpi: int, resolution
+    :param bbox_inches: str, bounding box (e.g., "tight") or None
+    :param spec: dict, keyword arguments of plot
+    :param family: str, plot family (see save_figure()) or None
+    :param tile: boolean, return the figure as a contact sheet tile (render processes; added to the family in this
+    process)
+    :return: str, output file (array if tile)
+    """
+    spec = {} if spec is None else spec
+    key = f"{plot.__module__}.{plot.__name__}"
+    with figure_context():
+        if render_settings["reuse"] and key in figure_templates.keys():
+            own_renders()
+            fig = render_state["templates"].get(key)
+            if fig is None or not figure_templates[key](fig,**spec):
+                if fig is not None:
+                    plt.close(fig)
+                    render_state["templates"].pop(key)
+                plot(**spec)
+                fig = render_state["templates"][key] = plt.gcf()
+        else:
+            plot(**spec)
+            fig = plt.gcf()
+        if tile:
+            if render_settings["thumbnails"]:
+                save_thumbnail(fig,file,family,bbox_inches)
+            return figure_tile(fig,bbox_inches)
+        save_figure(fig,file,dpi,bbox_inches,family)
+    return file
+
+def collect_renders(wait_all=False):
+    """
+    Function to check the figures sent to the render processes (errors are raised as when drawn in this process)
+    :param wait_all: boolean, wait for all figures (otherwise, only finished figures are checked)
+    :return: int, number of figures saved
+    """
+    from concurrent.futures import wait
+    own_renders()
+    futures = render_state["futures"]
+    if wait_all:
+        wait(futures)
+    done = [f for f in futures if f.done()]
+    render_state["futures"] = [f for f in futures if not f.done()]
+    for f in done:
+        f.result()
+    return len(done)
+
+def render(plot,file,dpi=300,bbox_inches="tight",family=None,**spec):
+    """
+    Function to draw and save a figure, in a render process if render workers are set (see set_render())
+    :param plot: function, plot function (module level, draws a new figure with pyplot)
+    :param file: str, output file
+    :param dpi: int, resolution
+    :param bbox_inches: str, bounding box (e.g., "tight") or None
+    :param family: str, plot family of the figure (path of the .pdf or contact sheet without extension, see
+    set_render()) or None
+    :param spec: keyword arguments of plot (only the data of the figure, as it is sent to the render process)
+    :return: None
+    """
+    family = None if render_settings["output"]=="files" else family
+    # Pages of a .pdf are written by this process
+    if render_settings["workers"] < 1 or (family is not None and render_settings["output"]=="pdf"):
+        render_figure(plot,file,dpi,bbox_inches,spec,family)
+        return
+    from concurrent.futures import wait,FIRST_COMPLETED
+    pool = render_pool()
+    collect_renders()
+    # Wait if the render processes are behind
+    while len(render_state["futures"]) >= render_settings["workers"]*render_settings["pending"]:
+        wait(render_state["futures"],return_when=FIRST_COMPLETED)
+        collect_renders()
+    if family is None:
+        render_state["futures"].append(pool.submit(render_figure,plot,file,dpi,bbox_inches,spec))
+        return
+    # Tiles are drawn in the render processes and placed in the contact sheet in order
+    future = pool.submit(render_figure,plot,file,dpi,bbox_inches,spec,family,True)
+    render_state["futures"].append(future)
+    members = open_family(family)
+    members["files"].append(file)
+    members["tiles"].append(future)
+
+def wait_renders():
+    """
+    Function to wait until all figures sent to the render processes are saved, and close the figure templates and plot
+    families of this process (e.g., at the end of a stage)
+    :return: int, number of figures saved since last checked
+    """
+    close_templates()
+    try:
+        return collect_renders(wait_all=True)
+    finally:
+        close_families()
+
+def close_render_pool():
+    """
+    Function to wait for all figures and shut down the render processes
+    :return: None
+    """
+    own_renders()
+    try:
+        wait_renders()
+    finally:
+        if render_state["pool"] is not None:
+            render_state["pool"].shutdown()
+            render_state["pool"] = None
+
+# Settings selected by the parent process (e.g., of batch workers)
+if os.environ.get("DURATION_RENDER"):
+    render_settings.update(json.loads(os.environ["DURATION_RENDER"]))
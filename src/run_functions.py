@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+### RUN SPECIFICATION FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used to run many configurations of the duration analyses from a single run
+specification file (run_spec.py). All configurations are run in one process: results of each stage (daily data, peaks,
+durations) are passed to the following configurations, daily data, threshold events and proxy volume tables are
+shared by script 3 configurations that use the same inputs, and cumulative sums and rolling means are shared by script 4
+configurations of the same site and seasons. A dry run passes the daily data and peak tables planned for scripts 1a and
+1b to the following configurations.
+
+A run specification (.toml, .yaml or .json) contains optional "defaults" (settings used by every run) and a list of
+"runs". Each run names a "stage" ("1a", "1b", "2a", "2b", "3", "4" or "5"), the settings for that stage (the user
+inputs of the matching script), an optional "name", and an optional "sweep" of settings with lists of values; each
+combination of the sweep values is run as a separate configuration.
+
+"""
+import os
+import json
+import time
+import inspect
+import itertools
+import pandas as pd
+from src.stage_functions import stage_1a,stage_1b,stage_2a,stage_2b,stage_3,stage_4,stage_5
+from src.plan_functions import plan_report,plan_daily
+
+# Stage functions and the in-memory results they accept (argument: shared result)
+stages = {"1a":stage_1a,"1b":stage_1b,"2a":stage_2a,"2b":stage_2b,"3":stage_3,"4":stage_4,"5":stage_5}
+stage_inputs = {"1a":{},
+                "1b":{"daily":"daily"},
+                "2a":{"daily":"daily"},
+                "2b":{"daily":"daily","flow":"flow"},
+                "3":{"daily":"daily","memo":"memo"},
+                "4":{"daily":"daily","peaks":"peaks","memo":"vol_memo"},
+                "5":{"voldur":"voldur","peaks":"peaks"}}
+stage_outputs = {"1a":"daily","1b":"peaks","2a":"flow","4":"voldur"}
+
+def load_spec(filename):
+    """
+    Function to load a run specification
+    :param filename: str, .toml, .yaml/.yml or .json file
+    :return: dict, run specification
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".json":
+        with open(filename) as f:
+            return json.load(f)
+    elif ext == ".toml":
+        import tomllib
+        with open(filename,"rb") as f:
+            return tomllib.load(f)
+    elif ext in [".yaml",".yml"]:
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("pyyaml is required for .yaml run specifications (pip install pyyaml)")
+        with open(filename) as f:
+            return yaml.safe_load(f)
+    else:
+        raise ValueError(f"Run specification must be .toml, .yaml or .json, not {ext}")
+
+def expand_runs(spec):
+    """
+    Function to expand a run specification into a list of configurations (one for each combination of sweep values)
+    :param spec: dict, run specification (output from load_spec())
+    :return: list, configurations (dict with name, stage and settings)
+    """
+    defaults = spec.get("defaults",dict())
+    configs = list()
+    for n,run in enumerate(spec.get("runs",list())):
+        run = dict(run)
+        stage = str(run.pop("stage",defaults.get("stage","")))
+        if stage not in stages.keys():
+            raise ValueError(f"Run {n+1}: stage must be one of {list(stages.keys())}, not '{stage}'")
+        name = run.pop("name",f"{stage}")
+        sweep = run.pop("sweep",dict())
+
+        # Only use defaults accepted by the stage, so defaults can be shared by different stages
+        params = inspect.signature(stages[stage]).parameters
+        settings = {k:v for k,v in defaults.items() if k in params.keys()}
+        settings.update(run)
+        unknown = [k for k in list(settings.keys())+list(sweep.keys()) if k not in params.keys() or k in stage_inputs[stage].keys()]
+        if len(unknown)>0:
+            raise ValueError(f"Run {n+1} ({name}): unknown settings for stage {stage}: {unknown}")
+
+        for values in itertools.product(*[v if isinstance(v,list) else [v] for v in sweep.values()]):
+            config = dict(settings)
+            config.update(zip(sweep.keys(),values))
+            # A single site can be given for stages that accept lists of sites
+            if isinstance(config.get("sites"),str):
+                config["sites"] = [config["sites"]]
+            label = " ".join([f"{k}={v}" for k,v in zip(sweep.keys(),values)])
+            configs.append({"name":f"{name} {label}".strip(),"stage":stage,"settings":config})
+    return configs
+
+def planned_results(stage,settings):
+    """
+    Function to find the in-memory results of a configuration without running it (dry run), so the following
+    configurations are planned with the record of each site: daily data for script 1a (local sources or previous
+    outputs, see plan_daily()) and the peak tables of each season for script 1b (None, as they are not imported)
+    :param stage: str, stage name
+    :param settings: dict, settings of the configuration
+    :return: dict, results for each site (as returned by the stage function)
+    """
+    if stage == "1a":
+        params = inspect.signature(stages[stage]).parameters
+        args = [settings.get(k,params[k].default) for k in ["wy_division","decimal","zero"]]
+        daily = plan_daily(settings["sites"],settings["site_sources"],*args)
+        return {site:data for site,data in daily.items() if data is not None}
+    if stage == "1b":
+        seasons = settings.get("seasons",False)
+        names = [""]+([f"_{s}" for s in seasons.keys()] if isinstance(seasons,dict) else [])
+        return {site:dict.fromkeys(names) for site,site_source in zip(settings["sites"],settings["site_sources"])
+                if site_source is not None}
+    return dict()
+
+def run_config(config,shared):
+    """
+    Function to run a single configuration, passing and updating the in-memory results shared between configurations
+    :param config: dict, configuration (from expand_runs())
+    :param shared: dict, in-memory results (daily, peaks, flow, voldur, memo and vol_memo dicts)
+    :return: output from the stage function
+    """
+    stage = config["stage"]
+    inputs = {arg:shared[key] for arg,key in stage_inputs[stage].items()}
+
+    if config["settings"].get("dry_run",False):
+        # Plan only (see plan_functions.py), passing the results planned for the following configurations
+        planned = planned_results(stage,config["settings"])
+        if stage == "1a" and "imported" not in config["settings"].keys():
+            inputs["imported"] = planned
+        result = stages[stage](**config["settings"],**inputs)
+        if stage in stage_outputs.keys():
+            shared[stage_outputs[stage]].update(planned)
+        return result
+
+    result = stages[stage](**config["settings"],**inputs)
+    if stage in stage_outputs.keys() and result is not None:
+        shared[stage_outputs[stage]].update(result)
+    if stage == "1a":
+        # New daily data, so events, proxy volumes, cumulative sums and rolling means must be redeveloped
+        shared["memo"].clear()
+        shared["vol_memo"].clear()
+    return result
+
+def run_spec(spec,keep_going=False,dry_run=False,outfile=None):
+    """
+    Function to run all configurations of a run specification in this process
+    :param spec: str or dict, run specification file or output from load_spec()
+    :param keep_going: boolean, continue with the next configuration if one fails (otherwise stop)
+    :param dry_run: boolean, only plan the outputs of each configuration (see plan_functions.py)
+    :param outfile: str, .csv file for the plan (dry_run only) or None
+    :return: df, stage, status and run time of each configuration (summary of the plan if dry_run)
+    """
+    if isinstance(spec,str):
+        spec = load_spec(spec)
+    configs = expand_runs(spec)
+    shared = {"daily":dict(),"peaks":dict(),"flow":dict(),"voldur":dict(),"memo":dict(),"vol_memo":dict()}
+
+    if dry_run:
+        plans = list()
+        for config in configs:
+            plan = run_config({**config,"settings":{**config["settings"],"dry_run":True}},shared)
+            plan.insert(0,"name",config["name"])
+            plans.append(plan)
+        return plan_report(plans,outfile=outfile)
+
+    summary = pd.DataFrame(columns=["name","stage","status","seconds"])
+    for n,config in enumerate(configs):
+        print(f"Run {n+1} of {len(configs)}: {config['name']}")
+        start = time.perf_counter()
+        try:
+            run_config(config,shared)
+            status = "done"
+        except Exception as error:
+            if not keep_going:
+                raise
+            print(f"Run {config['name']} failed: {error!r}")
+            status = "failed"
+        summary.loc[n] = [config["name"],config["stage"],status,round(time.perf_counter()-start,2)]
+    return summary
@@ -0,0 +1,1281 @@
+# -*- coding: utf-8 -*-
+"""
+### STAGE FUNCTIONS ###
+@author: tclarkin (USBR 2021)
+
+This script contains the stages of the duration analyses (scripts 1a, 1b, 2a, 2b, 3, 4 and 5) as functions, so that
+they can be run in a single process (e.g., by 0_duration_analyses_batch.py or run_spec.py) with results passed in memory. Outputs are
+still saved to the same files as the scripts.
+
+Each stage accepts the in-memory results of the previous stages (e.g., daily=stage_1a(...)); if not provided (or a site
+is missing), the files from previous runs are used. With dry_run=True, each stage only returns the plan of its outputs
+(see plan_functions.py); nothing is run or saved.
+
+"""
+import os
+import pandas as pd
+import numpy as np
+from src.functions import plt,check_dir,simple_plot,get_varlabel,get_seasons,save_seasons,get_list,get_daily
+from src.functions import wy_completeness,save_completeness,get_completeness,season_masks
+from src.data_functions import import_daily,import_peaks,season_subset,summarize_daily,nwis_import,csv_daily_import
+from src.flow_functions import annualcombos,monthcombos,allcombos,standard,alphabet
+from src.flow_functions import analyze_dur,plot_monthly_dur_ep,plot_wytraces,plot_boxplot,calculate_ep_seasonal,plot_dur_ep
+from src.crit_functions import identify_thresh_events,init_duration_plot,plot_and_calc_durations,plot_thresh_duration
+from src.crit_functions import thresh_duration_spec
+from src.crit_functions import analyze_volwindow_duration,cvhs_vol_table,analyze_cvhs_duration,analyze_cvhs_sweep,summarize_cvhs_sweep
+from src.vol_functions import analyze_voldur,voldur_data,init_voldurplot,cfs2af
+from src.vol_functions import plot_voldur_wy,voldur_wy_spec
+from src.vol_functions import voldur_surface,surface_pp,concat_tables,voldur_series,save_voldur_series
+from src.vol_functions import analyze_lowflow_multi,lowflow_surface,lowflow_stats
+from src.plot_functions import plot_trendsshifts,plot_normality,plot_voldurpp,plot_voldurpdf,plot_voldurmonth,mannwhitney,plot_date_trend,acf
+from src.plan_functions import plan_1a,plan_1b,plan_2a,plan_2b,plan_3,plan_4,plan_5
+from src.profile_functions import timed,set_site
+from src.engine_functions import get_engine
+from src.render_functions import figure_context,render,wait_renders,close_family
+
+### DAILY DATA PREPARATION (1a)
+@timed(stage="1a")
+def stage_1a(sites,site_sources,wy_division="WY",decimal=2,zero=False,seasons=False,season_files=True,imported=None,
+             dry_run=False):
+    """
+    This function imports, formats and saves continuous daily data for each site (script 1a)
+    :param sites: list, site or dam names
+    :param site_sources: list, .csv file or other site info for supported data
+    :param wy_division: str, "WY" or "CY"
+    :param decimal: int, number of decimal places to use in data
+    :param zero: False, minimum flow value, or "average" (to handle negative values)
+    :param seasons: dict, seasons by months {"name":[months]} or start/stop {"name":[start,stop]}, OR False
+    :param season_files: boolean, write NaN-masked daily data for each season
+    :param imported: dict, output from import_daily() for each site already imported (e.g., by a download thread)
+    :param dry_run: boolean, only plan the outputs (see plan_1a())
+    :return: dict, site_daily df for each site (plan if dry_run)
+    """
+    if dry_run:
+        return plan_1a(sites,site_sources,wy_division,decimal,zero,seasons,season_files,imported)
+    daily = dict()
+    for site,site_source in zip(sites,site_sources):
+        set_site(site)
+        print(f"Importing daily data for {site}...")
+        # Check directories
+        outdir = check_dir(site,"data")
+
+        # Load, plot, and save at-site data
+        if imported is not None and site in imported.keys():
+            site_daily = imported[site]
+        else:
+            site_daily = import_daily(site_source,wy_division,decimal,zero)
+        site_summary = summarize_daily(site_daily)
+        site_daily.to_csv(f"{outdir}/{site}_site_daily.csv")
+        print(f"Site data saved to {outdir}/{site}_site_daily.csv")
+        site_summary.to_csv(f"{outdir}/{site}_site_summary.csv")
+        print(f"Site summary saved to {outdir}/{site}_site_summary.csv")
+        save_completeness(site,wy_completeness(site_daily))
+
+        with figure_context(f"{outdir}/{site}_site_daily.jpg",dpi=600):
+            simple_plot(site_daily,"Site Daily")
+
+            # Subset by season, if selected
+            if isinstance(seasons,bool)==False:
+                if all(seasons):
+                    var = site_daily.columns[0]
+                    # Subset, plot, and save seasonal data
+                    for s in seasons.keys():
+                        season_daily = season_subset(site_daily,seasons[s],var)
+                        plt.plot(season_daily.index, season_daily[var], linestyle="dashed", label=f"{s}")
+                        if season_files:
+                            season_daily.to_csv(f"{outdir}/{site}_{s}_site_daily.csv")
+                            print(f"Seasonal data saved to {outdir}/{site}_{s}_site_daily.csv")
+                        save_completeness(site,wy_completeness(season_daily,var),f"_{s}",seasons[s])
+
+            # Complete and save plot
+            plt.legend()
+
+        # Save list of seasons
+        save_seasons(site,seasons)
+
+        daily[site] = site_daily
+
+    return daily
+
+### PEAK DATA PREPARATION (1b)
+@timed(stage="1b")
+def stage_1b(sites,site_sources,seasons=False,daily=None,imported=None,dry_run=False):
+    """
+    This function imports, formats and saves annual peaks for each site (script 1b)
+    :param sites: list, site or dam names
+    :param site_sources: list, .csv file or other site info for supported data (None for no peaks)
+    :param seasons: dict, seasons by months {"name":[months]} or start/stop {"name":[start,stop]}, OR False
+    :param daily: dict, site_daily df for each site (output from stage_1a(), files used if None)
+    :param imported: dict, output from import_peaks() for each site already imported (e.g., by a download thread)
+    :param dry_run: boolean, only plan the outputs (see plan_1b())
+    :return: dict, dict of peaks df for each season suffix ("" for annual) for each site (plan if dry_run)
+    """
+    if dry_run:
+        return plan_1b(sites,site_sources,seasons,daily)
+    peaks = dict()
+    for site,site_source in zip(sites,site_sources):
+        set_site(site)
+        print(f"Importing peak data for {site}...")
+        if site_source is None:
+            continue
+        outdir = check_dir(site,"data")
+        peaks[site] = dict()
+
+        # Load, plot, and save at-site data
+        if imported is not None and site in imported.keys():
+            site_peaks,var = imported[site]
+        else:
+            site_peaks,var = import_peaks(site_source)
+        site_peaks.dropna(inplace=True)
+        with figure_context(f"{outdir}/{site}_site_peak.jpg",dpi=300):
+            simple_plot(site_peaks,"Site Peaks",marker="o")
+            plt.legend()
+
+        # Find daily max to match peak
+        data = get_daily(site,"",daily)
+        dvar = data.columns[0]
+        if data.wy.max() > site_peaks.index.max():
+            for wy in range(int(site_peaks.index.max()+1),data.wy.max()):
+                site_peaks.loc[wy,:] = [np.nan]*len(site_peaks.columns)
+
+        for wy in site_peaks.index:
+            peak_date = pd.to_datetime(site_peaks.loc[wy,"date"])
+            if (peak_date>=data.index.min()) and (peak_date<=data.index.max()):
+                site_peaks.loc[wy,"daily_flow"] = data.loc[peak_date,dvar]
+
+        site_peaks.to_csv(f"{outdir}/{site}_site_peak.csv")
+        print(f"Site data saved to {outdir}/{site}_site_peak.csv")
+        peaks[site][""] = site_peaks
+
+        if isinstance(seasons,bool)==False:
+            if all(seasons):
+                # Subset, plot, and save seasonal data
+                for s in seasons.keys():
+                    season_peaks = season_subset(site_peaks,seasons[s],var)
+
+                    # Find other peaks (if available)
+                    data = get_daily(site,f"_{s}",daily)
+                    dvar = data.columns[0]
+
+                    for wy in season_peaks.loc[pd.isna(season_peaks.peak)].index:
+                        if wy not in data.wy.unique():
+                            continue
+                        daily_date = data.loc[data["wy"] == wy, dvar].idxmax()
+                        if pd.isna(daily_date):
+                            continue
+                        daily_flow = data.loc[daily_date, dvar].item()
+                        season_peaks.loc[wy,"date"] = daily_date
+                        season_peaks.loc[wy,"daily_flow"] = daily_flow
+                        if wy>=1990:
+                            try:
+                                inst_flow = nwis_import(site,"iv",f"{wy-1}-10-01",f"{wy}-09-30")
+                            except ValueError:
+                                continue
+                            if inst_flow.empty:
+                                continue
+                            season_inst = season_subset(inst_flow,seasons[s],dvar)
+                            inst_date = season_inst.flow.idxmax()
+                            if pd.isna(inst_date):
+                                continue
+                            season_peaks.loc[wy,"peak"] = season_inst.loc[inst_date,dvar]
+                            season_peaks.loc[wy, "date"] = inst_date
+                            season_peaks.loc[wy, "daily_flow"] = data.loc[pd.to_datetime(inst_date.date()), dvar].item()
+
+                    with figure_context(f"{outdir}/{site}_{s}_site_peak.jpg",dpi=300):
+                        simple_plot(season_peaks, f"{s} Peaks", marker="o")
+                        plt.legend()
+                    season_peaks.to_csv(f"{outdir}/{site}_{s}_site_peak.csv")
+                    print(f"Seasonal data saved to {outdir}/{site}_{s}_site_peak.csv")
+                    peaks[site][f"_{s}"] = season_peaks
+
+        # Save list of seasons
+        save_seasons(site, seasons)
+
+    return peaks
+
+### FLOW DURATION ANALYSIS (2a)
+@timed(stage="2a")
+def stage_2a(sites,analyze=["annual","monthly"],pcts=standard,wytrace=True,wy_division="WY",
+             quantiles=[0.05,0.5,0.95],boxplot=True,daily=None,dry_run=False):
+    """
+    This function conducts the flow duration analysis for each site (script 2a)
+    :param sites: list, site or dam names
+    :param analyze: list, "annual", "monthly", "seasonal" or "all"
+    :param pcts: list, fractional exceedance probabilities
+    :param wytrace: boolean, plot water year traces
+    :param wy_division: str, "WY" or "CY"
+    :param quantiles: list, quantiles to include on plot
+    :param boxplot: boolean, plot water year box and whisker plots
+    :param daily: dict, site_daily df for each site (output from stage_1a(), files used if None)
+    :param dry_run: boolean, only plan the outputs (see plan_2a())
+    :return: dict, dict of duration "table" and "raw" df for each season suffix ("" for annual) for each site (plan if
+    dry_run)
+    """
+    if dry_run:
+        return plan_2a(sites,analyze,pcts,wytrace,wy_division,quantiles,boxplot,daily)
+    flow = dict()
+    for site in sites:
+        set_site(site)
+        print(f"Analyzing flow duration for {site}...")
+        flow[site] = dict()
+
+        # Check for output and input directories
+        outdir = check_dir(site, "flow")
+        indir = f"{site}/data"
+        if not os.path.isdir(indir):
+            print("Input data directory not found.")
+
+        # Now, conduct duration analyses for selected combinations:
+        for a in analyze:
+            print(f"Analyzing {a}")
+            # Select combos
+            if a == "seasonal":
+                # Import seasons
+                season_df = get_seasons(site)
+                seasons = season_df.index.to_list()
+
+                # Load data once and identify each season (no per-season files)
+                site_data = get_daily(site,"",daily)
+                var = site_data.columns[0]
+                masks = season_masks(site_data,season_df,[season for season in seasons if season!="all"])
+                season_eps = calculate_ep_seasonal(site_data,masks)
+
+                # Loop through seasons
+                for season in masks.keys():
+                    print(season)
+                    s = f"_{season}"
+
+                    # Subset data
+                    data = site_data.loc[masks[season] & site_data[var].notna().values,:]
+                    decimal = str(data[var].head(1).item()).find('.')
+
+                    # Load combos
+                    combos = dict()
+                    combos[season] = annualcombos["Annual"]
+
+                    # Build duration tables and plot
+                    with figure_context(f"{outdir}/{site}{s}_{a}_plot.jpg",dpi=300):
+                        durtable, durraw = analyze_dur(data,combos,pcts,var,decimal,season_eps)
+                    durraw[0].to_csv(f"{outdir}/{site}{s}_annual_raw.csv", index=True, header=True)
+                    durtable.to_csv(f"{outdir}/{site}{s}_{a}.csv", index=True, header=True)
+                    flow[site][s] = {"table":durtable,"raw":durraw[0]}
+
+                    # If selected, plot water year traces
+                    if wytrace:
+                        print("Plotting WY traces")
+                        complete = get_completeness(site,s,data)
+                        with figure_context(f"{outdir}/{site}{s}_WY_plot.jpg",dpi=300):
+                            doy_data = plot_wytraces(data,wy_division,quantiles,ax=None,complete=complete)
+
+                        doy_data.to_csv(f"{outdir}/{site}{s}_doy.csv")
+
+                    # If selected, plot water year box and whisker plots
+                    if boxplot:
+                        print("Ploting WY box and whisker")
+                        with figure_context(f"{outdir}/{site}{s}_boxplot.jpg",dpi=300):
+                            plot_boxplot(data, wy_division)
+            else:
+                monthplot = False
+                if a == "annual":
+                    combos = annualcombos
+                if a == "monthly":
+                    combos = monthcombos
+                    monthplot = True
+                if a == "all":
+                    combos = allcombos
+                # Load data
+                data = get_daily(site,"",daily)
+                var = data.columns[0]
+                data = data.loc[data[var].dropna().index, :]
+                decimal = str(data[var].head(1).item()).find('.')
+
+                # Build duration tables and plot
+                with figure_context(f"{outdir}/{site}_{a}_plot.jpg",dpi=300):
+                    durtable, durraw = analyze_dur(data,combos,pcts,var,decimal)
+                durtable.to_csv(f"{outdir}/{site}_{a}.csv", index=True, header=True)
+                if a == "annual":
+                    durraw[0].to_csv(f"{outdir}/{site}_{a}_raw.csv", index=True, header=True)
+                    flow[site][""] = {"table":durtable,"raw":durraw[0]}
+                if monthplot == True:
+                    with figure_context(f"{outdir}/{site}_{a}_monthly_plot.jpg",dpi=300):
+                        plot_monthly_dur_ep(durtable, combos, var)
+
+            # If selected, plot water year traces
+            if wytrace and a == "annual" :
+                print("Plotting WY traces")
+                complete = get_completeness(site,"",data)
+                with figure_context(f"{outdir}/{site}_WY_plot.jpg",dpi=300):
+                    doy_data = plot_wytraces(data,wy_division,quantiles,ax=None,complete=complete)
+
+                doy_data.to_csv(f"{outdir}/{site}_doy.csv")
+
+            # If selected, plot water year box and whisker plots
+            if boxplot and a == "annual":
+                print("Ploting WY box and whisker")
+                with figure_context(f"{outdir}/{site}_boxplot.jpg",dpi=300):
+                    plot_boxplot(data, wy_division)
+
+    return flow
+
+### FLOW DURATION MULTIPLOT (2b)
+@timed(stage="2b")
+def stage_2b(sites,seasonal=False,labels=None,ylabel="Flow (ft$^3$/s)",
+             colors=["black","blue","red","green","orange","purple"],
+             linestyles=["solid","dashed","dotted","dashdot","solid","dashed"],durcurve=True,wytrace=True,
+             wy_division="WY",quantiles=[0.05,0.5,0.95],sharey=True,boxplot=True,outliers=False,summarize=True,
+             daily=None,flow=None,dry_run=False):
+    """
+    This function plots the duration curves, WY traces and box plots of multiple sites together (script 2b)
+    :param sites: list, site or dam names
+    :param seasonal: False or single item or list matched to sites ("all" for annual)
+    :param labels: list, label for each site (sites if None)
+    :param ylabel: str or list, single ylabel, or list assigned to each row
+    :param colors: list, color for each site
+    :param linestyles: list, linestyle for each site
+    :param durcurve: boolean, plot duration curves
+    :param wytrace: boolean, plot water year traces
+    :param wy_division: str, "WY" or "CY"
+    :param quantiles: list, quantiles to include on plot
+    :param sharey: boolean, use shared y axis
+    :param boxplot: boolean, plot box plots
+    :param outliers: boolean, show outliers in boxplot
+    :param summarize: boolean, create summary table
+    :param daily: dict, site_daily df for each site (output from stage_1a(), files used if None)
+    :param flow: dict, output from stage_2a() (files used if None)
+    :param dry_run: boolean, only plan the outputs (see plan_2b())
+    :return: None (plan if dry_run)
+    """
+    if dry_run:
+        return plan_2b(sites,seasonal,durcurve,wytrace,boxplot,summarize,daily)
+    if labels is None:
+        labels = sites
+
+    # Check for output directory
+    for site in sites:
+        sitedir = check_dir(site,"flow")
+    outdir = check_dir("flow_comparison")
+
+    # Check Seasonal List
+    if isinstance(seasonal,list)==False:
+        seasonal = [seasonal]*len(sites)
+
+    # Duration curves
+    if durcurve:
+        with figure_context(f"{outdir}/{sites[-1]}_all_annual_multiplot.jpg",dpi=300):
+            # Initiate plot
+            plot_dur_ep()
+
+            # Loop through sites
+            var = None
+            for n,site,season,label in zip(range(0,len(sites)),sites,seasonal,labels):
+                print(f"{n} Adding {site} to flow duration multiplot...")
+
+                if season=="all" or season==False:
+                    s = ""
+                else:
+                    s = f"_{season}"
+
+                if flow is not None and site in flow.keys() and s in flow[site].keys():
+                    data = flow[site][s]["raw"]
+                else:
+                    data = pd.read_csv(f"{site}/flow/{site}{s}_annual_raw.csv",parse_dates=True,index_col=0)
+                if var is None and ylabel is None:
+                    var = data.columns[1]
+                    var_label = get_varlabel(var)
+                elif ylabel is not None:
+                    var = data.columns[1]
+                    if isinstance(ylabel,list):
+                        var_label = ylabel[n]
+                    else:
+                        var_label = ylabel
+                else:
+                    if data.columns[1]!=var:
+                        var = data.columns[1]
+                        var_label = f"{var_label} | {get_varlabel(var)}"
+                plt.plot(data.exceeded*100,data[var],color=colors[n],linestyle=linestyles[n],label=label)
+            plt.ylabel(var_label)
+            plt.legend()
+
+        # Combined table
+        all_data = pd.DataFrame(index=standard)
+        for site in sites:
+            print(site)
+
+            if season=="all" or season==False:
+                s = "annual"
+                key = ""
+            else:
+                s = f"{season}_seasonal"
+                key = f"_{season}"
+
+            if flow is not None and site in flow.keys() and key in flow[site].keys():
+                data = flow[site][key]["table"]
+            else:
+                data = pd.read_csv(f"{site}/flow/{site}_{s}.csv",index_col=0)
+                # Match the exceedance probabilities of the table in memory ("Max", 0.001, ..., "Min")
+                data.index = [i if i in ["Max","Min"] else float(i) for i in data.index]
+            all_data.loc[:,site] = data.iloc[:,0]
+        all_data.to_csv(f"{outdir}/{site}_allplot_combine.csv")
+
+    # WY/Box plot multiple plot initialization
+    if wytrace or boxplot:
+        # determine number of subplots
+        nplot = len(sites)
+        ncol = int(min([max([1,np.floor(nplot/3)]),2]))
+        nrow = int(np.ceil(nplot/ncol))
+
+    # If selected, plot wy traces onto same panel
+    if wytrace:
+        with figure_context(f"{outdir}/{sites[-1]}_all_wy_plots.jpg",dpi=600):
+            fig,axs = plt.subplots(nrow,ncol,sharex=True,sharey=sharey,figsize=(6.25, 2*nrow),squeeze=False)
+
+            if sharey:
+                ylim = [10000,1]
+
+            for n,site in enumerate(sites):
+                ax = plt.subplot(nrow,ncol,n+1)
+
+                season = seasonal[n]
+                if season == "all" or season == False:
+                    s = ""
+                else:
+                    s = f"_{season}"
+
+                data = get_daily(site,s,daily)
+                var = data.columns[0]
+                data = data.loc[data[var].dropna().index, :]
+                complete = get_completeness(site,s,data)
+                ax = plot_wytraces(data,wy_division,quantiles,ax=ax,legend=False,complete=complete)
+                plt.annotate(f"({alphabet[n]}) {labels[n]} ({data.index.year.min()}-{data.index.year.max()})", xy=(0, 1.01),
+                             xycoords=ax.get_xaxis_transform())
+                if sharey:
+                    ylim[0] = min([ylim[0],10**np.floor(np.log10(max([1,data.iloc[:,0].min()])))])
+                    ylim[1] = max([ylim[1],10**np.ceil(np.log10(data.iloc[:,0].max()))])
+
+            if sharey:
+                for n,site in enumerate(sites):
+                    ax = plt.subplot(nrow, ncol, n + 1)
+                    ax.set_ylim(ylim)
+
+            # Add legend
+            if n+1==nrow*ncol:
+                plt.legend(loc="upper center",bbox_to_anchor=(0.5,-0.2),prop={'size': 8},ncol=2)
+            else:
+                box = ax.get_position()
+                ax.set_position([box.x0, box.y0, box.width, box.height])
+                plt.legend(bbox_to_anchor=(1+box.width,1-box.height), loc='center left', prop={'size': 10},ncol=2)
+                # Remove blanks
+                while n+1 < nrow*ncol:
+                    n += 1
+                    ax = plt.subplot(nrow,ncol,n+1)
+                    ax.set_visible(False)
+
+            # Add row labels:
+            if isinstance(ylabel,list):
+                for ax,lab in zip(axs[:, 0],ylabel):
+                    ax.set_ylabel(lab, rotation=90, size='large')
+            else:
+                fig.text(0, 0.5,ylabel, va='center', rotation='vertical')
+
+    # If selected, plot box plots onto same panel
+    if boxplot:
+        with figure_context(f"{outdir}/{sites[-1]}_all_boxplot.jpg",dpi=600):
+            fig,axs = plt.subplots(nrow,ncol,sharex=True,sharey=sharey,figsize=(6.25, 2*nrow),squeeze=False)
+
+            for n,site in enumerate(sites):
+                ax = plt.subplot(nrow,ncol,n+1)
+
+                season = seasonal[n]
+                if season == "all" or season == False:
+                    s = ""
+                else:
+                    s = f"_{season}"
+
+                data = get_daily(site,s,daily)
+                var = data.columns[0]
+                data = data.loc[data[var].dropna().index, :]
+                plot_boxplot(data,wy_division,outliers,ax=ax,legend=False)
+                plt.annotate(f"({alphabet[n]}) {labels[n]} ({data.index.year.min()}-{data.index.year.max()})", xy=(0, 1.01),
+                             xycoords=ax.get_xaxis_transform())
+
+            # Remove blanks
+            while n+1 < nrow*ncol:
+                n += 1
+                ax = plt.subplot(nrow,ncol,n+1)
+                ax.set_visible(False)
+
+            # Add row labels:
+            if isinstance(ylabel,list):
+                for ax,lab in zip(axs[:, 0],ylabel):
+                    ax.set_ylabel(lab, rotation=90, size='large')
+            else:
+                fig.text(0, 0.5,ylabel, va='center', rotation='vertical')
+
+    if summarize:
+        summary_df = pd.DataFrame()
+        for n,site in enumerate(sites):
+            season = seasonal[n]
+            if season == "all" or season == False:
+                s = ""
+            else:
+                s = f"_{season}"
+
+            data = get_daily(site,s,daily)
+            var = data.columns[0]
+            data = data.loc[data[var].dropna().index, :]
+            data_summary = summarize_daily(data)
+            summary_df[site] = data_summary.loc["all",:]
+
+        summary_df.to_csv(f"{outdir}/{site}_all_summaries.csv")
+
+### CRITICAL DURATION ANALYSIS (3)
+@timed(stage="3")
+def stage_3(site,season=False,event_thresh=0,min_dur=None,min_peak=None,plot_max=0,mean_type="arithmetic",
+            analyze_standard=True,standard_plots=False,buffer=5,tangent=False,
+            analyze_volwindow=False,volwindow_plots=True,res_file=None,
+            analyze_cvhs=False,cvhs_plots=True,hydro_dur=30,by=1,rating_file=None,start=None,
+            cvhs_sweep=False,sweep_starts=[],sweep_rating_files=[],daily=None,memo=None,dry_run=False):
+    """
+    Critical duration analysis (script 3) for a single site and threshold
+    :param site: str, site name (cannot handle seasonal)
+    :param season: False or season name
+    :param event_thresh: float, threshold flow for defining flood events
+    :param min_dur: int, minimum duration acceptable for analysis (or None)
+    :param min_peak: float, minimum peak acceptable for analysis (or None)
+    :param plot_max: int, maximum duration to show in peak vs duration plot (will use max if 0)
+    :param mean_type: str, "arithmetic", "geometric", "peak-weight"
+    :param analyze_standard: boolean, analyze using standard method
+    :param standard_plots: boolean, plot each selected event
+    :param buffer: int, number of days before and after duration to plot
+    :param tangent: boolean, including cumulative flows and tangent line
+    :param analyze_volwindow: boolean, analyze using volume-window method
+    :param volwindow_plots: boolean, plot each volume-window event
+    :param res_file: str, .csv filename or None. If file, QD (discharge) and AF (storage) are expected.
+    :param analyze_cvhs: boolean, analyze using CVHS method
+    :param cvhs_plots: boolean, plot each CVHS hydrograph
+    :param hydro_dur: int, max duration to analyze
+    :param by: int, step between durations
+    :param rating_file: str, .csv file. If file, FB (elevation), QD (discharge), AF (storage) expected
+    :param start: float, start elevation (must be in rating_file)
+    :param cvhs_sweep: boolean, sweep CVHS start elevations and ratings
+    :param sweep_starts: list, start elevations (must be in each rating file)
+    :param sweep_rating_files: list, .csv files (same format as rating_file)
+    :param daily: dict, site_daily df for each site (output from stage_1a(), files used if None)
+    :param memo: dict, daily data, events and proxy volume tables from previous calls (updated), or None
+    :param dry_run: boolean, only identify the events and plan the outputs (see plan_3())
+    :return: dict, events, selected events, and cvhs and sweep results (if analyzed) (plan if dry_run)
+    """
+    if dry_run:
+        return plan_3(site,season,event_thresh,min_dur,min_peak,analyze_standard,standard_plots,analyze_volwindow,
+                      volwindow_plots,res_file,analyze_cvhs,cvhs_plots,hydro_dur,by,cvhs_sweep,sweep_starts,
+                      sweep_rating_files,daily,memo)
+    set_site(site)
+    if memo is None:
+        memo = dict()
+    for key in ["data","evs","vol_table"]:
+        memo.setdefault(key,dict())
+
+    # Check for output directory
+    outdir = check_dir(site,"critical")
+    threshdir = check_dir(outdir,"thresh")
+
+    # Load data
+    if season == "all" or season == False:
+        s = ""
+    else:
+        s = f"_{season}"
+
+    if (site,s) not in memo["data"].keys():
+        memo["data"][(site,s)] = get_daily(site,s,daily)
+    data = memo["data"][(site,s)]
+    decimal = str(data[data.columns[0]].head(1).item()).find('.')
+
+    # Determine periods in excess of event threshold
+    print(f'Analyzing critical duration for events above {event_thresh} ft^3/s.')
+    if (site,s,event_thresh) not in memo["evs"].keys():
+        memo["evs"][(site,s,event_thresh)] = identify_thresh_events(data,event_thresh)
+    evs = memo["evs"][(site,s,event_thresh)]
+
+    # Check thresholds
+    if min_peak is None:
+        min_peak = 0
+    if min_dur is None:
+        min_dur = 0
+    crit = {"evs":evs}
+    name = f"{site}_{str(event_thresh)}_p{str(min_peak)}_d{str(min_dur)}"
+
+    if analyze_standard:
+        print("Using standard method...")
+        with figure_context(f"{threshdir}/{name}_peakvsdur.jpg",dpi=300):
+            # Intialize figure
+            init_duration_plot(evs,plot_max)
+
+            # Plot all data
+            if (min_dur==0) and (min_peak==0):
+                plot_and_calc_durations(evs,0,0,mean_type)
+            else:
+                plot_and_calc_durations(evs, 0, 0)
+            # Plot screened data
+            if (min_dur>0) or (min_peak>0):
+                plot_and_calc_durations(evs,min_dur,min_peak,mean_type,"Screened Events")
+
+            # Add title and legend, and save
+            plt.title(f"Flow vs Duration")
+            ax = plt.gca()
+            box = ax.get_position()
+            ax.set_position([box.x0, box.y0, box.width * 0.9, box.height])
+            plt.legend(bbox_to_anchor=(1, 0.5), loc='center left', prop={'size': 10})
+        evs.to_csv(f'{threshdir}/{name}_peakvsdur.csv')
+
+        # Selected events
+        evs_sel = evs.copy(deep=True)
+        evs_sel = evs_sel.loc[evs["peak"] > min_peak]
+        etot = len(evs_sel.index)
+        evs_sel.to_csv(f'{threshdir}/{name}_peakvsdur_selected.csv')
+        crit["selected"] = evs_sel
+
+    # Create standard event plots
+    if standard_plots:
+        print("Plotting events")
+        for n,e in zip(range(1,len(evs_sel)+1),evs_sel.index):
+            print(f'Plotting event {n} of {etot}')
+            edate = evs_sel.loc[e,"start_idx"].strftime("%Y-%m-%d")
+            spec = thresh_duration_spec(data,evs_sel,e,event_thresh,buffer,tangent)
+            render(plot_thresh_duration,f"{threshdir}/{site}_thresh_{edate}.jpg",dpi=300,bbox_inches='tight',
+                   family=f"{threshdir}/{site}_thresh_events",**spec)
+        close_family(f"{threshdir}/{site}_thresh_events")
+
+    # Analyse by volume-window method
+    if analyze_volwindow:
+        print("Beginning Volume Window Duration Analysis")
+        vwdir = check_dir(outdir,"vw")
+
+        if res_file is None:
+            print("No reservoir information file (res_file) provided. Volume-Window Plots not created.")
+        else:
+            # Import reservoir data
+            resdat = csv_daily_import(res_file,"WY",False)
+            # Create volume-window plots
+            print("Analyzing events with Volume-Window Method")
+            for n,e in zip(range(1,len(evs_sel)+1),evs_sel.index):
+                if evs_sel.loc[e,"start_idx"]<resdat.index.min():
+                    print(f'Skipping event {n} of {etot}')
+                    evs_sel = evs_sel.drop(e)
+                    continue
+                else:
+                    print(f'Analyzing event {n} of {etot}')
+                    edate = evs_sel.loc[e, "start_idx"].strftime("%Y-%m-%d")
+                    with figure_context(f"{vwdir}/{site}_volwindow_{edate}.jpg" if volwindow_plots else None,dpi=300,
+                                        family=f"{vwdir}/{site}_volwindow_events"):
+                        crit_dur = analyze_volwindow_duration(data,evs_sel,e,resdat,buffer,volwindow_plots)
+                    evs_sel.loc[e,"duration"] = crit_dur
+            close_family(f"{vwdir}/{site}_volwindow_events")
+
+            # Save data
+            evs_sel.to_csv(f'{vwdir}/{name}_peakvsdur_volwindow.csv')
+            crit["volwindow"] = evs_sel
+
+            # Summarize duration information
+            with figure_context(f"{vwdir}/{name}_peakvsdur_volwindow.jpg",dpi=300):
+                # Intialize figure
+                init_duration_plot(evs, plot_max)
+                # Replot all data
+                plot_and_calc_durations(evs, 0, 0)
+                # Plot screened data
+                if (min_dur > 0) or (min_peak > 0):
+                    plot_and_calc_durations(evs,min_dur,min_peak,mean_type,"Screened Events")
+
+                # Plot volume-window durations
+                plot_and_calc_durations(evs_sel,0,0,mean_type,"Volume-Window Events","black","black")
+
+                # Add title and legend and save
+                plt.title(f"Flow vs Duration")
+                ax = plt.gca()
+                box = ax.get_position()
+                ax.set_position([box.x0, box.y0, box.width * 0.9, box.height])
+                plt.legend(bbox_to_anchor=(1, 0.5), loc='center left', prop={'size': 10})
+
+    # Proxy volume table (shared by CVHS analyses with the same data and durations)
+    if analyze_cvhs or cvhs_sweep:
+        if (site,s,hydro_dur,by) not in memo["vol_table"].keys():
+            memo["vol_table"][(site,s,hydro_dur,by)] = cvhs_vol_table(data,range(1,hydro_dur+1,by),decimal)
+        vol_table = memo["vol_table"][(site,s,hydro_dur,by)]
+
+    # Analyze CVHS Critical Duration
+    if analyze_cvhs:
+        print("Beginning CVHS Duration Analysis")
+        cvhsdir = check_dir(outdir,"cvhs")
+
+        # Analyze
+        cvhs = analyze_cvhs_duration(data,evs,min_peak,hydro_dur,by,rating_file,start,cvhs_plots,decimal,cvhsdir,vol_table)
+        cvhs.to_csv(f"{cvhsdir}/{name}_cvhs.csv")
+        crit["cvhs"] = cvhs
+
+        # Plot results
+        with figure_context(f"{cvhsdir}/{name}_cvhs.jpg",dpi=None,bbox_inches=None):
+            fig, ax = plt.subplots(figsize=(8, 3.5))
+            plt.title(f"CVHS Duration")
+            plt.xlabel("Duration")
+            plt.ylabel("Max Stage")
+            for h in cvhs.iloc[:,2:].columns:
+                if h=="mean":
+                    plt.plot(cvhs[h],label=h,color="black",linestyle="dashed")
+                    plt.plot([cvhs[h].idxmax()]*2,[cvhs[h].min(),cvhs[h].max()],color="black",linestyle="dashed",label=f"Mean Crit. Duration ({cvhs[h].idxmax()}-days)")
+                else:
+                    plt.plot(cvhs[h],label=h)
+
+            plt.legend()
+
+    # Sweep CVHS start elevations and ratings
+    if cvhs_sweep:
+        print("Beginning CVHS Sensitivity Sweep")
+        sweepdir = check_dir(outdir,"cvhs_sweep")
+
+        # Analyze
+        cube = analyze_cvhs_sweep(data,evs,min_peak,hydro_dur,by,sweep_rating_files,sweep_starts,decimal,sweepdir,vol_table)
+        if cube is not None:
+            cube.to_csv(f"{sweepdir}/{name}_cvhs_sweep.csv")
+            sweep_summary = summarize_cvhs_sweep(cube)
+            sweep_summary.to_csv(f"{sweepdir}/{name}_cvhs_sweep_summary.csv")
+            crit["sweep"] = sweep_summary
+
+            # Plot results
+            with figure_context(f"{sweepdir}/{name}_cvhs_sweep.jpg",dpi=None,bbox_inches=None):
+                fig, ax = plt.subplots(figsize=(8, 3.5))
+                plt.xlabel("Duration")
+                plt.ylabel("Max Stage (mean)")
+                for (rating,st),group in cube.groupby(level=["rating","start"],sort=False):
+                    mean = group["mean"].droplevel(["rating","start"])
+                    if len(sweep_rating_files)>1:
+                        lab = f"{rating}: {st}"
+                    else:
+                        lab = f"{st}"
+                    plt.plot(mean,label=lab)
+                plt.legend(title="Start",prop={'size': 8})
+
+    wait_renders()
+    return crit
+
+### VOLUME DURATION ANALYSIS (4)
+@timed(stage="4")
+def stage_4(sites,seasonal=False,durations=[1,3,7,15,30],wy_division="WY",plot_vol=True,plot_wy=True,concat=True,
+            surface=False,surface_durations=range(1,366),lowflow=False,lowflow_durations=[1,7,30],lowflow_start=4,
+            lowflow_return=[2,10],save_series=None,daily=None,peaks=None,memo=None,dry_run=False):
+    """
+    This function identifies the ann. max. average values for each duration for each site (script 4)
+    :param sites: list, site or dam names
+    :param seasonal: boolean, analyze seasons
+    :param durations: list (same durations for all seasons) or dict (specific to each season, "all" for annual)
+    :param wy_division: str, "WY" or "CY"
+    :param plot_vol: boolean, plot all WY volumes on a single plot
+    :param plot_wy: boolean, plot each WY with all durations
+    :param concat: boolean, combine all tables
+    :param surface: boolean, find ann. max. average for every duration in surface_durations
+    :param surface_durations: list, durations (days) included in surface
+    :param lowflow: boolean, find ann. min. average for each climatic year and lowflow_durations
+    :param lowflow_durations: list, durations (days) for low flow statistics
+    :param lowflow_start: int, first month of climatic year
+    :param lowflow_return: list, return periods for low flow statistics
+    :param save_series: None, "compressed" or "csv" (see save_voldur_series())
+    :param daily: dict, site_daily df for each site (output from stage_1a(), files used if None)
+    :param peaks: dict, output from stage_1b() (files used if None)
+    :param memo: dict, cumulative sums and rolling means from previous calls (updated, see memo_cum()), or None
+    :param dry_run: boolean, only plan the outputs (see plan_4())
+    :return: dict, dict of dict of events df for each duration (and "peak") for each season suffix ("" for annual) for
+    each site (plan if dry_run)
+    """
+    if dry_run:
+        return plan_4(sites,seasonal,durations,wy_division,plot_vol,plot_wy,concat,surface,surface_durations,lowflow,
+                      lowflow_durations,lowflow_start,lowflow_return,save_series,daily,peaks)
+    # Check site directories
+    for site in sites:
+        sitedir = check_dir(site, "flow")
+
+    # Store results in memory for concatenation tables
+    voldur = dict()
+    lowflow_results = dict()
+
+    # Loop through sites
+    for site in sites:
+        set_site(site)
+        print(f"Analyzing volume duration for {site}...")
+        voldur[site] = dict()
+
+        # Check for output and input directories
+        outdir = check_dir(site, "volume")
+        indir = f"{site}/data"
+        if not os.path.isdir(indir):
+            print("Input data directory not found.")
+
+        # Import seasons
+        season_df = get_seasons(site)
+        seasons = season_df.index.to_list()
+
+        # Check seasonality
+        if seasonal:
+            # If list, duplicate for each season
+            if isinstance(durations, list):
+                print("List of durations provided; repeating for each season...")
+                dur_dict = dict()
+                for season in seasons:
+                    dur_dict[season] = list(durations)
+                    season_df.loc[season, "durations"] = str(durations)
+                durations_season = dur_dict
+            # If dict, check again season list, only analyze seasons with durations
+            else:
+                print("Dict of durations provided; parsing by season...")
+                dur_dict = dict()
+                season_analyze = list()
+                for i,season in enumerate(seasons):
+                    print(season)
+                    if season in durations.keys():
+                        dur_dict[season] = list(durations[season])
+                        season_df.loc[season, "durations"] = str(durations[season])
+                        season_analyze.append(season)
+                    else:
+                        print(f"No durations provided for {season}. Durations must be provided for 'all' and each season...")
+                        quit("Script run ended...")
+                durations_season = dur_dict
+                seasons = season_analyze
+        else:
+            seasons = [None]
+            if isinstance(durations, dict):
+                if "all" in durations.keys():
+                    durations_season = list(durations["all"])
+                else:
+                    print(f"No durations provided for 'all'. Durations must be provided for 'all' and each season...")
+                    quit("Script run ended...")
+            else:
+                durations_season = list(durations)
+            season_df.loc["all", "durations"] = str(durations_season)
+
+        # Save seasons
+        save_seasons(site,season_df)
+
+        # Load data once and identify each season (no per-season files)
+        site_daily = get_daily(site,"",daily)
+        var = site_daily.columns[0]
+        decimal = str(site_daily[var].head(1).item()).find('.')
+        masks = season_masks(site_daily,season_df,seasons)
+        memo_key = (site,wy_division,tuple([(season,masks[season].tobytes()) for season in seasons]))
+
+        # Analyze low flows (full record, climatic year)
+        if lowflow:
+            print(f"Analyzing low flow durations {lowflow_durations}")
+            site_lowflow = analyze_lowflow_multi(site_daily,lowflow_durations,decimal,lowflow_start,memo=memo,
+                                                 key=(site,wy_division))
+            for dur in lowflow_durations:
+                site_lowflow[dur].to_csv(f"{outdir}/{site}_lowflow_{dur}.csv")
+            site_lowsurf = lowflow_surface(site_daily,lowflow_durations,lowflow_start,memo=memo,key=(site,wy_division))
+            site_lowstats = lowflow_stats(site_lowsurf,lowflow_return).round(decimal)
+            site_lowstats.to_csv(f"{outdir}/{site}_lowflow_stats.csv")
+            lowflow_results[site] = site_lowstats
+
+        # Analyze all seasons and durations at once ("multi" engine, see src/engine_functions.py)
+        engine = get_engine("volumes")
+        if engine is not None:
+            if isinstance(durations_season,dict):
+                all_durs = [dur for season in seasons for dur in durations_season[season]]
+            else:
+                all_durs = list(durations_season)
+            all_durs = ["WY"]+sorted(set([dur for dur in all_durs if dur not in ["WY","peak"]]))
+            print(f'Analyzing durations {all_durs}')
+            seasonal_voldur = engine(site_daily,all_durs,decimal,masks,memo,memo_key)
+
+        for i,season in enumerate(seasons):
+            if season is None:
+                s=""
+                durations_sel = durations_season.copy()
+                if "WY" not in durations_sel:
+                    durations_sel.insert(0, "WY")
+            else:
+                if season=="all":
+                    s = ""
+                    durations_sel = durations_season[season]
+                    if "WY" not in durations_sel:
+                        durations_sel.insert(0, "WY")
+                else:
+                    s=f"_{season}"
+                    if "WY" in durations_sel:
+                        durations_sel.remove("WY")
+                    durations_sel = durations_season[season]
+            print(season)
+            voldur[site][s] = dict()
+
+            # Subset data by season
+            if s=="":
+                data = site_daily
+            else:
+                data = site_daily.copy()
+                data.loc[~masks[season],var] = np.nan
+            complete = get_completeness(site,s,data)
+
+            # Create list to store all duration data
+            site_dur = list()
+            site_sum = pd.DataFrame()
+
+            if concat:
+                site_tables = dict()
+
+            # Import peaks
+            if "peak" in durations_sel:
+                if peaks is not None and site in peaks.keys() and s in peaks[site].keys():
+                    has_peaks = True
+                    site_peaks = peaks[site][s].copy()
+                elif os.path.isfile(f"{indir}/{site}{s}_site_peak.csv"):
+                    has_peaks = True
+                    print("Importing peak data")
+                    site_peaks = pd.read_csv(f"{indir}/{site}{s}_site_peak.csv", index_col=0)
+                else:
+                    has_peaks = False
+                if has_peaks:
+                    site_peaks["date"] = pd.to_datetime(site_peaks["date"])
+                    voldur[site][s]["peak"] = site_peaks
+                    if concat:
+                        site_tables["peaks"] = site_peaks
+                durations_sel.remove("peak")
+            else:
+                has_peaks = False
+
+            if engine is not None:
+                site_voldur = seasonal_voldur[season]
+
+            # Loop through durations and analyze
+            for dur in durations_sel:
+                # handle volumes
+                if engine is not None:
+                    df_dur = site_voldur[dur]
+                    if dur=="WY" or save_series!="csv":
+                        dur_data = None
+                    else:
+                        dur_data = voldur_data(data,dur)
+                else:
+                    print(f'Analyzing duration for {dur}')
+                    df_dur,dur_data = analyze_voldur(data,dur,decimal,complete)
+                dur_var = df_dur.columns[1]
+                site_dur.append(df_dur)
+                voldur[site][s][dur] = df_dur
+                df_dur.to_csv(f"{outdir}/{site}{s}_{dur}.csv")
+                if dur_data is not None and save_series=="csv":
+                    dur_data.to_csv(f"{outdir}/{site}{s}_{dur}_data.csv")
+
+                if dur != "WY":
+                    site_sum.loc[dur,"N"] = len(df_dur)
+                    site_sum.loc[dur, "mean"] = df_dur[dur_var].mean()
+                    site_sum.loc[dur, "median"] = df_dur[dur_var].median()
+                    site_sum.loc[dur, "sd"] = df_dur[dur_var].std()
+                    site_sum.loc[dur, "skew"] = df_dur[dur_var].skew()
+                    site_sum.loc[dur, "log_mean"] = np.log10(df_dur[dur_var]).mean()
+                    site_sum.loc[dur, "log_median"] = np.log10(df_dur[dur_var]).median()
+                    site_sum.loc[dur, "log_sd"] = np.log10(df_dur[dur_var]).std()
+                    site_sum.loc[dur, "log_skew"] = np.log10(df_dur[dur_var]).skew()
+
+                if concat:
+                    site_tables[dur] = df_dur
+            site_sum.to_csv(f"{outdir}/{site}{s}_stats_summary.csv")
+
+            if save_series=="compressed":
+                print("Saving rolling series")
+                save_voldur_series(voldur_series(data,durations_sel),f"{outdir}/{site}{s}_series")
+
+            if surface:
+                print("Calculating duration surface")
+                site_surface = voldur_surface(data,surface_durations,decimal)
+                site_surface.to_csv(f"{outdir}/{site}{s}_surface.csv")
+                surface_pp(site_surface).to_csv(f"{outdir}/{site}{s}_surface_pp.csv")
+
+            if concat:
+                # Combine all durations in a single concat, export
+                site_df = concat_tables(site_tables,fill_index=False)
+                site_df.to_csv(f"{outdir}/{site}{s}_all_durations.csv")
+
+            if plot_vol:
+                print("Plotting WYs")
+
+                if "WY" in durations_sel:
+                    with figure_context(f"{outdir}/{site}{s}_wy_cumulative_plot.jpg",dpi=300):
+                        cum_data = data.copy()
+                        cum_data[var] = cfs2af(cum_data[var].cumsum())
+                        init_voldurplot(cum_data)
+                        if wy_division=="WY":
+                            wy_start = cum_data.loc[(cum_data.index.month==10) & (cum_data.index.day==1)].index
+                        else:
+                            wy_start = cum_data.loc[(cum_data.index.month == 1) & (cum_data.index.day == 1)].index
+                        plt.plot(cum_data.loc[wy_start,var],label="Water Year Data")
+                        plt.legend()
+
+            if plot_wy:
+                for wy in df_dur.index:
+                    print(f"  {wy}")
+
+                    # plot flows and durations
+                    if (wy not in complete.index) or (complete.loc[wy,"count"]==0):
+                        print("  Missing data. Skipping...")
+                        continue
+                    else:
+                        # plot peaks
+                        peak = None
+                        if has_peaks:
+                            if (wy not in site_peaks.index) or (pd.isnull(site_peaks.loc[wy, "date"])):
+                                continue
+                            peak = [site_peaks.loc[wy,"date"],site_peaks.loc[wy,f"peak"]]
+
+                        # Plot flows, durations and peak (in a render process if set)
+                        spec = voldur_wy_spec(data,wy,f"{s.replace('_','')}",site_dur,durations_sel,peak)
+                        render(plot_voldur_wy,f"{outdir}/{site}{s}_{wy}.jpg",dpi=300,bbox_inches="tight",
+                               family=f"{outdir}/{site}{s}_wy_plots",**spec)
+                close_family(f"{outdir}/{site}{s}_wy_plots")
+    wait_renders()
+
+    if concat and len(sites)>1:
+        stage_4_concat(sites,voldur,lowflow_results if lowflow else None)
+
+    return voldur
+
+@timed(stage="4_concat")
+def stage_4_concat(sites,voldur=None,lowflow=None):
+    """
+    This function combines the volume duration tables of all sites (cross-site part of script 4)
+    :param sites: list, site or dam names
+    :param voldur: dict, output from stage_4() (files from previous runs used for sites not included)
+    :param lowflow: dict, low flow statistics df for each site (files used for sites not included), False to skip
+    :return: None
+    """
+    if voldur is None:
+        voldur = dict()
+    print("Preparing concatination tables")
+    # Check for output directory
+    outdir = check_dir("volume_concat")
+
+    # Low flow statistics, one row per site
+    if lowflow is not None and lowflow is not False:
+        lowflow_results = dict()
+        for site in sites:
+            if site in lowflow.keys():
+                lowflow_results[site] = lowflow[site]
+            elif os.path.isfile(f"{site}/volume/{site}_lowflow_stats.csv"):
+                lowflow_results[site] = pd.read_csv(f"{site}/volume/{site}_lowflow_stats.csv",index_col=0)
+        if len(lowflow_results)==0:
+            print("Nothing")
+        else:
+            lowflow_all = pd.concat(lowflow_results,names=["site","dur"]).unstack("dur")
+            lowflow_all.columns = [f"{dur}{col}" for col,dur in lowflow_all.columns]
+            lowflow_all.to_csv(f"{outdir}/{site}_all_lowflow_stats.csv")
+
+    # Find all seasons and durations
+    keys = list()
+    for site in sites:
+        if site not in voldur.keys():
+            continue
+        for s in voldur[site].keys():
+            for dur in voldur[site][s].keys():
+                if (s,dur) not in keys:
+                    keys.append((s,dur))
+
+    # Loop through seasons and all durations, concat all sites (from memory, disk if needed)
+    for (s,dur) in keys:
+        print(dur)
+        dur_tables = dict()
+        for site in sites:
+            if site in voldur.keys() and s in voldur[site].keys() and dur in voldur[site][s].keys():
+                dur_tables[site] = voldur[site][s][dur]
+            elif dur=="peak" and os.path.isfile(f"{site}/data/{site}{s}_site_peak.csv"):
+                dur_tables[site] = pd.read_csv(f"{site}/data/{site}{s}_site_peak.csv",index_col=0,parse_dates=["date"])
+            elif dur!="peak" and os.path.isfile(f"{site}/volume/{site}{s}_{dur}.csv"):
+                dur_tables[site] = pd.read_csv(f"{site}/volume/{site}{s}_{dur}.csv",index_col=0)
+
+        dur_final = concat_tables(dur_tables)
+        if dur_final.empty:
+            print("Nothing")
+        elif dur=="peak":
+            dur_final.to_csv(f"{outdir}/{site}{s}_all_peaks.csv")
+        else:
+            dur_final.to_csv(f"{outdir}/{site}{s}_all_{dur}.csv")
+
+### VOLUME DURATION PLOTS (5)
+@timed(stage="5")
+def stage_5(sites,seasonal=False,wy_division="WY",idaplot=True,ppplot=True,pdfplot=True,monthplot=True,
+            eventdate="start",voldur=None,peaks=None,dry_run=False):
+    """
+    This function prepares the volume duration plots for each site (script 5)
+    :param sites: list, site or dam names
+    :param seasonal: boolean, plot seasons
+    :param wy_division: str, "WY" or "CY"
+    :param idaplot: boolean, create initial data analysis plots
+    :param ppplot: boolean, plot all durations with plotting positions
+    :param pdfplot: boolean, plot probability density function of data
+    :param monthplot: boolean, plot monthly distribution of annual peaks
+    :param eventdate: str, when to plot seasonality: "start", "mid", "end", or "max"
+    :param voldur: dict, output from stage_4() (files used if None)
+    :param peaks: dict, output from stage_1b() (files used if None)
+    :param dry_run: boolean, only plan the outputs (see plan_5())
+    :return: None (plan if dry_run)
+    """
+    if dry_run:
+        return plan_5(sites,seasonal,wy_division,idaplot,ppplot,pdfplot,monthplot,eventdate,voldur,peaks)
+    # Loop through sites
+    for site in sites:
+        set_site(site)
+        print(f"Preparing plots for {site}...")
+        outdir = check_dir(f"{site}/plot")
+
+        # Check for output and input directories
+        indir = f"{site}/data"
+        if not os.path.isdir(indir):
+            print("Input data directory not found.")
+        voldir = f"{site}/volume"
+        if not os.path.isdir(voldir):
+            print("Input volume directory not found.")
+
+        # Import seasons
+        season_df = get_seasons(site)
+        seasons = season_df.index.to_list()
+
+        # Get durations for seasons
+        if seasonal:
+            dur_dict = dict()
+            for season in seasons:
+                dur_dict[season] = get_list(season_df.loc[season,"durations"])
+            durations = dur_dict
+        else:
+            seasons = [None]
+            dur_dict = dict()
+            durations = get_list(season_df.loc["all","durations"])
+
+        for season in seasons:
+            if season is None:
+                durations_season = durations
+                s=""
+                durations_season.append("WY")
+            else:
+                durations_season = durations[season]
+                if season=="all":
+                    s=""
+                    durations_season.append("WY")
+                else:
+                    s=f"_{season}"
+
+            if durations_season is None:
+                continue
+
+            print(season)
+
+            # Begin analysis
+            site_dur = list()
+            remove_dur = list()
+            site_peaks = None
+            if peaks is not None and site in peaks.keys() and s in peaks[site].keys():
+                site_peaks = peaks[site][s]
+            site_voldur = dict()
+            if voldur is not None and site in voldur.keys() and s in voldur[site].keys():
+                site_voldur = voldur[site][s]
+
+            if "peak" in durations_season:
+                if site_peaks is not None or os.path.isfile(f"{indir}/{site}{s}_site_peak.csv"):
+                    has_peaks = True
+                    durations_sel = durations_season
+                    durations_sel.remove("peak")
+                    durations_sel.append("peak")
+                else:
+                    has_peaks = False
+                    durations_sel = durations_season
+                    durations_sel.remove("peak")
+            else:
+                has_peaks = False
+                durations_sel = durations_season
+
+            if "WY" in durations_season and s!="":
+                print("Removing WY from list of durations.")
+                durations_sel = durations_season
+                durations_sel.remove("WY")
+
+            for dur in durations_sel:
+                if dur is None:
+                    continue
+                print(dur)
+                if dur == "peak":
+                    if site_peaks is not None:
+                        df_dur = site_peaks.copy()
+                    else:
+                        try:
+                            df_dur = pd.read_csv(f"{indir}/{site}{s}_site_peak.csv",index_col=0)
+                        except FileNotFoundError:
+                            print(f"{indir}/{site}{s}_site_peak.csv not found...")
+                            continue
+                elif dur in site_voldur.keys():
+                    df_dur = site_voldur[dur].copy()
+                else:
+                    try:
+                        df_dur = pd.read_csv(f"{voldir}/{site}{s}_{dur}.csv",index_col=0)
+                    except FileNotFoundError:
+                        print(f"{voldir}/{site}{s}_{dur}.csv not found...")
+                        continue
+
+                if df_dur.empty:
+                    remove_dur.append(dur)
+                    continue
+                else:
+                    # drop empty rows
+                    df_dur.dropna(how="all", inplace=True)
+
+                    if eventdate not in list(df_dur.columns):
+                        date_used = "date"
+                        if dur == "WY":
+                            df_dur[date_used] = df_dur.index
+
+                        df_dur[eventdate] = pd.to_datetime(df_dur[date_used])
+
+                #df_dur = df_dur.dropna()
+                site_dur.append(df_dur)
+                var = df_dur.columns[1]
+
+            for r in remove_dur:
+                durations_sel.remove(r)
+
+            # Plot data
+            if idaplot:
+                print("Conducting initial data analysis...")
+                # Check for output directory
+                for evs,dur in zip(site_dur,durations_sel):
+                    var = evs.columns[1]
+                    print(f'{dur}...')
+
+                    # Check for trends and shifts
+                    with figure_context(f"{outdir}/{site}{s}_{dur}_trends&shifts_plot.jpg",dpi=600):
+                        plot_trendsshifts(evs,dur,var)
+
+                    # Check for trends and shifts
+                    with figure_context(f"{outdir}/{site}{s}_{dur}_start_trends&shifts_plot.jpg",dpi=600):
+                        plot_date_trend(evs,dur,wy_division)
+
+                    # Check for mann whitney
+                    with figure_context(f"{outdir}/{site}{s}_{dur}_mannwhitney_plot.jpg",dpi=600):
+                        mannwhitney(evs,dur,var)
+
+                    # TODO count change points AND add trends and shifts around confirmed change points...
+
+                    # Check for autocorrelation
+                    if len(evs.index) < 20:
+                        continue
+                    with figure_context(f"{outdir}/{site}{s}_{dur}_acf_plot.jpg",dpi=600):
+                        acf(evs,var)
+
+                    # Check for normality
+                    with figure_context(f"{outdir}/{site}{s}_{dur}_normality_plot.jpg",dpi=600):
+                        plot_normality(evs,dur,var)
+
+            if ppplot:
+                print("Plotting with plotting positions")
+                with figure_context(f"{outdir}/{site}{s}_pp_plot.jpg",dpi=600):
+                    plot_voldurpp(site,site_dur,durations_sel,alpha=0)
+
+            if pdfplot:
+                print("Plotting with probability density function")
+                with figure_context(f"{outdir}/{site}{s}_pdf_plot.jpg",dpi=600):
+                    plot_voldurpdf(site_dur,durations_sel)
+
+            if monthplot:
+                print("Plotting with monthly distributions")
+                for stat in ["count","mean","max"]:
+                    with figure_context(f"{outdir}/{site}{s}_{eventdate}_month_{stat}_plot.jpg",dpi=600):
+                        plot_voldurmonth(site_dur,durations_sel,stat,eventdate,wy_division)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+### SYNTHETIC DATA FUNCTIONS ###
+@author: tclarkin (USBR 2022)
+
+This script contains the functions used to create deterministic synthetic streamflow records (snowmelt season, storm
+events and lognormal noise) for benchmarks, calibration of run cost estimates and tests of the analyses without
+downloading data. The same settings and seed always give the same record.
+
+"""
+import numpy as np
+import pandas as pd
+
+def synthetic_flow(years=30,missing=0.0,seasonality=1.0,freq="D",seed=0,start="1950-10-01",base=200,melt=800,
+                   storms=3):
+    """
+    Function to create a synthetic streamflow record
+    :param years: int, record length (years)
+    :param missing: float, fraction of missing values (random days, or random periods for sub-daily records)
+    :param seasonality: float, scale of the snowmelt season (0 for none, 1 for a peak of base+melt in late May)
+    :param freq: str, pandas frequency of the record ("D" for daily, e.g., "h" or "15min" for sub-daily)
+    :param seed: int, random seed
+    :param start: str, first date
+    :param base: float, base flow
+    :param melt: float, peak of the snowmelt season above base flow
+    :param storms: float, number of storm events per year
+    :return: df, date and flow (as for .csv site sources, see csv_daily_import())
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start,pd.Timestamp(start)+pd.DateOffset(years=years),freq=freq,inclusive="left")
+    days = ((dates-dates[0])/pd.Timedelta(days=1)).values
+    steps = int(round(len(dates)/max(days[-1],1))) if len(dates)>1 else 1 # time steps per day
+    doy = dates.dayofyear.values+(days%1)
+
+    # Snowmelt season, with daily lognormal noise (held over each day)
+    flow = base+seasonality*melt*np.exp(-((doy-150)/30)**2)
+    flow = flow*np.exp(rng.normal(0,0.4,int(days[-1])+1))[days.astype(int)]
+
+    # Storm events: sudden rise, exponential recession over ~10 days
+    for i in rng.choice(len(dates),int(years*storms)):
+        n = min(10*steps,len(dates)-i)
+        flow[i:i+n] += rng.uniform(1000,6000)*np.exp(-np.arange(n)/(3*steps))
+
+    flow = np.round(flow,1)
+    if missing > 0:
+        if freq == "D":
+            flow[rng.random(len(flow)) < missing] = np.nan
+        else:
+            # Gauge outages: whole days
+            out = rng.random(int(days[-1])+1) < missing
+            flow[out[days.astype(int)]] = np.nan
+    return pd.DataFrame({"date":dates.strftime("%d-%b-%Y %H:%M" if freq!="D" else "%d-%b-%Y"),"flow":flow})
+
+def synthetic_daily(years=30,missing=0.0,seasonality=1.0,freq="D",seed=0,start="1950-10-01",wy_division="WY",
+                    decimal=1):
+    """
+    Function to create a synthetic daily record formatted as site_daily (see import_daily()); sub-daily records are
+    averaged to daily (days with missing values are missing)
+    :param years: int, record length (years)
+    :param missing: float, fraction of missing values
+    :param seasonality: float, scale of the snowmelt season
+    :param freq: str, pandas frequency of the record before averaging to daily
+    :param seed: int, random seed
+    :param start: str, first date
+    :param wy_division: str, "WY" or "CY"
+    :param decimal: int, number of decimal places to use in data
+    :return: df, site_daily
+    """
+    flow = synthetic_flow(years,missing,seasonality,freq,seed,start)
+    flow.index = pd.to_datetime(flow.pop("date"),format="%d-%b-%Y %H:%M" if freq!="D" else "%d-%b-%Y")
+    site_daily = flow.resample("D").mean(numeric_only=False) if freq!="D" else flow
+    site_daily.index.name = None
+    site_daily["flow"] = site_daily["flow"].round(decimal)
+    site_daily["doy"] = pd.DatetimeIndex(site_daily.index).dayofyear
+    site_daily["year"] = pd.DatetimeIndex(site_daily.index).year
+    site_daily["month"] = pd.DatetimeIndex(site_daily.index).month
+    site_daily["wy"] = site_daily["year"]
+    if wy_division == "WY":
+        site_daily.loc[site_daily["month"] >= 10, "wy"] = site_daily.loc[site_daily["month"] >= 10, "year"] + 1
+    return site_daily
+
+def synthetic_sites(sites=3,years=30,missing=0.0,seasonality=1.0,freq="D",seed=0,start="1950-10-01",wy_division="WY",
+                    decimal=1):
+    """
+    Function to create synthetic daily records for several sites (seed+n for site n)
+    :param sites: int, number of sites
+    :return: dict, site_daily df for each site ("site1", "site2", etc.)
+    """
+    return {f"site{n+1}":synthetic_daily(years,missing,seasonality,freq,seed+n,start,wy_division,decimal)
+            for n in range(sites)}
+
+def synthetic_rating(min_fb=200,max_fb=250,step=0.5,max_af=500000,max_qd=50000):
+    """
+    Function to create a synthetic reservoir rating (elevation, storage and discharge) for CVHS routing
+    :param min_fb: float, lowest elevation
+    :param max_fb: float, highest elevation
+    :param step: float, elevation step
+    :param max_af: float, storage at the highest elevation
+    :param max_qd: float, discharge at the highest elevation
+    :return: df, FB (elevation), AF (storage) and QD (discharge), as for rating files
+    """
+    fb = np.arange(min_fb,max_fb+step/2,step)
+    frac = (fb-min_fb)/(max_fb-min_fb)
+    return pd.DataFrame({"FB":fb.round(2),"AF":(max_af*frac**2).round(0),"QD":(max_qd*frac**1.5).round(0)})
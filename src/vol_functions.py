@@ -6,12 +6,14 @@
 This script contains the volume analysis functions and pre-defined variables used in the duration analyses 4
 
 """
+import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 import datetime as dt
-from src.functions import get_varlabel
+from src.functions import plt,mpl,get_varlabel,wy_completeness,get_daily
+from src.profile_functions import timed
+from src.engine_functions import register_engine
+from src.render_functions import register_template
 
 ### VOLUME DURATION FUNCTIONS
 def cfs2af(cfs):
@@ -22,33 +24,54 @@ def af2cfs(af):
     cfs = af / (86400 / 43560)
     return cfs
 
-def analyze_voldur(data,dur,decimal):
+flow_vars = ["flow","Flow","discharge","Discharge","inflow","Inflow","IN","in","Q","QU","cfs","CFS","qj","QJ","qd","QD"]
+
+@timed
+def analyze_voldur(data,dur,decimal,complete=None):
     """
     This function calculates a rolling mean and then identifies the ann. max. for each WY
     :param data: df, data including at least date, variable
     :param dur: int or "WY", duration to analyze
+    :param decimal: int, number of decimals to use
+    :param complete: df, output from wy_completeness() (calculated if None)
     :return: df, list of events with date, avg_flow and peak
     """
     var = data.columns[0]
     WYs = data["wy"].unique().astype(int)
     evs = pd.DataFrame(index=WYs)
+    # Centroid timing of each WY (or window), from the values of the WY (or window); columns added after the loop
+    vals = data[var].values
+    timing = dict()
     if dur=="WY":
         dur_data = None
         print('Analyzing by WY')
+        if complete is None:
+            complete = wy_completeness(data,var)
         for wy in WYs:
-            if sum(pd.isna(data.loc[data["wy"] == wy, var])) > 365*0.1:
+            if complete.loc[wy,"missing"] > 365*0.1:
                 continue
             else:
                 if dur == "WY":
                     evs.loc[wy, "annual_sum"] = round(data.loc[data["wy"] == wy, var].sum(),decimal)
-                    if var in ["flow","Flow","discharge","Discharge","inflow","Inflow","IN","in","Q","QU","cfs","CFS","qj","QJ","qd","QD"]:
+                    if var in flow_vars:
                         evs.loc[wy, "annual_acft"] = round(cfs2af(data.loc[data["wy"] == wy, var].sum()),decimal)
                     evs.loc[wy, "count"] = len(data.loc[data["wy"]==wy, var])
                     max_idx = data.loc[data["wy"] == wy, var].idxmax()
                     evs.loc[wy, "max"] = max_idx
                     evs.loc[wy, f"max_{var}"] = round(data.loc[max_idx, var],decimal)
-                    # TODO Add centroid calc
-                    #evs.loc[wy,f"centroid_{var}"] = data.loc[data["wy"] == wy].index.astype('int64')*data.loc[data["wy"] == wy, var]/data.loc[data["wy"] == wy].index.astype('int64').sum
+                    # Centroid (centre of mass) and centre of volume (half of annual volume passed)
+                    pos = np.flatnonzero(data["wy"].values==wy)
+                    start,end = pos[0],pos[-1]
+                    cum,cum_t = cum_arrays(vals[start:end+1])[0][0],cum_moment(vals[start:end+1])[0]
+                    centroid = window_centroid(cum,cum_t,np.array([0]),np.array([end-start]))[0]
+                    hit = np.flatnonzero(cum[1:] >= 0.5*cum[-1])
+                    cov_pos = start+hit[0] if len(hit)>0 else len(vals)
+                    timing[wy] = [start+centroid,round(centroid+1,2),
+                                  data.index[min(cov_pos,len(vals)-1)],cov_pos-start+1]
+        if len(timing) > 0:
+            timing = pd.DataFrame.from_dict(timing,orient="index",columns=["centroid","centroid_dowy","cov","cov_dowy"])
+            timing["centroid"] = pos_dates(data.index,timing["centroid"].values)
+            evs = evs.join(timing)
     else:
         # Calculate rolling before parsing years
         dur_data = data.copy()
@@ -62,16 +85,19 @@ def analyze_voldur(data,dur,decimal):
                 continue
             evs.loc[wy,"start"] = max_idx-dt.timedelta(days=int(dur)-1) # place date as start of window
             evs.loc[wy,f"avg_{var}"] = round(dur_data.loc[max_idx,var],decimal)
-            if var in ["flow", "Flow", "discharge", "Discharge", "inflow", "Inflow", "IN","in", "Q", "QU", "cfs", "CFS","qj","QJ","qd","QD"]:
+            if var in flow_vars:
                 evs.loc[wy,f"volume_acft"] = round(evs.loc[wy,f"avg_{var}"]*dur * 86400 / 43560,decimal)
             evs.loc[wy, "mid"] = max_idx - dt.timedelta(days=max([0,int(dur / 2) - 1]))  # place date as middle of window
             evs.loc[wy, "end"] = max_idx  # place date as end of window
             evs.loc[wy, "max"] = data.loc[evs.loc[wy, "start"]:evs.loc[wy, "end"],var].idxmax()
             evs.loc[wy,f"max_{var}"] = data.loc[evs.loc[wy,"max"],var]
             evs.loc[wy,"count"] = len(data.loc[data["wy"] == wy, var])
-            #TODO Add centroid calc
-            #evs.loc[wy, f"centroid_{var}"] = data.loc[evs.loc[wy,"start"]:evs.loc[wy,"end"]].index.astype('int64') * data.loc[evs.loc[wy,"start"]:evs.loc[wy,"end"], var] / \
-            #                                 data.loc[evs.loc[wy,"start"]:evs.loc[wy,"end"]].index.astype('int64').sum
+            # Centroid (centre of mass) of the window
+            end = data.index.get_loc(max_idx)
+            start = end-int(dur)+1
+            cum,cum_t = cum_arrays(vals[start:end+1])[0][0],cum_moment(vals[start:end+1])[0]
+            centroid = window_centroid(cum,cum_t,np.array([0]),np.array([end-start]))[0]
+            timing[wy] = [start+centroid,round(centroid+1,2)]
 
             # Check start
             if dur_data.loc[evs.loc[wy, "start"], "wy"] < wy:
@@ -81,11 +107,674 @@ def analyze_voldur(data,dur,decimal):
             if dur_data.loc[evs.loc[wy, "end"], "wy"] > wy:
                 evs.loc[wy,"warning"] = "End in next WY"
                 print(f"{wy} end in next WY. Check!!!")
+        if len(timing) > 0:
+            timing = pd.DataFrame.from_dict(timing,orient="index",columns=["centroid","centroid_days"])
+            timing["centroid"] = pos_dates(data.index,timing["centroid"].values)
+            evs = evs.join(timing)
+            # Warnings last (as analyze_voldur_multi())
+            if "warning" in evs.columns:
+                evs = evs[[c for c in evs.columns if c!="warning"]+["warning"]]
 
     # TODO: Seasonal split?
 
     return evs,dur_data
 
+def cum_arrays(vals):
+    """
+    This function prepares the cumulative sum arrays used to compute rolling means for any duration
+    :param vals: array, values (1d or 2d with one row per series)
+    :return: arrays, cumulative sum of values and cumulative count of valid values (leading zero column)
+    """
+    vals = np.atleast_2d(np.asarray(vals,dtype=float))
+    valid = ~np.isnan(vals)
+    zero = np.zeros((vals.shape[0],1))
+    cum = np.concatenate([zero,np.cumsum(np.where(valid,vals,0),axis=1)],axis=1)
+    cum_n = np.concatenate([zero,np.cumsum(valid,axis=1)],axis=1)
+    return cum,cum_n
+
+def cum_moment(vals):
+    """
+    This function prepares the cumulative sum of position x value used to compute centroids for any window
+    :param vals: array, values (1d or 2d with one row per series)
+    :return: array, cumulative sum of position x value (leading zero column)
+    """
+    vals = np.atleast_2d(np.asarray(vals,dtype=float))
+    pos = np.arange(vals.shape[1])
+    zero = np.zeros((vals.shape[0],1))
+    cum_t = np.concatenate([zero,np.cumsum(np.where(np.isnan(vals),0,vals)*pos,axis=1)],axis=1)
+    return cum_t
+
+def window_centroid(cum,cum_t,start,end):
+    """
+    This function calculates the centroid (position) of each window from cumulative sums
+    :param cum: array, cumulative sums from cum_arrays() (1d)
+    :param cum_t: array, cumulative moments from cum_moment() (1d)
+    :param start: array, position of the first day of each window
+    :param end: array, position of the last day of each window
+    :return: array, centroid position of each window (NaN where window volume is zero)
+    """
+    vol = cum[end+1]-cum[start]
+    moment = cum_t[end+1]-cum_t[start]
+    with np.errstate(divide="ignore",invalid="ignore"):
+        centroid = np.where(vol!=0,moment/vol,np.nan)
+    return centroid
+
+def rolling_mean(cum,cum_n,dur):
+    """
+    This function calculates a trailing rolling mean from cumulative sums (NaN unless all dur values are valid)
+    :param cum: array, cumulative sums from cum_arrays()
+    :param cum_n: array, cumulative valid counts from cum_arrays()
+    :param dur: int, duration (days)
+    :return: array, rolling mean aligned to the end of each window
+    """
+    n = cum.shape[1]-1
+    out = np.full((cum.shape[0],n),np.nan)
+    if dur > n:
+        return out
+    sums = cum[:,dur:]-cum[:,:-dur]
+    counts = cum_n[:,dur:]-cum_n[:,:-dur]
+    out[:,dur-1:] = np.where(counts==dur,sums/dur,np.nan)
+    return out
+
+def memo_cum(vals,memo=None,key=None):
+    """
+    This function returns the cumulative sum arrays of values (cum_arrays() and cum_moment()), from the memo if available
+    :param vals: array, values (1d or 2d with one row per series)
+    :param memo: dict, cumulative sums and rolling means from previous calls (updated), or None
+    :param key: tuple, key of the values in the memo (e.g., site, wy_division and season masks)
+    :return: arrays, cum, cum_n and cum_t
+    """
+    if memo is None:
+        return cum_arrays(vals)+(cum_moment(vals),)
+    memo.setdefault("cum",dict())
+    if key not in memo["cum"].keys():
+        memo["cum"][key] = cum_arrays(vals)+(cum_moment(vals),)
+    return memo["cum"][key]
+
+def memo_rolling(cum,cum_n,dur,memo=None,key=None):
+    """
+    This function returns the rolling mean for a duration (rolling_mean()), from the memo if available
+    :param cum: array, cumulative sums from cum_arrays()
+    :param cum_n: array, cumulative valid counts from cum_arrays()
+    :param dur: int, duration (days)
+    :param memo: dict, cumulative sums and rolling means from previous calls (updated), or None
+    :param key: tuple, key of the values in the memo (as for memo_cum())
+    :return: array, rolling mean aligned to the end of each window
+    """
+    if memo is None:
+        return rolling_mean(cum,cum_n,dur)
+    memo.setdefault("avg",dict())
+    if (key,dur) not in memo["avg"].keys():
+        memo["avg"][(key,dur)] = rolling_mean(cum,cum_n,dur)
+    return memo["avg"][(key,dur)]
+
+def wy_bounds(wy):
+    """
+    This function identifies the position of the first day of each WY (data must be sorted by date)
+    :param wy: array, wy of each day
+    :return: arrays, unique WYs, start position of each WY, and WY group number of each day
+    """
+    wy = np.asarray(wy)
+    bounds = np.concatenate([[0],np.flatnonzero(wy[1:]!=wy[:-1])+1])
+    WYs = wy[bounds].astype(int)
+    gid = np.repeat(np.arange(len(bounds)),np.diff(np.append(bounds,len(wy))))
+    return WYs,bounds,gid
+
+def group_argmax(vals,bounds,gid):
+    """
+    This function finds the position of the (first) max. value in each group, ignoring NaN
+    :param vals: array, values (2d with one row per series)
+    :param bounds: array, start position of each group
+    :param gid: array, group number of each value
+    :return: array, position of max for each series and group (-1 where no valid values)
+    """
+    filled = np.where(np.isnan(vals),-np.inf,vals)
+    gmax = np.maximum.reduceat(filled,bounds,axis=1)
+    # Tolerance avoids ties being broken by floating point noise in the cumulative sums
+    tol = 1e-9*np.maximum(np.abs(np.where(np.isfinite(gmax),gmax,0)),1)
+    hit = filled >= (gmax-tol)[:,gid]
+    pos = np.where(hit,np.arange(vals.shape[1]),vals.shape[1])
+    first = np.minimum.reduceat(pos,bounds,axis=1)
+    first[~np.isfinite(gmax)] = -1
+    return first
+
+def voldur_evs(data,vals,avg,idx,dur,WYs,bounds,decimal,cum=None,cum_t=None):
+    """
+    This function builds the analyze_voldur() table for one series and duration from the window end positions
+    :param data: df, data including at least date, variable, wy
+    :param vals: array, daily values of the series
+    :param avg: array, rolling mean of the series
+    :param idx: array, position of the window end for each WY (-1 if none)
+    :param dur: int, duration (days)
+    :param WYs: array, unique WYs
+    :param bounds: array, start position of each WY
+    :param decimal: int, number of decimals to use
+    :param cum: array, cumulative sums from cum_arrays() (1d, needed for centroid)
+    :param cum_t: array, cumulative moments from cum_moment() (1d, needed for centroid)
+    :return: df, list of events with date, avg_flow and peak
+    """
+    var = data.columns[0]
+    dates = data.index
+    ok = idx >= 0
+    end = idx[ok]
+    start = end-int(dur)+1
+    wy = data["wy"].values
+
+    evs = pd.DataFrame(index=WYs)
+    if not ok.any():
+        return evs
+
+    # Find max within each window
+    windows = np.lib.stride_tricks.sliding_window_view(vals,int(dur))[start]
+    max_pos = start+np.argmax(windows,axis=1)
+
+    # Fill columns for WYs with a valid window
+    def fill(values,dtype=float):
+        col = np.full(len(WYs),np.nan).astype(dtype)
+        col[ok] = values
+        return col
+
+    nat = "datetime64[ns]"
+    avg_val = np.round(avg[end],decimal)
+    evs["start"] = fill(dates[start].values,nat)
+    evs[f"avg_{var}"] = fill(avg_val)
+    if var in flow_vars:
+        evs["volume_acft"] = fill(np.round(avg_val*dur*86400/43560,decimal))
+    evs["mid"] = fill((dates[end]-dt.timedelta(days=max([0,int(dur/2)-1]))).values,nat)
+    evs["end"] = fill(dates[end].values,nat)
+    evs["max"] = fill(dates[max_pos].values,nat)
+    evs[f"max_{var}"] = fill(vals[max_pos])
+    evs["count"] = fill(np.diff(np.append(bounds,len(vals)))[ok])
+    if cum_t is not None:
+        centroid = window_centroid(cum,cum_t,start,end)
+        evs["centroid"] = fill(pos_dates(dates,centroid).values,nat)
+        evs["centroid_days"] = fill(np.round(centroid-start+1,2))
+
+    # Check start
+    prev = wy[start] < WYs[ok]
+    if prev.any():
+        evs.loc[WYs[ok][prev],"warning"] = "Start in previous WY"
+        for w in WYs[ok][prev]:
+            print(f"{w} start in previous WY. Check!!!")
+
+    return evs
+
+def pos_dates(dates,pos):
+    """
+    This function converts (fractional) positions in a continuous daily record to dates (nearest day)
+    :param dates: DatetimeIndex, dates of the record
+    :param pos: array, positions
+    :return: DatetimeIndex, dates
+    """
+    return dates[0]+pd.to_timedelta(np.round(pos),unit="D")
+
+def voldur_wy(data,vals,cum,cum_t,WYs,bounds,gid,decimal,complete=None):
+    """
+    This function builds the analyze_voldur() WY table, with the WY centroid and centre of volume dates, from the
+    cumulative sum arrays
+    :param data: df, data including at least date, variable, wy
+    :param vals: array, daily values of the series
+    :param cum: array, cumulative sums from cum_arrays() (1d)
+    :param cum_t: array, cumulative moments from cum_moment() (1d)
+    :param WYs: array, unique WYs
+    :param bounds: array, start position of each WY
+    :param gid: array, WY group number of each day
+    :param decimal: int, number of decimals to use
+    :param complete: df, output from wy_completeness() (calculated if None)
+    :return: df, annual sum, max and timing for each WY
+    """
+    var = data.columns[0]
+    dates = data.index
+    print('Analyzing by WY')
+    if complete is None:
+        complete = wy_completeness(data,var)
+    ends = np.append(bounds[1:],len(vals))-1
+    ok = complete.loc[WYs,"missing"].values <= 365*0.1
+    start = bounds[ok]
+    end = ends[ok]
+
+    evs = pd.DataFrame(index=WYs)
+    if not ok.any():
+        return evs
+
+    def fill(values,dtype=float):
+        col = np.full(len(WYs),np.nan).astype(dtype)
+        col[ok] = values
+        return col
+
+    nat = "datetime64[ns]"
+    total = cum[end+1]-cum[start]
+    max_pos = group_argmax(vals[None,:],bounds,gid)[0][ok]
+    evs["annual_sum"] = fill(np.round(total,decimal))
+    if var in flow_vars:
+        evs["annual_acft"] = fill(np.round(cfs2af(total),decimal))
+    evs["count"] = fill(np.diff(np.append(bounds,len(vals)))[ok])
+    evs["max"] = fill(dates[max_pos].values,nat)
+    evs[f"max_{var}"] = fill(np.round(vals[max_pos],decimal))
+
+    # Centroid (centre of mass) and centre of volume (half of annual volume passed)
+    centroid = window_centroid(cum,cum_t,start,end)
+    wy_cum = cum[1:]-cum[bounds][gid]
+    half = 0.5*(cum[ends+1]-cum[bounds])
+    hit = wy_cum >= half[gid]
+    cov_pos = np.minimum.reduceat(np.where(hit,np.arange(len(vals)),len(vals)),bounds)[ok]
+    evs["centroid"] = fill(pos_dates(dates,centroid).values,nat)
+    evs["centroid_dowy"] = fill(np.round(centroid-start+1,2))
+    evs["cov"] = fill(dates[np.minimum(cov_pos,len(vals)-1)].values,nat)
+    evs["cov_dowy"] = fill(cov_pos-start+1)
+
+    return evs
+
+@timed
+def analyze_voldur_multi(data,durations,decimal,complete=None):
+    """
+    This function calculates the ann. max. rolling mean for each WY for all durations from a single cumulative sum
+    (same output as calling analyze_voldur() for each duration, plus centroid timing)
+    :param data: df, data including at least date, variable, wy (continuous daily, sorted by date)
+    :param durations: list, durations to analyze (int or "WY")
+    :param decimal: int, number of decimals to use
+    :param complete: df, output from wy_completeness() (used for "WY")
+    :return: dict, df of events for each duration
+    """
+    var = data.columns[0]
+    vals = data[var].values.astype(float)
+    cum,cum_n = cum_arrays(vals)
+    cum_t = cum_moment(vals)
+    WYs,bounds,gid = wy_bounds(data["wy"].values)
+
+    site_voldur = dict()
+    for dur in durations:
+        if dur=="WY":
+            site_voldur[dur] = voldur_wy(data,vals,cum[0],cum_t[0],WYs,bounds,gid,decimal,complete)
+            continue
+        avg = rolling_mean(cum,cum_n,int(dur))
+        idx = group_argmax(avg,bounds,gid)[0]
+        site_voldur[dur] = voldur_evs(data,vals,avg[0],idx,dur,WYs,bounds,decimal,cum[0],cum_t[0])
+
+    return site_voldur
+
+@register_engine("volumes","multi")
+@timed
+def analyze_voldur_seasonal(data,durations,decimal,masks,memo=None,key=None):
+    """
+    This function calculates the ann. max. rolling mean for each WY for all durations and seasons in a single pass
+    (each season is treated as the data with values outside of the season set to NaN, as from season_subset())
+    :param data: df, data including at least date, variable, wy (continuous daily, sorted by date)
+    :param durations: list or dict, durations to analyze (int or "WY"), dict applies specifically to each season
+    :param decimal: int, number of decimals to use
+    :param masks: dict, boolean array for each season (output from season_masks())
+    :param memo: dict, cumulative sums and rolling means from previous calls (updated, see memo_cum()), or None
+    :param key: tuple, key of the data and masks in the memo (e.g., site, wy_division and season masks)
+    :return: dict, dict of df of events for each duration for each season
+    """
+    var = data.columns[0]
+    seasons = list(masks.keys())
+    raw = data[var].values.astype(float)
+    vals = np.vstack([np.where(masks[season],raw,np.nan) for season in seasons])
+    cum,cum_n,cum_t = memo_cum(vals,memo,key)
+    WYs,bounds,gid = wy_bounds(data["wy"].values)
+
+    # Find all durations needed by any season
+    if isinstance(durations,dict):
+        season_durs = {season:durations[season] for season in seasons}
+    else:
+        season_durs = {season:durations for season in seasons}
+    all_durs = list()
+    for season in seasons:
+        for dur in season_durs[season]:
+            if dur not in all_durs:
+                all_durs.append(dur)
+
+    seasonal_voldur = {season:dict() for season in seasons}
+    for dur in all_durs:
+        if dur=="WY":
+            for i,season in enumerate(seasons):
+                if dur in season_durs[season]:
+                    season_data = data.copy()
+                    season_data[var] = vals[i]
+                    seasonal_voldur[season][dur] = voldur_wy(season_data,vals[i],cum[i],cum_t[i],WYs,bounds,gid,decimal)
+            continue
+        avg = memo_rolling(cum,cum_n,int(dur),memo,key)
+        idx = group_argmax(avg,bounds,gid)
+        for i,season in enumerate(seasons):
+            if dur in season_durs[season]:
+                seasonal_voldur[season][dur] = voldur_evs(data,vals[i],avg[i],idx[i],dur,WYs,bounds,decimal,cum[i],cum_t[i])
+
+    return seasonal_voldur
+
+def voldur_surface(data,durations=range(1,366),decimal=None):
+    """
+    This function calculates the ann. max. rolling mean for each WY and every duration from a single cumulative sum
+    :param data: df, data including at least date, variable, wy (continuous daily, sorted by date)
+    :param durations: list, durations to analyze (int)
+    :param decimal: int, number of decimals to use (None for no rounding)
+    :return: df, ann. max. average values (WY x duration)
+    """
+    var = data.columns[0]
+    cum,cum_n = cum_arrays(data[var].values)
+    WYs,bounds,gid = wy_bounds(data["wy"].values)
+
+    surface = np.full((len(WYs),len(durations)),np.nan)
+    for d,dur in enumerate(durations):
+        avg = rolling_mean(cum,cum_n,int(dur))[0]
+        amax = np.maximum.reduceat(np.where(np.isnan(avg),-np.inf,avg),bounds)
+        surface[:,d] = np.where(np.isfinite(amax),amax,np.nan)
+    if decimal is not None:
+        surface = np.round(surface,decimal)
+
+    surface = pd.DataFrame(surface,index=pd.Index(WYs,name="wy"),columns=pd.Index(list(durations),name="dur"))
+    return surface
+
+def surface_pp(surface,alpha=0):
+    """
+    This function calculates the plotting position of each WY for every duration of the surface
+    :param surface: df, output from voldur_surface()
+    :param alpha: float, value used in plotting positions
+    :return: df, plotting positions (WY x duration)
+    """
+    vals = surface.values
+    n = np.sum(~np.isnan(vals),axis=0)
+    # Rank in descending order (NaN ranked last)
+    order = np.argsort(np.where(np.isnan(vals),np.inf,-vals),axis=0,kind="stable")
+    rank = np.empty_like(order)
+    np.put_along_axis(rank,order,np.arange(1,len(vals)+1)[:,None].repeat(vals.shape[1],axis=1),axis=0)
+    pp = (rank-alpha)/(n+1-2*alpha)
+    pp = np.where(np.isnan(vals),np.nan,pp)
+    return pd.DataFrame(pp,index=surface.index,columns=surface.columns)
+
+def query_surface(surface,pp,dur,aep):
+    """
+    This function looks up the ann. max. average value for any duration and AEP by linear interpolation
+    (between plotting positions, then between durations; values outside the record are held at the ends)
+    :param surface: df, output from voldur_surface()
+    :param pp: df, output from surface_pp()
+    :param dur: float or array, duration(s) (days)
+    :param aep: float or array, annual exceedance probability(s)
+    :return: float or array, interpolated value(s)
+    """
+    scalar = np.isscalar(dur) and np.isscalar(aep)
+    dur,aep = np.broadcast_arrays(np.atleast_1d(np.asarray(dur,dtype=float)),np.atleast_1d(np.asarray(aep,dtype=float)))
+    durs = np.asarray(surface.columns,dtype=float)
+
+    # Interpolate each needed duration column along AEP
+    hi = np.clip(np.searchsorted(durs,dur),0,len(durs)-1)
+    lo = np.clip(hi-1,0,len(durs)-1)
+    lo = np.where(durs[hi]<=dur,hi,lo)
+    col_vals = dict()
+    for c in np.unique(np.concatenate([lo,hi])):
+        ok = ~np.isnan(surface.iloc[:,c].values)
+        x = pp.iloc[:,c].values[ok]
+        y = surface.iloc[:,c].values[ok]
+        order = np.argsort(x)
+        col_vals[c] = np.interp(aep,x[order],y[order])
+
+    # Interpolate between durations
+    y_lo = np.empty(dur.shape)
+    y_hi = np.empty(dur.shape)
+    for c in col_vals.keys():
+        y_lo[lo==c] = col_vals[c][lo==c]
+        y_hi[hi==c] = col_vals[c][hi==c]
+    span = np.where(hi==lo,1,durs[hi]-durs[lo])
+    out = y_lo+(dur-durs[lo])*(y_hi-y_lo)/span
+
+    if scalar:
+        return out.item()
+    return out
+
+def voldur_data(data,dur):
+    """
+    This function returns a copy of the data with the variable replaced by its rolling mean (as from analyze_voldur())
+    :param data: df, data including at least date, variable
+    :param dur: int, duration (days)
+    :return: df, rolling data
+    """
+    var = data.columns[0]
+    dur_data = data.copy()
+    cum,cum_n = cum_arrays(dur_data[var].values)
+    dur_data[var] = rolling_mean(cum,cum_n,int(dur))[0]
+    return dur_data
+
+def voldur_series(data,durations):
+    """
+    This function returns the rolling mean for all durations from a single cumulative sum (one column per duration)
+    :param data: df, data including at least date, variable
+    :param durations: list, durations (days); "WY" and "peak" are ignored
+    :return: df, rolling data (index dates, columns durations)
+    """
+    var = data.columns[0]
+    cum,cum_n = cum_arrays(data[var].values)
+    series = dict()
+    for dur in durations:
+        if dur in ["WY","peak"]:
+            continue
+        series[str(dur)] = rolling_mean(cum,cum_n,int(dur))[0]
+    return pd.DataFrame(series,index=data.index)
+
+def save_voldur_series(series,filename):
+    """
+    This function saves rolling series in a single compressed file (parquet if available, otherwise gzip csv)
+    :param series: df, output from voldur_series()
+    :param filename: str, file path without extension
+    :return: str, file path saved
+    """
+    series = series.astype(np.float32)
+    try:
+        series.to_parquet(f"{filename}.parquet",compression="gzip")
+        return f"{filename}.parquet"
+    except ImportError:
+        series.to_csv(f"{filename}.csv.gz",compression="gzip")
+        return f"{filename}.csv.gz"
+
+def load_voldur_series(site,durations,s="",data=None):
+    """
+    This function loads rolling series saved by script 4 (regenerated from site_daily if not saved or incomplete)
+    :param site: str, site name
+    :param durations: list, durations (days)
+    :param s: str, season suffix (e.g., "_spring")
+    :param data: df, daily data for the season (loaded from site_daily if None)
+    :return: df, rolling data (index dates, columns durations)
+    """
+    cols = [str(dur) for dur in durations if dur not in ["WY","peak"]]
+    filename = f"{site}/volume/{site}{s}_series"
+    series = None
+    if os.path.isfile(f"{filename}.parquet"):
+        series = pd.read_parquet(f"{filename}.parquet")
+    elif os.path.isfile(f"{filename}.csv.gz"):
+        series = pd.read_csv(f"{filename}.csv.gz",index_col=0,parse_dates=True)
+    if series is not None and all([col in series.columns for col in cols]):
+        return series[cols]
+
+    # Regenerate from daily data
+    if data is None:
+        data = get_daily(site,s)
+    return voldur_series(data,cols)
+
+def concat_tables(tables,fill_index=True):
+    """
+    This function combines tables (e.g., durations or sites) side by side with a single concat
+    :param tables: dict, df for each key (first column level)
+    :param fill_index: boolean, include every WY between the first and last WY
+    :return: df, combined table with ("dur","col") multiindex columns
+    """
+    tables = {key:table for key,table in tables.items() if table is not None and not table.empty}
+    if len(tables)==0:
+        return pd.DataFrame()
+    combined = pd.concat(tables,axis=1,names=["dur","col"]).sort_index()
+    if fill_index:
+        combined = combined.reindex(pd.Index(range(int(combined.index.min()),int(combined.index.max())+1)))
+    return combined
+
+### LOW FLOW FUNCTIONS
+def climatic_year(dates,start_month=4):
+    """
+    This function labels each date with its climatic year (designated by the calendar year in which it ends, as WY)
+    :param dates: DatetimeIndex, dates
+    :param start_month: int, first month of the climatic year (4 for April-March, 10 for WY, 1 for CY)
+    :return: array, climatic year of each date
+    """
+    year = np.asarray(dates.year)
+    if start_month==1:
+        return year
+    return np.where(np.asarray(dates.month)>=start_month,year+1,year)
+
+def group_argmin(vals,bounds,gid):
+    """
+    This function finds the position of the (first) min. value in each group, ignoring NaN
+    :param vals: array, values (2d with one row per series)
+    :param bounds: array, start position of each group
+    :param gid: array, group number of each value
+    :return: array, position of min for each series and group (-1 where no valid values)
+    """
+    return group_argmax(-vals,bounds,gid)
+
+def lowflow_bounds(data,start_month=4,max_missing=0.1):
+    """
+    This function identifies the climatic years of the data and which are complete enough for low flow statistics
+    :param data: df, data including at least date, variable (continuous daily, sorted by date)
+    :param start_month: int, first month of the climatic year
+    :param max_missing: float, max. fraction of 365 days missing for a year to be used
+    :return: arrays, unique years, start position of each year, year group number of each day, valid count, use
+    """
+    var = data.columns[0]
+    CYs,bounds,gid = wy_bounds(climatic_year(data.index,start_month))
+    count = np.add.reduceat(data[var].notna().values.astype(int),bounds)
+    use = count >= 365*(1-max_missing)
+    return CYs,bounds,gid,count,use
+
+def analyze_lowflow_multi(data,durations,decimal,start_month=4,max_missing=0.1,alpha=0,memo=None,key=None):
+    """
+    This function calculates the ann. min. rolling mean for each climatic year for all durations from a single
+    cumulative sum (low flow analog of analyze_voldur_multi())
+    :param data: df, data including at least date, variable (continuous daily, sorted by date)
+    :param durations: list, durations to analyze (int)
+    :param decimal: int, number of decimals to use
+    :param start_month: int, first month of the climatic year (4 for April-March)
+    :param max_missing: float, max. fraction of 365 days missing for a year to be used
+    :param alpha: float, value used in plotting positions
+    :param memo: dict, cumulative sums and rolling means from previous calls (updated, see memo_cum()), or None
+    :param key: tuple, key of the data in the memo (e.g., site and wy_division)
+    :return: dict, df of events for each duration (with non-exceedance plotting position)
+    """
+    var = data.columns[0]
+    dates = data.index
+    vals = data[var].values.astype(float)
+    cum,cum_n = memo_cum(vals,memo,key)[:2]
+    CYs,bounds,gid,count,use = lowflow_bounds(data,start_month,max_missing)
+    cy = CYs[gid]
+
+    site_lowflow = dict()
+    for dur in durations:
+        dur = int(dur)
+        avg = memo_rolling(cum,cum_n,dur,memo,key)
+        idx = group_argmin(avg,bounds,gid)[0]
+        evs = pd.DataFrame(index=pd.Index(CYs,name="cy"))
+        ok = (idx >= 0) & use
+        end = idx[ok]
+        start = end-dur+1
+
+        def fill(values,dtype=float):
+            col = np.full(len(CYs),np.nan).astype(dtype)
+            col[ok] = values
+            return col
+
+        nat = "datetime64[ns]"
+        evs["start"] = fill(dates[start].values,nat)
+        evs[f"avg_{var}"] = fill(np.round(avg[0][end],decimal))
+        evs["end"] = fill(dates[end].values,nat)
+        if ok.any():
+            windows = np.lib.stride_tricks.sliding_window_view(vals,dur)[start]
+            min_pos = start+np.argmin(windows,axis=1)
+            evs["min"] = fill(dates[min_pos].values,nat)
+            evs[f"min_{var}"] = fill(vals[min_pos])
+        else:
+            evs["min"] = pd.NaT
+            evs[f"min_{var}"] = np.nan
+        # Valid days of the climatic year (count in the volume tables is the days of the WY)
+        evs["valid_days"] = count
+
+        # Non-exceedance plotting position
+        evs["pp"] = surface_pp(-evs[[f"avg_{var}"]],alpha).iloc[:,0]
+
+        # Check start
+        prev = cy[start] < CYs[ok]
+        if prev.any():
+            evs.loc[CYs[ok][prev],"warning"] = "Start in previous year"
+        site_lowflow[dur] = evs
+
+    return site_lowflow
+
+def lowflow_surface(data,durations=range(1,366),start_month=4,max_missing=0.1,decimal=None,memo=None,key=None):
+    """
+    This function calculates the ann. min. rolling mean for each climatic year and every duration from a single
+    cumulative sum (years with too much missing data are NaN)
+    :param data: df, data including at least date, variable (continuous daily, sorted by date)
+    :param durations: list, durations to analyze (int)
+    :param start_month: int, first month of the climatic year
+    :param max_missing: float, max. fraction of 365 days missing for a year to be used
+    :param decimal: int, number of decimals to use (None for no rounding)
+    :param memo: dict, cumulative sums from previous calls (updated, see memo_cum()), or None
+    :param key: tuple, key of the data in the memo (as for analyze_lowflow_multi())
+    :return: df, ann. min. average values (climatic year x duration)
+    """
+    var = data.columns[0]
+    cum,cum_n = memo_cum(data[var].values.astype(float),memo,key)[:2]
+    CYs,bounds,gid,count,use = lowflow_bounds(data,start_month,max_missing)
+
+    surface = np.full((len(CYs),len(durations)),np.nan)
+    for d,dur in enumerate(durations):
+        avg = rolling_mean(cum,cum_n,int(dur))[0]
+        amin = np.minimum.reduceat(np.where(np.isnan(avg),np.inf,avg),bounds)
+        surface[:,d] = np.where(np.isfinite(amin)&use,amin,np.nan)
+    if decimal is not None:
+        surface = np.round(surface,decimal)
+
+    surface = pd.DataFrame(surface,index=pd.Index(CYs,name="cy"),columns=pd.Index(list(durations),name="dur"))
+    return surface
+
+def lowflow_stats(surface,return_periods=[2,10],method="lp3",min_years=10):
+    """
+    This function estimates the n-day, T-year low flow (e.g., 7Q10) for each duration of a low flow surface
+    :param surface: df, output from lowflow_surface()
+    :param return_periods: list, return periods (years); non-exceedance probability is 1/T
+    :param method: str, "lp3" (log-Pearson type III, conditional probability adjustment for zeros) or "empirical"
+    :param min_years: int, min. number of years required
+    :return: df, low flow for each duration (rows) and return period (columns, e.g., "Q10"), plus N (and N_nonzero for
+    "lp3"); zero if the non-exceedance probability is within the zero years, NaN if fewer than 3 nonzero years remain
+    to fit
+    """
+    from scipy.stats import pearson3,skew
+
+    stats = pd.DataFrame(index=surface.columns)
+    for dur in surface.columns:
+        mins = surface[dur].dropna().values
+        stats.loc[dur,"N"] = len(mins)
+        if method!="empirical":
+            stats.loc[dur,"N_nonzero"] = (mins>0).sum()
+        for T in return_periods:
+            p = 1/T
+            if len(mins) < min_years:
+                q = np.nan
+            elif method=="empirical":
+                sorted_mins = np.sort(mins)
+                pp = np.arange(1,len(mins)+1)/(len(mins)+1)
+                q = np.interp(p,pp,sorted_mins)
+            else:
+                nonzero = mins[mins>0]
+                frac0 = 1-len(nonzero)/len(mins)
+                p_adj = (p-frac0)/(1-frac0) if frac0 < 1 else 0
+                if p_adj <= 0:
+                    q = 0
+                elif len(nonzero) < 3:
+                    q = np.nan
+                else:
+                    logs = np.log10(nonzero)
+                    k = pearson3.ppf(p_adj,skew(logs,bias=False))
+                    q = 10**(logs.mean()+k*logs.std(ddof=1))
+            stats.loc[dur,f"Q{T}"] = q
+    stats.index.name = "dur"
+    return stats
+
+### VOLUME DURATION PLOT FUNCTIONS
 def init_voldurplot(data,wy=None):
     """
 
@@ -131,4 +820,65 @@ def plot_voldur(s,wy,site_dur,durations):
             if s is None:
                 plt.plot([idx_s,idx_s,idx_e,idx_e],[0,avg_val,avg_val,0],label=f"{dur}-day {var}",alpha=0.75)
             else:
-                plt.plot([idx_s, idx_s, idx_e, idx_e], [0, avg_val, avg_val, 0], label=f"{s} {dur}-day {var}",alpha=0.75)
\ No newline at end of file
+                plt.plot([idx_s, idx_s, idx_e, idx_e], [0, avg_val, avg_val, 0], label=f"{s} {dur}-day {var}",alpha=0.75)
+
+def plot_voldur_wy(data,wy,s,site_dur,durations,peak=None):
+    """
+    This function produces the WY plot of flows, all durations and the peak (script 4)
+    :param data: df, flow timeseries (at least the WY)
+    :param wy: int, selected wy
+    :param s: str, season label (or None)
+    :param site_dur: list, contains dfs, output from analyze_voldur() for each duration listed in durations (at least the WY)
+    :param durations: list, durations to plot
+    :param peak: list, date and peak of the WY, or None
+    :return: figure
+    """
+    init_voldurplot(data,wy)
+    plot_voldur(s,wy,site_dur,durations)
+    if peak is not None:
+        plt.plot(peak[0],peak[1],marker="x",linewidth=0,label=f"{s} Peak")
+    plt.legend()
+
+@register_template(plot_voldur_wy)
+def update_voldur_wy(fig,data,wy,s,site_dur,durations,peak=None):
+    """
+    This function updates a WY plot (from plot_voldur_wy()) with the flows, durations and peak of another WY
+    :param fig: figure, output from plot_voldur_wy()
+    :return: boolean, False if the lines differ (e.g., no peak or a missing duration)
+    """
+    ax = fig.axes[0]
+    var = data.columns[0]
+    dates = data.index[data["wy"]==wy]
+    labels,xys = [var],[(dates,data.loc[dates,var])]
+    for d in range(0,len(durations)):
+        dur = durations[d]
+        if dur=="WY":
+            continue
+        evs = site_dur[d]
+        dvar = evs.columns[1]
+        if pd.isna(evs.loc[wy,:]).all():
+            continue
+        idx_s,idx_e,avg_val = evs.loc[wy,"start"],evs.loc[wy,"end"],evs.loc[wy,dvar]
+        labels.append(f"{dur}-day {dvar}" if s is None else f"{s} {dur}-day {dvar}")
+        xys.append(([idx_s,idx_s,idx_e,idx_e],[0,avg_val,avg_val,0]))
+    if peak is not None:
+        labels.append(f"{s} Peak")
+        xys.append(([peak[0]],[peak[1]]))
+    if [line.get_label() for line in ax.lines] != labels:
+        return False
+    for line,(x,y) in zip(ax.lines,xys):
+        line.set_data(x,y)
+    ax.set_title(wy)
+    ax.relim()
+    ax.autoscale_view()
+    return True
+
+def voldur_wy_spec(data,wy,s,site_dur,durations,peak=None):
+    """
+    This function selects the data of a WY for plot_voldur_wy() (e.g., to send to a render process)
+    :return: dict, keyword arguments of plot_voldur_wy()
+    """
+    var = data.columns[0]
+    site_dur = [None if dur=="WY" else evs.loc[[wy]] for dur,evs in zip(durations,site_dur)]
+    return {"data":data.loc[data["wy"]==wy,[var,"wy"]],"wy":wy,"s":s,"site_dur":site_dur,"durations":durations,
+            "peak":peak}